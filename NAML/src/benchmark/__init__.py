@@ -0,0 +1,4 @@
+"""
+Benchmarks, run from the `NAML` directory, e.g.
+    PYTHONPATH=src python3 -m benchmark.parse_behaviors
+"""
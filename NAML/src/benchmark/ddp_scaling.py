@@ -0,0 +1,106 @@
+"""
+Data-parallel training throughput on CPU with 1/2/4/8 gloo processes, on the
+same synthetic data. Cores are split evenly between processes, as torchrun
+would with OMP_NUM_THREADS set, so the numbers show how well the ranks'
+gradient all-reduce overlaps with compute. Ranks read their data as
+`train` does, through `ResumableSampler`, or with `--shards` through
+`ShardDataset` of shards compiled from the same data.
+
+    PYTHONPATH=src python3 -m benchmark.ddp_scaling --processes 1 2 4 8
+"""
+import argparse
+import os
+import tempfile
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+
+from benchmark.synthetic import generate, train_steps
+from train import Model, config
+from dataset import BaseDataset, ResumableSampler, ShardDataset
+from data_preprocess import compile_shards
+
+
+def run(rank, world_size, port, manifest, steps, warmup_steps, shards,
+        results):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    torch.set_num_threads(max(1, os.cpu_count() // world_size))
+    for key, value in manifest.items():
+        setattr(config, key, value)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+
+    torch.manual_seed(0)
+    model = Model(config)
+    if shards:
+        dataset = ShardDataset('data/train/shards',
+                               'data/train/news_parsed.tsv',
+                               config.shuffle_seed, world_size, rank)
+        dataloader = iter(
+            DataLoader(dataset,
+                       batch_size=None,
+                       num_workers=config.num_workers))
+    else:
+        dataset = BaseDataset('data/train/behaviors_parsed.tsv',
+                              'data/train/news_parsed.tsv')
+        dataloader = iter(
+            DataLoader(dataset,
+                       batch_size=config.batch_size,
+                       sampler=ResumableSampler(dataset, config.shuffle_seed,
+                                                world_size, rank),
+                       num_workers=config.num_workers,
+                       drop_last=True))
+
+    # Ranks step in lockstep, all-reducing gradients at every step
+    seconds, _, _ = train_steps(model,
+                                dataloader,
+                                steps,
+                                warmup_steps,
+                                forward_model=DistributedDataParallel(model))
+    if rank == 0:
+        results[world_size] = config.batch_size * world_size / seconds
+    dist.destroy_process_group()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--warmup-steps', type=int, default=2)
+    parser.add_argument('--port', type=int, default=29511)
+    parser.add_argument('--shards',
+                        action='store_true',
+                        help='read compiled shards instead of BaseDataset')
+    args = parser.parse_args()
+
+    results = mp.Manager().dict()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        # Enough for every rank of the largest run to take all its steps
+        manifest = generate(
+            directory,
+            num_impressions=((args.warmup_steps + args.steps) *
+                             config.batch_size * max(args.processes), 500))
+        if args.shards:
+            compile_shards('data/train/behaviors_packed', 'data/train/shards',
+                           config.batch_size, seed=config.shuffle_seed)
+        for world_size in args.processes:
+            mp.spawn(run,
+                     args=(world_size, args.port + world_size, manifest,
+                           args.steps, args.warmup_steps, args.shards,
+                           results),
+                     nprocs=world_size)
+
+    baseline = results[args.processes[0]] / args.processes[0]
+    for world_size in args.processes:
+        samples_per_second = results[world_size]
+        print(f'{world_size:>2} processes: {samples_per_second:8.1f} samples/sec '
+              f'({samples_per_second / baseline:.2f}x, efficiency '
+              f'{samples_per_second / baseline / world_size:.0%})')
+
+
+if __name__ == '__main__':
+    main()
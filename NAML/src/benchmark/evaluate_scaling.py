@@ -0,0 +1,56 @@
+"""
+Evaluation throughput with 1/2/4/8 processes scoring shards of the same
+synthetic validation split (`evaluate` with num_workers), and the metrics,
+which should not depend on the number of processes. Time includes encoding
+news and starting the processes.
+
+    PYTHONPATH=src python3 -m benchmark.evaluate_scaling --processes 1 2 4 8
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import torch
+
+from benchmark.synthetic import generate
+from train import Model, config, device
+from evaluate import evaluate
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--impressions', type=int, default=50000)
+    parser.add_argument('--chunk-size', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        for key, value in generate(directory,
+                                   num_impressions=(1000, args.impressions),
+                                   seed=args.seed).items():
+            setattr(config, key, value)
+        torch.manual_seed(args.seed)
+        model = Model(config).to(device).eval()
+        for num_workers in args.processes:
+            start = time.time()
+            metrics = evaluate(model,
+                               './data/val',
+                               num_workers,
+                               chunk_size=args.chunk_size)
+            results[num_workers] = (args.impressions / (time.time() - start),
+                                    metrics)
+
+    baseline = results[args.processes[0]][0] / args.processes[0]
+    for num_workers, (impressions_per_second, metrics) in results.items():
+        print(f'{num_workers:>2} processes: {impressions_per_second:8.1f} '
+              f'impressions/sec ({impressions_per_second / baseline:.2f}x, '
+              f'efficiency {impressions_per_second / baseline / num_workers:.0%}), '
+              'AUC/MRR/nDCG@5/nDCG@10 ' + ' '.join(f'{x:.4f}' for x in metrics))
+
+
+if __name__ == '__main__':
+    main()
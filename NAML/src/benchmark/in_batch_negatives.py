@@ -0,0 +1,82 @@
+"""
+Compare training throughput and validation AUC of sampled negatives only
+with `config.in_batch_negatives`, for several K (`negative_sampling_ratio`,
+each preprocessed separately) on the same synthetic data.
+
+    PYTHONPATH=src python3 -m benchmark.in_batch_negatives --steps 50 --k 2 1
+"""
+import argparse
+import os
+import tempfile
+
+import torch
+from torch.utils.data import DataLoader
+
+from benchmark.synthetic import generate, train_steps
+from train import Model, config, device, evaluate
+from dataset import BaseDataset
+
+
+def run(steps, warmup_steps, in_batch_negatives, seed):
+    """
+    Returns:
+        samples/sec after warmup, negatives per positive, validation AUC
+    """
+    config.in_batch_negatives = in_batch_negatives
+    torch.manual_seed(seed)
+    model = Model(config).to(device)
+    dataset = BaseDataset('data/train/behaviors_parsed.tsv',
+                          'data/train/news_parsed.tsv')
+    dataloader = iter(
+        DataLoader(dataset,
+                   batch_size=config.batch_size,
+                   shuffle=False,
+                   drop_last=True))
+
+    seconds, _, _ = train_steps(model, dataloader, steps, warmup_steps)
+    samples_per_second = config.batch_size / seconds
+    # Scored against all candidates of the minibatch but its own positive
+    negatives = (config.batch_size * (1 + config.negative_sampling_ratio) -
+                 1 if in_batch_negatives else config.negative_sampling_ratio)
+
+    model.eval()
+    auc = evaluate(model, './data/val', 1)[0]
+    return samples_per_second, negatives, auc
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--k', type=int, nargs='+', default=[2, 1])
+    parser.add_argument('--steps', type=int, default=50)
+    parser.add_argument('--warmup-steps', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for K in args.k:
+            # Training samples depend on K, so each K is preprocessed apart
+            os.chdir(tempfile.mkdtemp(dir=directory))
+            config.negative_sampling_ratio = K
+            for key, value in generate(
+                    os.getcwd(),
+                    num_impressions=((args.warmup_steps + args.steps) *
+                                     config.batch_size * 2, 1000),
+                    seed=args.seed).items():
+                setattr(config, key, value)
+            for in_batch_negatives in [False, True]:
+                name = f'K={K}' + (' in-batch' if in_batch_negatives else '')
+                results[name] = run(args.steps, args.warmup_steps,
+                                    in_batch_negatives, args.seed)
+            os.chdir(directory)
+
+    baseline = next(iter(results.values()))
+    for name, (samples_per_second, negatives, auc) in results.items():
+        print(f'{name:>15}: {samples_per_second:8.1f} samples/sec '
+              f'({samples_per_second / baseline[0]:.2f}x), '
+              f'{negatives:4d} negatives per positive, '
+              f'AUC {auc:.4f} ({auc - baseline[2]:+.4f})')
+
+
+if __name__ == '__main__':
+    main()
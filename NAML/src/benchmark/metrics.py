@@ -0,0 +1,65 @@
+"""
+Compare `impression_metrics` with `calculate_single_user_metric` mapped over a
+process pool, as `evaluate` did, on random ragged impressions: time and the
+largest difference of per-impression metrics.
+
+    PYTHONPATH=src python3 -m benchmark.metrics --impressions 100000
+"""
+import argparse
+import time
+import warnings
+from multiprocessing import Pool
+
+import numpy as np
+
+from evaluate import calculate_single_user_metric
+from metrics import impression_metrics
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--impressions', type=int, default=100000)
+    parser.add_argument('--max-candidates', type=int, default=60)
+    parser.add_argument('--num-workers', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    offsets = np.r_[0,
+                    np.cumsum(
+                        rng.integers(2,
+                                     args.max_candidates,
+                                     size=args.impressions))]
+    y_true = (rng.random(offsets[-1]) < 0.1).astype(np.int8)
+    y_score = rng.random(offsets[-1])
+
+    start = time.perf_counter()
+    tasks = list(
+        zip(np.split(y_true.astype(np.int64), offsets[1:-1]),
+            np.split(y_score, offsets[1:-1])))
+    with warnings.catch_warnings():
+        # Single-class impressions
+        warnings.simplefilter('ignore')
+        with Pool(processes=args.num_workers) as pool:
+            pool_result = np.array(
+                pool.map(calculate_single_user_metric, tasks))
+    pool_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    auc, mrr, ndcg = impression_metrics(y_true, y_score, offsets)
+    vectorized_seconds = time.perf_counter() - start
+    vectorized_result = np.stack([auc, mrr, ndcg[5], ndcg[10]], axis=1)
+
+    # Impressions with both classes, which are the ones averaged
+    both = ~np.isnan(vectorized_result[:, 0])
+    difference = np.abs(vectorized_result[both] - pool_result[both]).max(axis=0)
+    print(f'{args.impressions} impressions, {offsets[-1]} candidates')
+    print(f'      pool: {pool_seconds:8.3f} s')
+    print(f'vectorized: {vectorized_seconds:8.3f} s '
+          f'({pool_seconds / vectorized_seconds:.1f}x)')
+    print('max difference (AUC, MRR, nDCG@5, nDCG@10): ' +
+          ', '.join(f'{x:.1e}' for x in difference))
+
+
+if __name__ == '__main__':
+    main()
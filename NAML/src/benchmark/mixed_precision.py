@@ -0,0 +1,83 @@
+"""
+Compare training throughput and validation AUC of the fp32 eager loop with
+`config.autocast_dtype` / `config.compile_model`, on the same synthetic
+subset in the same order.
+
+    PYTHONPATH=src python3 -m benchmark.mixed_precision --autocast bfloat16 --compile model
+"""
+import argparse
+import os
+import tempfile
+
+import torch
+from torch.utils.data import DataLoader
+
+from benchmark.synthetic import generate, train_steps
+from train import Model, compile_module, config, device, evaluate
+from dataset import BaseDataset
+
+
+def run(steps, warmup_steps, autocast, compile_model, seed):
+    """
+    Returns:
+        samples/sec after warmup, validation AUC
+    """
+    config.autocast_dtype = autocast
+    config.compile_model = compile_model
+    torch.manual_seed(seed)
+    model = Model(config).to(device)
+    if config.compile_model is not None:
+        compile_module(model if config.compile_model ==
+                       'model' else model.news_encoder)
+    dataset = BaseDataset('data/train/behaviors_parsed.tsv',
+                          'data/train/news_parsed.tsv')
+    # Same subset in the same order for every run
+    dataloader = iter(
+        DataLoader(dataset,
+                   batch_size=config.batch_size,
+                   shuffle=False,
+                   drop_last=True))
+
+    seconds, _, _ = train_steps(model, dataloader, steps, warmup_steps)
+    samples_per_second = config.batch_size / seconds
+
+    model.eval()
+    auc = evaluate(model, './data/val', 1)[0]
+    return samples_per_second, auc
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--autocast', default='bfloat16')
+    parser.add_argument('--compile', default=None)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--warmup-steps', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        for key, value in generate(
+                directory,
+                num_impressions=((args.warmup_steps + args.steps) *
+                                 config.batch_size, 500)).items():
+            setattr(config, key, value)
+        results = {
+            name: run(args.steps, args.warmup_steps, autocast, compile_model,
+                      args.seed)
+            for name, autocast, compile_model in [
+                ('fp32 eager', None, None),
+                (f'{args.autocast} compile={args.compile}', args.autocast,
+                 args.compile),
+            ]
+        }
+
+    baseline = results['fp32 eager']
+    for name, (samples_per_second, auc) in results.items():
+        print(f'{name:>30}: {samples_per_second:8.1f} samples/sec '
+              f'({samples_per_second / baseline[0]:.2f}x), '
+              f'AUC {auc:.4f} ({auc - baseline[1]:+.4f})')
+
+
+if __name__ == '__main__':
+    main()
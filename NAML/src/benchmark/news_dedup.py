@@ -0,0 +1,67 @@
+"""
+Measure the news encoder work saved by `config.deduplicate_news` on
+preprocessed data (packed behaviors and news store must exist).
+
+    PYTHONPATH=src python3 -m benchmark.news_dedup --data ./data/train
+"""
+import argparse
+from os import path
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from torch.utils.flop_counter import FlopCounterMode
+
+from dataset import BaseDataset, config
+from model.NAML import NAML
+
+
+def news_encoder_flops(model):
+    """
+    Forward FLOPs of encoding one news.
+    """
+    news = model.gather_news(torch.ones(1, dtype=torch.long))
+    with FlopCounterMode(display=False) as counter:
+        model.news_encoder(news)
+    return counter.get_total_flops()
+
+
+@torch.no_grad()
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default='./data/train')
+    parser.add_argument('--batches', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=config.batch_size)
+    args = parser.parse_args()
+
+    config.news_table = 'device'
+    config.deduplicate_news = True
+    dataset = BaseDataset(path.join(args.data, 'behaviors_parsed.tsv'),
+                          path.join(args.data, 'news_parsed.tsv'))
+    assert dataset.behaviors_packed is not None, 'Run `pack_behaviors` first'
+    model = NAML(config).eval()
+    model.set_news_table(dataset.news_store)
+    flops = news_encoder_flops(model)
+
+    slots, unique = [], []
+    dataloader = DataLoader(dataset,
+                            batch_size=args.batch_size,
+                            shuffle=True,
+                            drop_last=True)
+    for i, minibatch in enumerate(dataloader):
+        if i == args.batches:
+            break
+        model(minibatch['candidate_news'], minibatch['clicked_news'])
+        slots.append(model.num_news_encoded[0])
+        unique.append(model.num_news_encoded[1])
+
+    slots, unique = np.array(slots), np.array(unique)
+    print(f'{len(slots)} batches of {args.batch_size}')
+    print(f'news per batch: {slots.mean():.1f}, distinct: {unique.mean():.1f}')
+    print(f'encoder GFLOPs per batch: {slots.mean() * flops / 1e9:.2f} -> '
+          f'{unique.mean() * flops / 1e9:.2f}, '
+          f'{1 - unique.sum() / slots.sum():.1%} saved')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Compare `parse_behaviors` against the row-by-row implementation it replaced.
+
+Negatives are shuffled with a numpy Generator instead of `random.shuffle`, so
+which negatives get sampled differs from the old implementation. Everything
+else (user2int, rows, users, histories, positives, labels) must be identical,
+and the sampled negatives must be unused negatives of the same impression.
+Chunked parsing is timed too, `tests/test_parse_behaviors.py` checks that its
+output is the same as in-memory parsing.
+
+    PYTHONPATH=src python3 -m benchmark.parse_behaviors --impressions 200000
+"""
+import argparse
+import filecmp
+import random
+import tempfile
+import time
+from os import path
+
+import pandas as pd
+from tqdm import tqdm
+
+from benchmark.synthetic import write_behaviors
+from data_preprocess import config, parse_behaviors
+
+
+def parse_behaviors_legacy(source, target, user2int_path):
+    behaviors = pd.read_table(
+        source,
+        header=None,
+        names=['impression_id', 'user', 'time', 'clicked_news', 'impressions'])
+    behaviors.clicked_news.fillna(' ', inplace=True)
+    behaviors.impressions = behaviors.impressions.str.split()
+
+    user2int = {}
+    for row in behaviors.itertuples(index=False):
+        if row.user not in user2int:
+            user2int[row.user] = len(user2int) + 1
+
+    pd.DataFrame(user2int.items(), columns=['user',
+                                            'int']).to_csv(user2int_path,
+                                                           sep='\t',
+                                                           index=False)
+
+    for row in behaviors.itertuples():
+        behaviors.at[row.Index, 'user'] = user2int[row.user]
+
+    for row in tqdm(behaviors.itertuples(), desc="Balancing data"):
+        positive = iter([x for x in row.impressions if x.endswith('1')])
+        negative = [x for x in row.impressions if x.endswith('0')]
+        random.shuffle(negative)
+        negative = iter(negative)
+        pairs = []
+        try:
+            while True:
+                pair = [next(positive)]
+                for _ in range(config.negative_sampling_ratio):
+                    pair.append(next(negative))
+                pairs.append(pair)
+        except StopIteration:
+            pass
+        behaviors.at[row.Index, 'impressions'] = pairs
+
+    behaviors = behaviors.explode('impressions').dropna(
+        subset=["impressions"]).reset_index(drop=True)
+    behaviors[['candidate_news', 'clicked']] = pd.DataFrame(
+        behaviors.impressions.map(
+            lambda x: (' '.join([e.split('-')[0] for e in x]), ' '.join(
+                [e.split('-')[1] for e in x]))).tolist())
+    behaviors.to_csv(
+        target,
+        sep='\t',
+        index=False,
+        columns=['user', 'clicked_news', 'candidate_news', 'clicked'])
+
+
+def check_negatives(source, parsed):
+    """
+    Every sampled negative must be a distinct negative of its impression.
+    """
+    K = config.negative_sampling_ratio
+    behaviors = pd.read_table(source, header=None, usecols=[4])[4]
+    candidates = iter(parsed.candidate_news.str.split())
+    for impressions in behaviors.str.split():
+        positive = [x for x in impressions if x.endswith('1')]
+        negative = [x.split('-')[0] for x in impressions if x.endswith('0')]
+        sampled = []
+        for _ in range(min(len(positive), len(negative) // K)):
+            sampled += next(candidates)[1:]
+        for news in set(sampled):
+            assert sampled.count(news) <= negative.count(news)
+
+
+def timed(function, *args, **kwargs):
+    start = time.time()
+    function(*args, **kwargs)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--impressions', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--news', type=int, default=30000)
+    parser.add_argument('--chunksize', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = path.join(directory, 'behaviors.tsv')
+        write_behaviors(source, args.impressions, args.users, args.news)
+
+        def output(name):
+            return (path.join(directory, f'{name}_parsed.tsv'),
+                    path.join(directory, f'{name}_user2int.tsv'))
+
+        random.seed(args.seed)
+        legacy_time = timed(parse_behaviors_legacy, source, *output('legacy'))
+        new_time = timed(parse_behaviors, source, *output('new'),
+                         seed=args.seed)
+        chunked_time = timed(parse_behaviors,
+                             source,
+                             *output('chunked'),
+                             chunksize=args.chunksize,
+                             seed=args.seed)
+
+        assert filecmp.cmp(output('legacy')[1], output('new')[1], False)
+        legacy = pd.read_table(output('legacy')[0])
+        new = pd.read_table(output('new')[0])
+        for column in ['user', 'clicked_news', 'clicked']:
+            assert legacy[column].equals(new[column])
+        assert legacy.candidate_news.str.split().str[0].equals(
+            new.candidate_news.str.split().str[0])
+        check_negatives(source, new)
+
+    print(f'{args.impressions} impressions, {len(new)} training rows')
+    print(f'legacy:  {legacy_time:.2f}s')
+    print(f'new:     {new_time:.2f}s ({legacy_time / new_time:.1f}x)')
+    print(f'chunked: {chunked_time:.2f}s ({legacy_time / chunked_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Compare the time a training step waits for its minibatch when sampling
+`BaseDataset` (packed behaviors) and when streaming shards compiled by
+`compile_shards`, on the same synthetic data.
+
+    PYTHONPATH=src python3 -m benchmark.shards --steps 50 --workers 2
+"""
+import argparse
+import os
+import tempfile
+
+import torch
+from torch.utils.data import DataLoader
+
+from benchmark.synthetic import generate, train_steps
+from train import Model, config, device
+from dataset import BaseDataset, ResumableSampler, ShardDataset
+from data_preprocess import compile_shards
+
+
+def run(dataloader, steps, warmup_steps, seed):
+    """
+    Returns:
+        mean seconds waiting for a minibatch, mean seconds per step,
+        both after warmup
+    """
+    torch.manual_seed(seed)
+    model = Model(config).to(device)
+    seconds, phases, _ = train_steps(model, iter(dataloader), steps,
+                                     warmup_steps)
+    return phases['data_wait'], seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--steps', type=int, default=50)
+    parser.add_argument('--warmup-steps', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=config.num_workers)
+    parser.add_argument('--batches-per-shard', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        for key, value in generate(
+                directory,
+                num_impressions=((args.warmup_steps + args.steps) *
+                                 config.batch_size, 500)).items():
+            setattr(config, key, value)
+        compile_shards('data/train/behaviors_packed',
+                       'data/train/shards',
+                       config.batch_size,
+                       args.batches_per_shard,
+                       seed=args.seed)
+
+        dataset = BaseDataset('data/train/behaviors_parsed.tsv',
+                              'data/train/news_parsed.tsv')
+        shards = ShardDataset('data/train/shards',
+                              'data/train/news_parsed.tsv', args.seed)
+        results = {
+            'BaseDataset':
+            run(
+                DataLoader(dataset,
+                           batch_size=config.batch_size,
+                           sampler=ResumableSampler(dataset, args.seed),
+                           num_workers=args.workers,
+                           drop_last=True), args.steps, args.warmup_steps,
+                args.seed),
+            'ShardDataset':
+            run(DataLoader(shards, batch_size=None, num_workers=args.workers),
+                args.steps, args.warmup_steps, args.seed)
+        }
+
+    print(f'{args.workers} workers, batch size {config.batch_size}')
+    for name, (wait, step) in results.items():
+        print(f'{name:>15}: data wait {wait * 1000:7.2f} ms/step, '
+              f'step {step * 1000:7.1f} ms ({wait / step:.1%} waiting)')
+
+
+if __name__ == '__main__':
+    main()
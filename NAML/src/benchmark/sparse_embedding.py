@@ -0,0 +1,77 @@
+"""
+Compare training step time of dense Adam over the whole model with
+`config.sparse_embedding` (SparseAdam for the embeddings, Adam for the rest),
+on the same synthetic subset in the same order. The word embedding is sized
+like MIND's (`--num-words`) rather than the synthetic vocabulary, since the
+dense update cost grows with the table while the sparse one does not.
+
+SparseAdam updates moments of looked up rows only (lazy Adam), so losses are
+close but not identical.
+
+    PYTHONPATH=src python3 -m benchmark.sparse_embedding --steps 20
+"""
+import argparse
+import os
+import tempfile
+
+import torch
+from torch.utils.data import DataLoader
+
+from benchmark.synthetic import generate, train_steps
+from train import Model, config, device
+from dataset import BaseDataset
+
+
+def run(steps, warmup_steps, sparse_embedding, seed):
+    """
+    Returns:
+        seconds per step after warmup, mean loss after warmup
+    """
+    config.sparse_embedding = sparse_embedding
+    torch.manual_seed(seed)
+    model = Model(config).to(device)
+    dataset = BaseDataset('data/train/behaviors_parsed.tsv',
+                          'data/train/news_parsed.tsv')
+    # Same subset in the same order for every run
+    dataloader = iter(
+        DataLoader(dataset,
+                   batch_size=config.batch_size,
+                   shuffle=False,
+                   drop_last=True))
+
+    seconds, _, loss = train_steps(model, dataloader, steps, warmup_steps)
+    return seconds, loss
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-words', type=int, default=1 + 70975)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--warmup-steps', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        for key, value in generate(
+                directory,
+                num_impressions=((args.warmup_steps + args.steps) *
+                                 config.batch_size, 500)).items():
+            setattr(config, key, value)
+        config.num_words = max(config.num_words, args.num_words)
+        results = {
+            name: run(args.steps, args.warmup_steps, sparse_embedding,
+                      args.seed)
+            for name, sparse_embedding in [('dense Adam', False),
+                                           ('sparse embedding', True)]
+        }
+
+    baseline = results['dense Adam']
+    print(f'{config.num_words} words x {config.word_embedding_dim} dims')
+    for name, (seconds, loss) in results.items():
+        print(f'{name:>20}: {seconds * 1000:8.1f} ms/step '
+              f'({baseline[0] / seconds:.2f}x), mean loss {loss:.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+"""
+Micro and end-to-end benchmarks on deterministic synthetic data, saved as
+JSON so runs (e.g. before and after a change) can be compared.
+
+    PYTHONPATH=src python3 -m benchmark.suite --output after.json --compare before.json
+    PYTHONPATH=src python3 -m benchmark.suite --filter 'news_encoder|train_step'
+
+Each benchmark is timed `--repeat` times after `--warmup` runs, results are
+items/sec of the median run.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from os import path
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+from benchmark.synthetic import generate
+from train import Model, config, device
+
+benchmarks = {}
+
+
+def benchmark(kind, unit):
+    """
+    Register `function(directory)`, which prepares a run and returns
+    (run, number of `unit` processed by one call of run).
+    """
+    def register(function):
+        benchmarks[function.__name__] = (kind, unit, function)
+        return function
+
+    return register
+
+
+def new_model():
+    torch.manual_seed(0)
+    return Model(config).to(device)
+
+
+def synchronize():
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+
+@benchmark('micro', 'news')
+def parse_news(directory):
+    from data_preprocess import parse_news as parse
+    news_path = path.join(directory, 'data', 'train', 'news.tsv')
+    vocabulary = path.join(directory, 'vocabulary')
+    target = path.join(directory, 'parsed', 'news_parsed.tsv')
+    os.makedirs(path.dirname(target), exist_ok=True)
+    with open(news_path) as f:
+        num_news = sum(1 for _ in f) - 1
+
+    def run():
+        # Fresh vocabulary files, so every run adds all words
+        shutil.rmtree(vocabulary, ignore_errors=True)
+        os.makedirs(vocabulary)
+        parse(news_path, target, path.join(vocabulary, 'category2int.tsv'),
+              path.join(vocabulary, 'word2int.tsv'), 'train')
+
+    return run, num_news
+
+
+def dataset_getitem(directory, packed):
+    from dataset import BaseDataset
+    dataset = BaseDataset('data/train/behaviors_parsed.tsv',
+                          'data/train/news_parsed.tsv')
+    if not packed:
+        # Fall back to the tsv path, as without `pack_behaviors`
+        dataset.behaviors_packed = None
+        dataset.behaviors_parsed = pd.read_table(
+            'data/train/behaviors_parsed.tsv')
+    indices = np.random.default_rng(0).permutation(len(dataset))[:2000]
+
+    def run():
+        for i in indices:
+            dataset[i]
+
+    return run, len(indices)
+
+
+@benchmark('micro', 'samples')
+def dataset_getitem_packed(directory):
+    return dataset_getitem(directory, True)
+
+
+@benchmark('micro', 'samples')
+def dataset_getitem_tsv(directory):
+    return dataset_getitem(directory, False)
+
+
+def news_batch(size):
+    from news_store import NewsStore
+    news_store = NewsStore('data/train/news_store')
+    rows = np.random.default_rng(0).integers(1, len(news_store), size=size)
+    return {
+        attribute: torch.from_numpy(value).long().to(device)
+        for attribute, value in news_store.get(
+            rows, config.dataset_attributes['news']).items()
+    }
+
+
+@benchmark('micro', 'news')
+def news_encoder_forward(directory):
+    model = new_model().eval()
+    news = news_batch(config.batch_size * 16)
+
+    @torch.no_grad()
+    def run():
+        model.news_encoder(news)
+        synchronize()
+
+    return run, config.batch_size * 16
+
+
+@benchmark('micro', 'news')
+def news_encoder_backward(directory):
+    model = new_model().train()
+    news = news_batch(config.batch_size * 16)
+
+    def run():
+        model.zero_grad()
+        model.news_encoder(news).sum().backward()
+        synchronize()
+
+    return run, config.batch_size * 16
+
+
+@benchmark('micro', 'rows')
+def additive_attention(directory):
+    from model.general.attention.additive import AdditiveAttention
+    torch.manual_seed(0)
+    attention = AdditiveAttention(config.query_vector_dim,
+                                  config.num_filters).to(device)
+    # Like the user encoder over a minibatch of histories
+    candidate_vector = torch.randn(config.batch_size * 16,
+                                   config.num_clicked_news_a_user,
+                                   config.num_filters,
+                                   device=device)
+
+    @torch.no_grad()
+    def run():
+        attention(candidate_vector)
+        synchronize()
+
+    return run, len(candidate_vector)
+
+
+@benchmark('micro', 'impressions')
+def impression_metrics(directory):
+    from metrics import impression_metrics as run_metrics
+    rng = np.random.default_rng(0)
+    offsets = np.r_[0, np.cumsum(rng.integers(2, 60, size=2000))]
+    y_true = (rng.random(offsets[-1]) < 0.1).astype(np.int8)
+    y_score = rng.random(offsets[-1])
+
+    def run():
+        run_metrics(y_true, y_score, offsets)
+
+    return run, len(offsets) - 1
+
+
+@benchmark('macro', 'samples')
+def train_step(directory):
+    from dataset import BaseDataset
+    from profiler import TrainingProfiler
+    import train
+    model = new_model().train()
+    # The steps of `train`, with its optimizers, autocast and loss scaling
+    autocast_dtype = train.get_autocast_dtype()
+    scaler = train.make_grad_scaler(autocast_dtype)
+    optimizers = [x for x in train.make_optimizers(model) if x is not None]
+    criterion = nn.CrossEntropyLoss()
+    profiler = TrainingProfiler(None, device)
+    dataset = BaseDataset('data/train/behaviors_parsed.tsv',
+                          'data/train/news_parsed.tsv')
+    dataloader = DataLoader(dataset,
+                            batch_size=config.batch_size,
+                            shuffle=False,
+                            num_workers=config.num_workers,
+                            drop_last=True)
+    num_steps = min(10, len(dataloader))
+
+    def run():
+        for _, minibatch in zip(range(num_steps), dataloader):
+            train.train_step(model, minibatch, criterion, optimizers, scaler,
+                             autocast_dtype, profiler)
+        synchronize()
+
+    return run, num_steps * config.batch_size
+
+
+def count_lines(file_path):
+    with open(file_path) as f:
+        return sum(1 for _ in f)
+
+
+@benchmark('macro', 'impressions')
+def evaluate(directory):
+    from evaluate import evaluate as run_evaluate
+    model = new_model().eval()
+
+    def run():
+        run_evaluate(model, './data/val', 1)
+
+    return run, count_lines('data/val/behaviors.tsv')
+
+
+@benchmark('macro', 'impressions')
+def evaluate_resident(directory):
+    from evaluate import EvaluationData, evaluate as run_evaluate
+    model = new_model().eval()
+    # Built once, like validation during training
+    data = EvaluationData('./data/val')
+
+    def run():
+        run_evaluate(model, './data/val', 1, data=data)
+
+    return run, len(data)
+
+
+@benchmark('macro', 'impressions')
+def evaluate_streaming(directory):
+    from evaluate import evaluate as run_evaluate
+    model = new_model().eval()
+    num_impressions = count_lines('data/val/behaviors.tsv')
+
+    def run():
+        run_evaluate(model,
+                     './data/val',
+                     1,
+                     chunk_size=max(1, num_impressions // 8))
+
+    return run, num_impressions
+
+
+@benchmark('macro', 'impressions')
+def predict(directory):
+    try:
+        from main import predict as run_predict
+    except ImportError as error:
+        print(f'Skip predict: {error}')
+        return None
+    predict_dir = path.join(directory, 'data', 'predict')
+    shutil.copytree('data/val', predict_dir, dirs_exist_ok=True)
+    shutil.copy('data/train/user2int.tsv', predict_dir)
+    # Impressions to predict have no labels
+    with open('data/val/behaviors.tsv') as source, open(
+            path.join(predict_dir, 'behaviors.tsv'), 'w') as target:
+        for line in source:
+            *columns, impressions = line.rstrip('\n').split('\t')
+            impressions = ' '.join(x.split('-')[0] for x in impressions.split())
+            target.write('\t'.join(columns + [impressions]) + '\n')
+    model = new_model().eval()
+
+    def run():
+        run_predict(model, predict_dir, config.num_workers)
+
+    return run, count_lines(path.join(predict_dir, 'behaviors.tsv'))
+
+
+def measure(run, warmup, repeat):
+    """
+    Returns:
+        seconds of each repeated run
+    """
+    for _ in range(warmup):
+        run()
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True,
+                                text=True,
+                                cwd=path.dirname(__file__)).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'device': str(device),
+        'num_threads': torch.get_num_threads(),
+        'batch_size': config.batch_size,
+    }
+
+
+def compare(results, baseline):
+    """
+    Print items/sec against a previous result file.
+    """
+    with open(baseline) as f:
+        baseline = json.load(f)['results']
+    print(f'\n{"benchmark":<26}{"baseline":>14}{"current":>14}{"speedup":>10}')
+    for name, result in results.items():
+        current = result['items_per_second']
+        if name not in baseline:
+            print(f'{name:<26}{"-":>14}{current:>14.1f}{"-":>10}')
+            continue
+        previous = baseline[name]['items_per_second']
+        print(f'{name:<26}{previous:>14.1f}{current:>14.1f}'
+              f'{current / previous:>9.2f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filter', default='.*', help='regex of benchmark names')
+    parser.add_argument('--output', default=None, help='JSON file to write')
+    parser.add_argument('--compare', default=None, help='JSON file to compare with')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--news', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--impressions', type=int, nargs=2, default=[5000, 1000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.output is not None:
+        args.output = path.abspath(args.output)
+    if args.compare is not None:
+        args.compare = path.abspath(args.compare)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        for key, value in generate(directory,
+                                   num_news=args.news,
+                                   num_users=args.users,
+                                   num_impressions=tuple(args.impressions),
+                                   seed=args.seed).items():
+            setattr(config, key, value)
+        for name, (kind, unit, function) in benchmarks.items():
+            if re.search(args.filter, name) is None:
+                continue
+            prepared = function(directory)
+            if prepared is None:
+                continue
+            run, num_items = prepared
+            seconds = measure(run, args.warmup, args.repeat)
+            median = float(np.median(seconds))
+            results[name] = {
+                'kind': kind,
+                'unit': unit,
+                'items': num_items,
+                'seconds': seconds,
+                'median_seconds': median,
+                'items_per_second': num_items / median
+            }
+            print(f'{kind:>5} {name:<26}{num_items / median:>12.1f} {unit}/sec '
+                  f'(median {median * 1000:.1f} ms of {args.repeat})')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(
+                {
+                    'environment': environment(),
+                    'arguments': vars(args),
+                    'results': results
+                },
+                f,
+                indent=4)
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Deterministic synthetic data in MIND format, and training steps on it the
+way `train` takes them.
+"""
+import time
+from os import path
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+def write_behaviors(target,
+                    num_impressions,
+                    num_users,
+                    num_news,
+                    max_clicked_news=100,
+                    max_impressions=60,
+                    click_rate=0.1,
+                    seed=0):
+    """
+    Write a behaviors.tsv: impression_id, user, time, clicked_news, impressions
+    """
+    rng = np.random.default_rng(seed)
+    Path(path.dirname(target) or '.').mkdir(parents=True, exist_ok=True)
+    with open(target, 'w') as f:
+        for impression_id in range(1, num_impressions + 1):
+            user = rng.integers(num_users)
+            clicked_news = ' '.join(
+                f'N{x}' for x in rng.integers(
+                    num_news, size=rng.integers(max_clicked_news + 1)))
+            size = rng.integers(2, max_impressions + 1)
+            impressions = ' '.join(
+                f'N{x}-{y}'
+                for x, y in zip(rng.integers(num_news, size=size), (
+                    rng.random(size) < click_rate).astype(int)))
+            f.write(f'{impression_id}\tU{user}\t11/15/2019 8:55:22 AM\t'
+                    f'{clicked_news}\t{impressions}\n')
+
+
+def write_news(target,
+               num_news,
+               num_words=5000,
+               num_categories=15,
+               title_length=(4, 20),
+               abstract_length=(0, 80),
+               seed=0):
+    """
+    Write a news.tsv in the layout `parse_news` reads (header, id in column 0,
+    category in 2, title in 6 and abstract in 7). Words are Zipf distributed.
+    """
+    rng = np.random.default_rng(seed)
+    Path(path.dirname(target) or '.').mkdir(parents=True, exist_ok=True)
+    probability = 1 / np.arange(1, num_words + 1)
+    probability /= probability.sum()
+
+    def text(length):
+        return ' '.join(f'w{x}' for x in rng.choice(
+            num_words, size=rng.integers(*length), p=probability))
+
+    with open(target, 'w') as f:
+        f.write('id\tsource\tcategory\tsubcategory\turl\tdate\ttitle\tabstract\n')
+        for i in range(num_news):
+            f.write(f'N{i}\tsynthetic\tcategory{rng.integers(num_categories)}'
+                    f'\tsubcategory\thttps://example.com/N{i}\t2019-11-15'
+                    f'\t{text(title_length)}\t{text(abstract_length)}\n')
+
+
+def generate(directory,
+             num_news=2000,
+             num_users=500,
+             num_impressions=(5000, 1000),
+             seed=0):
+    """
+    Write and preprocess train/val splits in the layout `train.py` expects,
+    i.e. `directory` works as the working directory of training:
+        data/train: news.tsv, behaviors.tsv and everything `data_preprocess` writes
+        data/val: news.tsv, behaviors.tsv, news_parsed.tsv and its news store
+    Returns:
+        the vocabulary manifest, to be set on `config`
+    """
+    from data_preprocess import parse_behaviors, parse_news, pack_behaviors
+    from vocab import load_vocab_manifest
+
+    train_dir = path.join(directory, 'data', 'train')
+    val_dir = path.join(directory, 'data', 'val')
+    for split, split_dir, count in [('train', train_dir, num_impressions[0]),
+                                    ('val', val_dir, num_impressions[1])]:
+        write_news(path.join(split_dir, 'news.tsv'), num_news, seed=seed)
+        write_behaviors(path.join(split_dir, 'behaviors.tsv'),
+                        count,
+                        num_users,
+                        num_news,
+                        seed=seed + (split == 'val'))
+
+    parse_behaviors(path.join(train_dir, 'behaviors.tsv'),
+                    path.join(train_dir, 'behaviors_parsed.tsv'),
+                    path.join(train_dir, 'user2int.tsv'),
+                    seed=seed)
+    for split_dir, mode in [(train_dir, 'train'), (val_dir, 'test')]:
+        parse_news(path.join(split_dir, 'news.tsv'),
+                   path.join(split_dir, 'news_parsed.tsv'),
+                   path.join(train_dir, 'category2int.tsv'),
+                   path.join(train_dir, 'word2int.tsv'),
+                   mode=mode)
+    pack_behaviors(path.join(train_dir, 'behaviors_parsed.tsv'),
+                   path.join(train_dir, 'news_parsed.tsv'),
+                   path.join(train_dir, 'behaviors_packed'))
+    return load_vocab_manifest(path.join(train_dir, 'word2int.tsv'))
+
+
+def train_steps(model, dataloader, steps, warmup_steps=0, forward_model=None):
+    """
+    Take training steps as `train` does: `train.train_step` with the
+    optimizers of `train.make_optimizers`, and autocast and loss scaling from
+    `config.autocast_dtype`.
+    Args:
+        model: Model, trained in place
+        dataloader: iterator of minibatches
+        forward_model: called for forward instead of model, e.g. its
+            DistributedDataParallel
+    Returns:
+        seconds per step, {phase: seconds per step} (see `TrainingProfiler`)
+        and mean loss, all of the steps after warmup
+    """
+    import train
+    from profiler import TrainingProfiler
+
+    def synchronize():
+        if train.device.type == 'cuda':
+            torch.cuda.synchronize()
+
+    autocast_dtype = train.get_autocast_dtype()
+    scaler = train.make_grad_scaler(autocast_dtype)
+    optimizers = [x for x in train.make_optimizers(model) if x is not None]
+    criterion = nn.CrossEntropyLoss()
+    profiler = TrainingProfiler(None, train.device)
+    model.train()
+    losses = []
+    for i in range(warmup_steps + steps):
+        if i == warmup_steps:
+            synchronize()
+            profiler.reset()
+        with profiler.phase('data_wait'):
+            minibatch = next(dataloader)
+        loss = train.train_step(forward_model or model, minibatch, criterion,
+                                optimizers, scaler, autocast_dtype, profiler)
+        if i >= warmup_steps:
+            losses.append(loss.detach().float())
+    synchronize()
+    seconds = time.perf_counter() - profiler.start
+    return seconds / steps, {
+        name: total / steps
+        for name, total in profiler.totals.items()
+    }, torch.stack(losses).mean().item()
@@ -0,0 +1,209 @@
+import json
+import os
+import queue
+import re
+import threading
+import time
+from os import path
+
+import numpy as np
+import torch
+
+manifest_name = 'manifest.json'
+
+
+def snapshot(state):
+    """
+    Copy tensors in (nested) state dicts to CPU, so training can go on
+    updating parameters and optimizer state in place while they are written.
+    """
+    if torch.is_tensor(state):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {key: snapshot(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot(value) for value in state)
+    return state
+
+
+def atomic_write(file_path, write):
+    """
+    Call `write(file)` on a temporary file next to `file_path`, then rename it
+    into place. Readers see either the old file or the complete new one.
+    """
+    tmp_path = path.join(path.dirname(file_path),
+                         f'.{path.basename(file_path)}.tmp')
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def load_checkpoint(file_path):
+    """
+    torch.load a checkpoint, which holds only tensors and plain Python types.
+    Checkpoints saved before the metrics in them were converted to float hold
+    numpy float64 scalars, these are allowed too with weights_only loading.
+    """
+    if not hasattr(torch.serialization, 'safe_globals'):
+        return torch.load(file_path)
+    core = np._core if hasattr(np, '_core') else np.core
+    with torch.serialization.safe_globals(
+        [core.multiarray.scalar, np.dtype,
+         type(np.dtype(np.float64))]):
+        return torch.load(file_path)
+
+
+def load_manifest(directory):
+    """
+    Returns:
+        list of {'file', 'step', 'metrics', 'time'} ordered by step,
+        or None if there is no manifest
+    """
+    try:
+        with open(path.join(directory, manifest_name)) as f:
+            return json.load(f)['checkpoints']
+    except FileNotFoundError:
+        return None
+
+
+def latest_checkpoint(directory):
+    """
+    Returns:
+        path of the checkpoint with the largest step, or None.
+        Read from the manifest of `CheckpointWriter`, or for directories
+        without one from `ckpt-{step}.pth` file names, ignoring other files.
+    """
+    if not path.exists(directory):
+        return None
+    entries = load_manifest(directory)
+    if entries is not None:
+        entries = [
+            x for x in entries if path.exists(path.join(directory, x['file']))
+        ]
+        if entries:
+            return path.join(directory,
+                             max(entries, key=lambda x: x['step'])['file'])
+    all_checkpoints = {}
+    for x in os.listdir(directory):
+        match = re.fullmatch(r'ckpt-(\d+)\.pth', x)
+        if match is not None:
+            all_checkpoints[int(match.group(1))] = x
+    if not all_checkpoints:
+        return None
+    return path.join(directory, all_checkpoints[max(all_checkpoints.keys())])
+
+
+class CheckpointWriter():
+    """
+    Save checkpoints on a background thread. `save` only copies the state to
+    CPU, torch.save, the manifest update and pruning happen on the thread.
+    If the previous snapshot is still waiting for the thread, `save` blocks.
+    Files are written to a temporary file and renamed, so an interrupted
+    write never leaves a truncated checkpoint or manifest behind.
+
+    Checkpoints kept are the `keep_last` ones with the largest steps and the
+    `keep_best` ones with the highest `monitor` metric, others are deleted.
+
+    An error of the thread is raised by the next `save`, `wait` or `close`.
+    """
+    def __init__(self, directory, keep_last=3, keep_best=1, monitor='auc'):
+        self.directory = directory
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.monitor = monitor
+        os.makedirs(directory, exist_ok=True)
+        self.entries = load_manifest(directory) or []
+        self.error = None
+        # At most one snapshot waits while another is written, `save` blocks
+        # rather than piling up copies of the model in host memory
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self.run,
+                                       name='CheckpointWriter',
+                                       daemon=True)
+        self.thread.start()
+
+    def save(self, state, step, metrics):
+        """
+        Args:
+            state: dict of state dicts etc., as for torch.save
+            step: training step, also the file name `ckpt-{step}.pth`
+            metrics: {name: float}, must include `monitor`
+        """
+        self.raise_error()
+        self.queue.put((snapshot(state), step, metrics))
+
+    def wait(self):
+        """
+        Block until all checkpoints saved so far are written.
+        """
+        self.queue.join()
+        self.raise_error()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.raise_error()
+
+    def raise_error(self):
+        """
+        Raise the error of a failed write once, on the training thread.
+        """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self.write(*item)
+            except Exception as error:
+                # The thread keeps taking items, so `save` and `close` never
+                # block on a full queue
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def write(self, state, step, metrics):
+        file_name = f'ckpt-{step}.pth'
+        atomic_write(path.join(self.directory, file_name),
+                     lambda f: torch.save(state, f))
+        self.entries = [x for x in self.entries if x['step'] != step] + [{
+            'file': file_name,
+            'step': step,
+            'metrics': metrics,
+            'time': time.time()
+        }]
+        self.entries.sort(key=lambda x: x['step'])
+        pruned = self.prune()
+        atomic_write(
+            path.join(self.directory, manifest_name),
+            lambda f: f.write(
+                json.dumps({
+                    'checkpoints': self.entries
+                }, indent=4).encode()))
+        # Only delete files once the manifest no longer refers to them
+        for entry in pruned:
+            try:
+                os.remove(path.join(self.directory, entry['file']))
+            except FileNotFoundError:
+                pass
+
+    def prune(self):
+        """
+        Drop entries to be neither kept as last nor as best.
+        Returns:
+            dropped entries
+        """
+        last = self.entries[-self.keep_last:] if self.keep_last > 0 else []
+        best = sorted(self.entries,
+                      key=lambda x: x['metrics'].get(self.monitor, -float('inf')),
+                      reverse=True)[:self.keep_best]
+        keep = {x['step'] for x in last + best}
+        pruned = [x for x in self.entries if x['step'] not in keep]
+        self.entries = [x for x in self.entries if x['step'] in keep]
+        return pruned
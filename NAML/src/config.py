@@ -1,7 +1,16 @@
 import os
+import json
 
 model_name = 'NAML'
 
+# Vocabulary sizes written by `src/data_preprocess.py`
+vocab_manifest_path = './data/train/vocab.json'
+try:
+    with open(vocab_manifest_path) as f:
+        vocab_manifest = json.load(f)
+except FileNotFoundError:
+    vocab_manifest = {}
+
 class BaseConfig():
     """
     General configurations appiled to all models
@@ -10,20 +19,69 @@ class BaseConfig():
     num_batches_show_loss = 100  # Number of batchs to show loss
     # Number of batchs to check metrics on validation dataset
     num_batches_validate = 1000
+    # Impressions of the validation set used (`max_count` of `evaluate`)
+    num_impressions_validate = 200000
+    # Impressions per chunk when evaluating the test set with
+    # `src/evaluate.py`, memory is bounded by it. None loads all at once
+    num_impressions_evaluate_chunk = 50000
+    # Processes scoring shards of the test set with `src/evaluate.py`, which
+    # share the news vectors encoded once. 1 evaluates in one process
+    num_evaluate_workers = os.cpu_count()
     batch_size = 16 
     learning_rate = 0.0001
-    num_workers = 2  # Number of workers for data loading
+    # Seed of the per-epoch shuffle, saved in checkpoints to resume mid-epoch
+    shuffle_seed = 0
+    # Sparse gradients for the word and category embeddings, updated by
+    # SparseAdam (only rows in the minibatch) while the rest use Adam
+    sparse_embedding = False
+    # Mixed precision training, None (fp32), 'bfloat16' or 'float16'
+    autocast_dtype = None
+    # None, 'model' or 'news_encoder', compile it with torch.compile
+    compile_model = None
+    # Checkpoints kept: the latest ones by step and the best ones by AUC
+    checkpoint_keep_last = 3
+    checkpoint_keep_best = 1
+    # Directory written by `compile_shards`, e.g. './data/train/shards'. If it
+    # exists, training streams its pre-collated minibatches instead of
+    # sampling `BaseDataset`
+    training_shards = None
+    # Time of each step phase, samples/sec and peak memory are written to
+    # TensorBoard every `num_batches_show_loss` batches. CUDA phases are only
+    # timed exactly if synchronized, which costs some throughput
+    synchronize_step_timing = False
+    # Capture a torch.profiler trace of these batches, e.g. (100, 110), into
+    # the TensorBoard run directory. Touching `profile` in that directory
+    # while training captures the next `num_batches_profile` batches
+    profile_batches = None
+    num_batches_profile = 10
+    num_workers = 2  # Number of workers for data loading (per process)
+    # Backend when launched by torchrun with more than one process
+    distributed_backend = 'gloo'
+    num_tokenize_workers = os.cpu_count()  # Number of processes for tokenizing news
+    # None, 'device' or 'pinned'. If set, the dataset yields news row indices
+    # and the model gathers news from a table held on device or in pinned memory
+    news_table = None
+    # With `news_table` set, encode each distinct news of a minibatch only once
+    deduplicate_news = False
     num_clicked_news_a_user = 50  # Number of sampled click history for each user
     num_words_title = 20
     num_words_abstract = 100
     word_freq_threshold = 1
     negative_sampling_ratio = 2  # K
+    # Score the candidates of all samples in a minibatch against each user in
+    # training, so every positive gets batch_size * (1 + K) - 1 negatives for
+    # the same encoder work and K can be lowered
+    in_batch_negatives = False
     dropout_probability = 0.2
+    # Read from `vocab_manifest_path` if it exists
+    num_words = vocab_manifest.get('num_words', 1 + 70975)
+    num_categories = vocab_manifest.get('num_categories', 1 + 6)
     # Modify the following by the output of `src/dataprocess.py`
-    num_words = 1 + 70975
-    num_categories = 1 + 6
     num_users = 1 + 100
     word_embedding_dim = 300
+    # Pretrained word embedding file, also read for words appended to the
+    # vocabulary after `pretrained_word_embedding.npy` or the checkpoint
+    word_embedding_source = f'./data/glove/glove.840B.{word_embedding_dim}d.txt'
     category_embedding_dim = 100
     # For additive attention
     query_vector_dim = 200
@@ -1,17 +1,21 @@
 from config import model_name
 import pandas as pd
-import swifter
 import json
-import math
 from tqdm import tqdm
+import os
 from os import path
 from pathlib import Path
-import random
 from nltk.tokenize import word_tokenize
 import numpy as np
 import csv
 import importlib
 import nltk
+from collections import Counter
+from itertools import chain
+from multiprocessing import Pool
+from news_store import (NewsStore, news_store_directory, write_news_store,
+                        load_packed_behaviors)
+from vocab import Vocabulary, save_vocab_manifest
 
 try:
     config = getattr(importlib.import_module('config'), f"{model_name}Config")
@@ -20,66 +24,267 @@ except AttributeError:
     exit()
 
 
-def parse_behaviors(source, target, user2int_path):
+def parse_behaviors(source, target, user2int_path, chunksize=None, seed=None):
     """
     Parse behaviors file in training set.
     Args:
         source: source behaviors file
         target: target behaviors file
         user2int_path: path for saving user2int file
+        chunksize: if given, stream source in chunks of this many rows, so
+            memory is bounded by chunksize instead of the file size
+        seed: seed for negative sampling, output is the same for the same seed
+            whether chunked or not
     """
     print(f"Parse {source}")
 
-    behaviors = pd.read_table(
+    rng = np.random.default_rng(seed)
+    # user, int (in order of first appearance)
+    user2int = pd.Series(dtype=np.int64)
+    chunks = pd.read_table(
         source,
         header=None,
-        names=['impression_id', 'user', 'time', 'clicked_news', 'impressions'])
-    behaviors.clicked_news.fillna(' ', inplace=True)
-    behaviors.impressions = behaviors.impressions.str.split()
-
-    user2int = {}
-    for row in behaviors.itertuples(index=False):
-        if row.user not in user2int:
-            user2int[row.user] = len(user2int) + 1
-
-    pd.DataFrame(user2int.items(), columns=['user',
-                                            'int']).to_csv(user2int_path,
-                                                           sep='\t',
-                                                           index=False)
+        names=['impression_id', 'user', 'time', 'clicked_news', 'impressions'],
+        chunksize=chunksize)
+    if chunksize is None:
+        chunks = [chunks]
+
+    for i, behaviors in enumerate(
+            tqdm(chunks, desc="Balancing data", disable=chunksize is None)):
+        behaviors = behaviors.reset_index(drop=True)
+        behaviors['clicked_news'] = behaviors.clicked_news.fillna(' ')
+
+        codes, users = pd.factorize(behaviors.user)
+        user_int = user2int.reindex(users)
+        new_users = users[user_int.isna().values]
+        user2int = pd.concat([
+            user2int,
+            pd.Series(np.arange(len(new_users)) + len(user2int) + 1,
+                      index=new_users)
+        ])
+        behaviors['user'] = user2int.reindex(users).values[codes]
+
+        balance_behaviors(behaviors, rng).to_csv(
+            target,
+            sep='\t',
+            index=False,
+            mode='w' if i == 0 else 'a',
+            header=i == 0,
+            columns=['user', 'clicked_news', 'candidate_news', 'clicked'])
+
+    pd.DataFrame({
+        'user': user2int.index,
+        'int': user2int.values
+    }).to_csv(user2int_path, sep='\t', index=False)
     print(
         f'Please modify `num_users` in `src/config.py` into 1 + {len(user2int)}'
     )
 
-    for row in behaviors.itertuples():
-        behaviors.at[row.Index, 'user'] = user2int[row.user]
-
-    for row in tqdm(behaviors.itertuples(), desc="Balancing data"):
-        positive = iter([x for x in row.impressions if x.endswith('1')])
-        negative = [x for x in row.impressions if x.endswith('0')]
-        random.shuffle(negative)
-        negative = iter(negative)
-        pairs = []
-        try:
-            while True:
-                pair = [next(positive)]
-                for _ in range(config.negative_sampling_ratio):
-                    pair.append(next(negative))
-                pairs.append(pair)
-        except StopIteration:
-            pass
-        behaviors.at[row.Index, 'impressions'] = pairs
-
-    behaviors = behaviors.explode('impressions').dropna(
-        subset=["impressions"]).reset_index(drop=True)
-    behaviors[['candidate_news', 'clicked']] = pd.DataFrame(
-        behaviors.impressions.map(
-            lambda x: (' '.join([e.split('-')[0] for e in x]), ' '.join(
-                [e.split('-')[1] for e in x]))).tolist())
-    behaviors.to_csv(
-        target,
-        sep='\t',
-        index=False,
-        columns=['user', 'clicked_news', 'candidate_news', 'clicked'])
+
+def balance_behaviors(behaviors, rng):
+    """
+    Pair each positive impression with `negative_sampling_ratio` randomly
+    chosen negatives of the same row, dropping positives left without enough
+    negatives.
+    Args:
+        behaviors: DataFrame with `user`, `clicked_news` and `impressions`
+        rng: numpy Generator, one key is drawn per negative impression
+    Returns:
+        DataFrame with `user`, `clicked_news`, `candidate_news` and `clicked`,
+        one row per pair
+    """
+    K = config.negative_sampling_ratio
+    impressions = behaviors.impressions.str.split().explode().dropna()
+    row = impressions.index.to_numpy()
+    impressions = impressions.to_numpy().astype(str)
+    news, label = np.char.partition(impressions, '-')[:, [0, 2]].T
+    label = np.char.partition(label, '-')[:, 0]
+
+    positive = np.char.endswith(impressions, '1')
+    negative = np.char.endswith(impressions, '0')
+    positive_row = row[positive]
+    # Shuffle negatives within each row by sorting on a random key
+    order = np.lexsort((rng.random(negative.sum()), row[negative]))
+    negative_row = row[negative][order]
+    negative_news = news[negative][order]
+    negative_label = label[negative][order]
+
+    num_rows = len(behaviors)
+    num_positive = np.bincount(positive_row, minlength=num_rows)
+    num_negative = np.bincount(negative_row, minlength=num_rows)
+    num_pairs = np.minimum(num_positive,
+                           num_negative // K if K > 0 else num_positive)
+
+    # Positive j of a row goes with negatives j*K ... j*K+K-1 of that row
+    positive_kept = rank_in_group(positive_row) < num_pairs[positive_row]
+    negative_kept = rank_in_group(negative_row) < num_pairs[negative_row] * K
+    pair_row = positive_row[positive_kept]
+    candidate_news = np.column_stack([
+        news[positive][positive_kept],
+        negative_news[negative_kept].reshape(-1, K)
+    ])
+    clicked = np.column_stack([
+        label[positive][positive_kept],
+        negative_label[negative_kept].reshape(-1, K)
+    ])
+
+    return pd.DataFrame({
+        'user': behaviors.user.values[pair_row],
+        'clicked_news': behaviors.clicked_news.values[pair_row],
+        'candidate_news': join_columns(candidate_news),
+        'clicked': join_columns(clicked)
+    })
+
+
+def rank_in_group(groups):
+    """
+    Position of each element within its run of equal values.
+    Args:
+        groups: sorted int array
+    """
+    if len(groups) == 0:
+        return groups
+    start = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    return np.arange(len(groups)) - np.repeat(
+        start, np.diff(np.r_[start, len(groups)]))
+
+
+def join_columns(values):
+    """
+    Join each row of a 2D string array with spaces.
+    """
+    joined = pd.Series(values[:, 0], dtype=object)
+    if values.shape[1] == 1:
+        return joined
+    return joined.str.cat(
+        [pd.Series(values[:, j], dtype=object) for j in range(1, values.shape[1])],
+        sep=' ')
+
+
+def pack_behaviors(source, news_path, target, chunksize=100000):
+    """
+    Pack parsed behaviors into integer arrays indexing the news store, so
+    `BaseDataset` only slices arrays.
+    Args:
+        source: behaviors_parsed.tsv written by `parse_behaviors`
+        news_path: news_parsed.tsv, its news store must exist
+        target: target directory, see `load_packed_behaviors`
+        chunksize: number of rows parsed at a time
+    Written arrays, one row per training sample:
+        user: int32
+        clicked_news: int32, num_clicked_news_a_user, left-padded with 0
+        clicked_news_length: int32
+        candidate_news: int32, 1 + K
+        clicked: int8, 1 + K
+    """
+    print(f"Pack {source}")
+    news_store = NewsStore(news_store_directory(news_path))
+    with open(source) as f:
+        num_rows = sum(1 for _ in f) - 1
+    num_candidates = 1 + config.negative_sampling_ratio
+    Path(target).mkdir(parents=True, exist_ok=True)
+    packed = {
+        name: np.lib.format.open_memmap(path.join(target, f'{name}.npy'),
+                                        mode='w+',
+                                        dtype=dtype,
+                                        shape=(num_rows, ) + shape)
+        for name, dtype, shape in [
+            ('user', np.int32, ()),
+            ('clicked_news', np.int32, (config.num_clicked_news_a_user, )),
+            ('clicked_news_length', np.int32, ()),
+            ('candidate_news', np.int32, (num_candidates, )),
+            ('clicked', np.int8, (num_candidates, )),
+        ]
+    }
+
+    start = 0
+    for behaviors in tqdm(pd.read_table(source,
+                                        chunksize=chunksize,
+                                        na_filter=False),
+                          desc="Packing behaviors"):
+        end = start + len(behaviors)
+        packed['user'][start:end] = behaviors.user.values
+        packed['candidate_news'][start:end] = news_store.rows(
+            ' '.join(behaviors.candidate_news).split()).reshape(
+                -1, num_candidates)
+        packed['clicked'][start:end] = np.array(
+            ' '.join(behaviors.clicked).split(),
+            dtype=np.int8).reshape(-1, num_candidates)
+
+        # Only the first num_clicked_news_a_user clicked news are used
+        clicked_news = [
+            x.split()[:config.num_clicked_news_a_user]
+            for x in behaviors.clicked_news
+        ]
+        length = np.fromiter(map(len, clicked_news),
+                             dtype=np.int32,
+                             count=len(clicked_news))
+        row = np.repeat(np.arange(len(clicked_news)), length)
+        column = config.num_clicked_news_a_user - length[row] + rank_in_group(
+            row)
+        history = np.zeros((len(clicked_news), config.num_clicked_news_a_user),
+                           dtype=np.int32)
+        history[row, column] = news_store.rows(
+            list(chain.from_iterable(clicked_news)))
+        packed['clicked_news'][start:end] = history
+        packed['clicked_news_length'][start:end] = length
+        start = end
+
+    for array in packed.values():
+        array.flush()
+
+
+def compile_shards(source,
+                   target,
+                   batch_size,
+                   batches_per_shard=256,
+                   seed=None):
+    """
+    Shuffle packed behaviors once and cut them into shards of whole
+    minibatches, streamed by `ShardDataset`. Each shard is a directory laid
+    out like packed behaviors, with rows in minibatch order, so a minibatch
+    is one contiguous slice of every array.
+    Args:
+        source: packed behaviors directory written by `pack_behaviors`
+        target: target directory, `manifest.json` in it is written last
+        batch_size: samples per minibatch, must match `config.batch_size`
+        batches_per_shard: minibatches per shard, the unit of shuffling
+        seed: seed of the sample shuffle
+    The last incomplete minibatch is dropped.
+    """
+    print(f"Compile {source}")
+    packed = load_packed_behaviors(source)
+    assert packed is not None, 'Run `pack_behaviors` first'
+    num_batches = len(packed['candidate_news']) // batch_size
+    order = np.random.default_rng(seed).permutation(
+        len(packed['candidate_news']))[:num_batches * batch_size]
+
+    num_shards = 0
+    for start in tqdm(range(0, num_batches, batches_per_shard),
+                      desc="Compiling shards"):
+        rows = order[start * batch_size:(start + batches_per_shard) *
+                     batch_size]
+        # Read the memory-mapped arrays forward, then put rows back in order
+        sorted_rows = np.sort(rows)
+        position = np.searchsorted(sorted_rows, rows)
+        shard_directory = path.join(target, f'shard-{num_shards:05d}')
+        Path(shard_directory).mkdir(parents=True, exist_ok=True)
+        for name, array in packed.items():
+            np.save(path.join(shard_directory, f'{name}.npy'),
+                    np.asarray(array[sorted_rows])[position])
+        num_shards += 1
+
+    with open(path.join(target, 'manifest.json'), 'w') as f:
+        json.dump(
+            {
+                'batch_size': batch_size,
+                'num_batches': num_batches,
+                'batches_per_shard': batches_per_shard,
+                'num_shards': num_shards,
+                'seed': seed,
+                'num_clicked_news_a_user': config.num_clicked_news_a_user,
+                'negative_sampling_ratio': config.negative_sampling_ratio
+            }, f)
 
 
 def parse_news(source, target, category2int_path, word2int_path, mode):
@@ -88,10 +293,10 @@ def parse_news(source, target, category2int_path, word2int_path, mode):
     Args:
         source: source news file
         target: target news file
-        if mode == 'train':
-            category2int_path, word2int_path, entity2int_path: Path to save
-        elif mode == 'test':
-            category2int_path, word2int_path, entity2int_path: Path to load from
+        category2int_path, word2int_path: vocabulary files, see `Vocabulary`
+        mode: 'train' or 'predict' append new categories and words to the
+            vocabulary files, 'test' only reads them. Prediction appends to
+            the training vocabulary, whose ids index the model's embeddings
     """
     print(f"Parse {source}")
     news = pd.read_table(source,
@@ -103,161 +308,270 @@ def parse_news(source, target, category2int_path, word2int_path, mode):
                              'abstract'
                          ])
     news.fillna(' ', inplace=True)
-    
-
-    def parse_row(row):
-        new_row = [
-            row.id,
-            category2int[str(row.category)] if row.category in category2int else 0,
-            [0] * config.num_words_title, [0] * config.num_words_abstract
-        ]
-
-        try:
-            for i, w in enumerate(word_tokenize(row.title.lower())):
-                if w in word2int:
-                    new_row[2][i] = word2int[w]
-        except IndexError:
-            pass
-
-        try:
-            for i, w in enumerate(word_tokenize(row.abstract.lower())):
-                if w in word2int:
-                    new_row[3][i] = word2int[w]
-        except IndexError:
-            pass
-
-        return pd.Series(new_row,
-                         index=[
-                             'id', 'category', 'title', 'abstract'
-                         ])
 
-    if mode == 'train':
-        category2int = {}
-        word2int = {}
-        word2freq = {}
-        entity2int = {}
-        entity2freq = {}
-
-        for row in news.itertuples(index=False):
-            if row.category not in category2int:
-                category2int[row.category] = len(category2int) + 1
-            if row.subcategory not in category2int:
-                category2int[row.subcategory] = len(category2int) + 1
-
-            for w in word_tokenize(row.title.lower()):
-                if w not in word2freq:
-                    word2freq[w] = 1
-                else:
-                    word2freq[w] += 1
-            for w in word_tokenize(row.abstract.lower()):
-                if w not in word2freq:
-                    word2freq[w] = 1
-                else:
-                    word2freq[w] += 1
-
-            for e in json.loads(row.title_entities):
-                times = len(e['OccurrenceOffsets']) * e['Confidence']
-                if times > 0:
-                    if e['WikidataId'] not in entity2freq:
-                        entity2freq[e['WikidataId']] = times
-                    else:
-                        entity2freq[e['WikidataId']] += times
-
-            for e in json.loads(row.abstract_entities):
-                times = len(e['OccurrenceOffsets']) * e['Confidence']
-                if times > 0:
-                    if e['WikidataId'] not in entity2freq:
-                        entity2freq[e['WikidataId']] = times
-                    else:
-                        entity2freq[e['WikidataId']] += times
-
-        for k, v in word2freq.items():
-            if v >= config.word_freq_threshold:
-                word2int[k] = len(word2int) + 1
-
-        for k, v in entity2freq.items():
-            if v >= config.entity_freq_threshold:
-                entity2int[k] = len(entity2int) + 1
-
-        parsed_news = news.swifter.apply(parse_row, axis=1)
-        parsed_news.to_csv(target, sep='\t', index=False)
-
-        pd.DataFrame(category2int.items(),
-                     columns=['category', 'int']).to_csv(category2int_path,
-                                                         sep='\t',
-                                                         index=False)
+    if mode not in ['train', 'test', 'predict']:
+        print('Wrong mode!')
+        return
+
+    # Each text is tokenized exactly once, the tokens are shared by
+    # vocabulary counting and id mapping
+    tokens = tokenize(news.title.tolist() + news.abstract.tolist(),
+                      config.num_tokenize_workers)
+    title_tokens, abstract_tokens = tokens[:len(news)], tokens[len(news):]
+
+    word2int = Vocabulary(word2int_path, 'word')
+    category2int = Vocabulary(category2int_path, 'category')
+    if mode in ['train', 'predict']:
+        # New words and categories are appended after the existing ones, so
+        # ids already used by a trained model never change
+        num_new_categories = category2int.add(
+            news.category.astype(str).unique())
+        # Count in the same order as the news is read, so ids are assigned
+        # in order of first appearance
+        word2freq = Counter(
+            chain.from_iterable(
+                chain.from_iterable(zip(title_tokens, abstract_tokens))))
+        num_new_words = word2int.add(
+            k for k, v in word2freq.items()
+            if v >= config.word_freq_threshold)
+
+        category2int.save()
+        word2int.save()
+        save_vocab_manifest(word2int, category2int)
         print(
-            f'Please modify `num_categories` in `src/config.py` into 1 + {len(category2int)}'
+            f'Add {num_new_categories} categories and {num_new_words} words, '
+            f'`num_categories` = {len(category2int)}, `num_words` = {len(word2int)}'
         )
 
-        pd.DataFrame(word2int.items(), columns=['word',
-                                                'int']).to_csv(word2int_path,
-                                                               sep='\t',
-                                                               index=False)
-        print(
-            f'Please modify `num_words` in `src/config.py` into 1 + {len(word2int)}'
-        )
+    save_parsed_news(
+        target, news.id.values,
+        news.category.astype(str).map(category2int.key2int).fillna(0).astype(
+            np.int32).values,
+        token_matrix(title_tokens, word2int.key2int, config.num_words_title),
+        token_matrix(abstract_tokens, word2int.key2int,
+                     config.num_words_abstract))
 
-    elif mode == 'test':
-        category2int = dict(pd.read_table(category2int_path).values.tolist())
-        word2int = dict(pd.read_table(word2int_path, na_filter=False).values.tolist())
 
-        parsed_news = news.apply(parse_row, axis=1)
-        parsed_news.to_csv(target, sep='\t', index=False)
-    
-    elif mode == 'predict':
-        category2int = dict(pd.read_table(category2int_path).values.tolist())
-        word2int = dict(pd.read_table(word2int_path, na_filter=False).values.tolist())
+def tokenize_text(text):
+    return word_tokenize(text.lower())
 
-        parsed_news = news.apply(parse_row, axis=1)
-        parsed_news.to_csv(target, sep='\t', index=False)
 
-    else:
-        print('Wrong mode!')
+def tokenize(texts, num_workers):
+    """
+    Tokenize texts with a pool of processes.
+    Args:
+        texts: list of str
+        num_workers: number of processes, tokenize in this process if <= 1
+    Returns:
+        list of token lists, in the order of texts
+    """
+    if num_workers <= 1:
+        return [tokenize_text(x) for x in tqdm(texts, desc="Tokenizing")]
+    with Pool(processes=num_workers) as pool:
+        return list(
+            tqdm(pool.imap(tokenize_text,
+                           texts,
+                           chunksize=max(1, len(texts) // (num_workers * 64))),
+                 total=len(texts),
+                 desc="Tokenizing"))
+
+
+def token_matrix(tokens, word2int, num_words_text):
+    """
+    Map token lists to a zero-padded matrix of word ids, unknown words are 0.
+    Args:
+        tokens: list of token lists
+        word2int: dict
+        num_words_text: number of columns, longer texts are truncated
+    Returns:
+        int32 array, len(tokens) * num_words_text
+    """
+    tokens = [x[:num_words_text] for x in tokens]
+    length = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+    word = pd.Series(list(chain.from_iterable(tokens)), dtype=object)
+    row = np.repeat(np.arange(len(tokens)), length)
+    matrix = np.zeros((len(tokens), num_words_text), dtype=np.int32)
+    matrix[row, rank_in_group(row)] = word.map(word2int).fillna(0).astype(
+        np.int32).values
+    return matrix
+
+
+def save_parsed_news(target, ids, category, title, abstract):
+    """
+    Save parsed news as tsv, plus a columnar store next to it which the
+    datasets memory-map instead of parsing the tsv.
+    Remote targets (e.g. gs://) can't be memory-mapped, so they only get the tsv.
+    """
+    pd.DataFrame({
+        'id': ids,
+        'category': category,
+        'title': title.tolist(),
+        'abstract': abstract.tolist()
+    }).to_csv(target, sep='\t', index=False)
+    if '://' in target:
+        return
+    write_news_store(news_store_directory(target), ids, category, title,
+                     abstract)
 
 
 def generate_word_embedding(source, target, word2int_path):
     """
     Generate from pretrained word embedding file
     If a word not in embedding file, initial its embedding by N(0, 1)
+    The first call scans the pretrained file once and saves a word -> line
+    offset index next to it (see `glove_index_path`), later calls only read
+    the lines of vocabulary words.
     Args:
         source: path of pretrained word embedding file, e.g. glove.840B.300d.txt
         target: path for saving word embedding. Will be saved in numpy format
         word2int_path: vocabulary file when words in it will be searched in pretrained embedding file
     """
-    # na_filter=False is needed since nan is also a valid word
-    # word, int
-    word2int = pd.read_table(word2int_path, na_filter=False, index_col='word')
-    source_embedding = pd.read_table(source,
-                                     index_col=0,
-                                     sep=' ',
-                                     header=None,
-                                     quoting=csv.QUOTE_NONE,
-                                     names=range(config.word_embedding_dim))
-    # word, vector
-    source_embedding.index.rename('word', inplace=True)
-    # word, int, vector
-    merged = word2int.merge(source_embedding,
-                            how='inner',
-                            left_index=True,
-                            right_index=True)
-    merged.set_index('int', inplace=True)
-
-    missed_index = np.setdiff1d(np.arange(len(word2int) + 1),
-                                merged.index.values)
-    missed_embedding = pd.DataFrame(data=np.random.normal(
-        size=(len(missed_index), config.word_embedding_dim)))
-    missed_embedding['int'] = missed_index
-    missed_embedding.set_index('int', inplace=True)
-
-    final_embedding = pd.concat([merged, missed_embedding]).sort_index()
-    np.save(target, final_embedding.values)
+    word2int = Vocabulary(word2int_path, 'word').key2int
+    # Written in place, the whole table never needs to be held in memory
+    embedding = np.lib.format.open_memmap(target,
+                                          mode='w+',
+                                          dtype=np.float32,
+                                          shape=(len(word2int) + 1,
+                                                 config.word_embedding_dim))
+    for start in range(0, len(embedding), 65536):
+        block = embedding[start:start + 65536]
+        block[:] = np.random.normal(size=block.shape)
+
+    index = load_glove_index(source)
+    if index is None:
+        hit = scan_glove(source, word2int, embedding)
+    else:
+        hit = read_glove_lines(source, index, word2int, embedding)
+    embedding.flush()
 
     print(
-        f'Rate of word missed in pretrained embedding: {(len(missed_index)-1)/len(word2int):.4f}'
+        f'Rate of word missed in pretrained embedding: {(len(word2int)-hit)/len(word2int):.4f}'
     )
 
 
+def glove_index_path(source):
+    return f'{source}.index.npz'
+
+
+def load_glove_index(source):
+    """
+    Returns:
+        (words, offsets) of every line in source, or None if there is no
+        index or source changed since it was built
+    """
+    try:
+        index = np.load(glove_index_path(source))
+    except FileNotFoundError:
+        return None
+    stat = os.stat(source)
+    if index['size'] != stat.st_size or index['mtime'] != stat.st_mtime_ns:
+        return None
+    return index['words'].tobytes().decode('utf-8').split('\n'), index['offsets']
+
+
+def glove_word(line):
+    """
+    Returns:
+        word of a pretrained embedding line, in bytes
+    """
+    line = line.rstrip()
+    # A few words in glove.840B contain spaces, the vector is always the
+    # last word_embedding_dim fields
+    if line.count(b' ') == config.word_embedding_dim:
+        return line[:line.index(b' ')]
+    return line.rsplit(b' ', config.word_embedding_dim)[0]
+
+
+def glove_vector(line):
+    return np.array(line.rstrip().rsplit(b' ', config.word_embedding_dim)[1:],
+                    dtype=np.float32)
+
+
+def scan_glove(source, word2int, embedding):
+    """
+    Read source once, fill rows of vocabulary words into embedding and save
+    the index for `load_glove_index`.
+    Returns:
+        number of vocabulary words found
+    """
+    found = set()
+    words = []
+    offsets = []
+    with open(source, 'rb') as f:
+        offset = 0
+        for line in tqdm(f, desc="Scanning pretrained embedding"):
+            word = glove_word(line).decode('utf-8', errors='replace')
+            words.append(word)
+            offsets.append(offset)
+            offset += len(line)
+            if word in word2int and word not in found:
+                found.add(word)
+                embedding[word2int[word]] = glove_vector(line)
+
+    stat = os.stat(source)
+    np.savez(glove_index_path(source),
+             words=np.frombuffer('\n'.join(words).encode('utf-8'),
+                                 dtype=np.uint8),
+             offsets=np.array(offsets, dtype=np.int64),
+             size=stat.st_size,
+             mtime=stat.st_mtime_ns)
+    return len(found)
+
+
+def read_glove_lines(source, index, word2int, embedding):
+    """
+    Fill rows of vocabulary words into embedding, seeking to their lines.
+    Returns:
+        number of vocabulary words found
+    """
+    words, offsets = index
+    word2offset = {}
+    for word, offset in zip(words, offsets):
+        if word in word2int and word not in word2offset:
+            word2offset[word] = offset
+    with open(source, 'rb') as f:
+        # In file order, so reads go forward through the file
+        for word, offset in sorted(word2offset.items(), key=lambda x: x[1]):
+            f.seek(offset)
+            embedding[word2int[word]] = glove_vector(f.readline())
+    return len(word2offset)
+
+
+def word_embedding_rows(source, word2int_path, start):
+    """
+    Embedding rows of words with ids from start on, e.g. words appended to
+    the vocabulary after the pretrained embedding was generated or the
+    checkpoint was saved: their vector in the pretrained embedding file, or
+    zeros if it has none. Unlike `generate_word_embedding`, nothing is
+    random, so training and prediction give these words the same rows.
+    Args:
+        source: path of pretrained word embedding file, e.g. glove.840B.300d.txt
+        word2int_path: vocabulary file
+        start: first word id
+    Returns:
+        float32 array, (num_words - start) * word_embedding_dim
+    """
+    word2int = Vocabulary(word2int_path, 'word').key2int
+    rows = np.zeros((max(0,
+                         len(word2int) + 1 - start), config.word_embedding_dim),
+                    dtype=np.float32)
+    appended = {
+        word: int_ - start
+        for word, int_ in word2int.items() if int_ >= start
+    }
+    if not appended:
+        return rows
+    if not path.exists(source):
+        print(f'{source} not found, {len(appended)} new words get zeros')
+        return rows
+    index = load_glove_index(source)
+    if index is None:
+        scan_glove(source, appended, rows)
+    else:
+        read_glove_lines(source, index, appended, rows)
+    return rows
+
+
 def transform_entity_embedding(source, target, entity2int_path):
     """
     Args:
@@ -284,20 +598,21 @@ def transform_entity_embedding(source, target, entity2int_path):
 def data_process():
     nltk.download('punkt')
     data_dir = 'gs://newsnudge/data/predict'
+    train_dir = './data/train'
     print('\nProcess data for prediction')
 
     print('Parse news')
     parse_news(path.join(data_dir, 'news.tsv'),
                path.join(data_dir, 'news_parsed.tsv'),
-               path.join(data_dir, 'category2int.tsv'),
-               path.join(data_dir, 'word2int.tsv'),
+               path.join(train_dir, 'category2int.tsv'),
+               path.join(train_dir, 'word2int.tsv'),
                mode='predict')
 
 if __name__ == '__main__':
     nltk.download('punkt')
 
     data_dir = 'gs://newsnudge/data/predict'
-    # train_dir = '../data/train'
+    train_dir = './data/train'
     # val_dir = '../data/val'
     # test_dir = '../data/test'    
 
@@ -316,6 +631,17 @@ if __name__ == '__main__':
     #            path.join(train_dir, 'entity2int.tsv'),
     #            mode='train')
 
+    # print('Pack behaviors')
+    # pack_behaviors(path.join(train_dir, 'behaviors_parsed.tsv'),
+    #                path.join(train_dir, 'news_parsed.tsv'),
+    #                path.join(train_dir, 'behaviors_packed'))
+
+    # print('Compile training shards')
+    # compile_shards(path.join(train_dir, 'behaviors_packed'),
+    #                path.join(train_dir, 'shards'),
+    #                config.batch_size,
+    #                seed=config.shuffle_seed)
+
     # print('Generate word embedding')
     # generate_word_embedding(
     #     f'./data/glove/glove.840B.{config.word_embedding_dim}d.txt',
@@ -352,6 +678,6 @@ if __name__ == '__main__':
     print('Parse news')
     parse_news(path.join(data_dir, 'news.tsv'),
                path.join(data_dir, 'news_parsed.tsv'),
-               path.join(data_dir, 'category2int.tsv'),
-               path.join(data_dir, 'word2int.tsv'),
+               path.join(train_dir, 'category2int.tsv'),
+               path.join(train_dir, 'word2int.tsv'),
                mode='predict')
\ No newline at end of file
@@ -1,11 +1,15 @@
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, Sampler, get_worker_info
 import pandas as pd
 from ast import literal_eval
 from os import path
+import json
+import math
 import numpy as np
 from config import model_name
 import importlib
 import torch
+from news_store import (NewsStore, news_store_directory,
+                        behaviors_packed_directory, load_packed_behaviors)
 
 try:
     config = getattr(importlib.import_module('config'), f"{model_name}Config")
@@ -14,6 +18,29 @@ except AttributeError:
     exit()
 
 
+def load_news2dict(news_path):
+    """
+    Parse `news_parsed.tsv` into {id: {attribute: tensor}}.
+    Only used when there is no news store next to it.
+    """
+    # NAML에서는 category, subcategory, title, abstract 총 네 가지 feature 사용.
+    news_parsed = pd.read_table(
+        news_path,
+        index_col='id',
+        usecols=['id'] + config.dataset_attributes['news'],
+        converters={
+            attribute: literal_eval
+            for attribute in set(config.dataset_attributes['news']) & set([
+                'title', 'abstract', 'title_entities', 'abstract_entities'
+            ])
+        })
+    news2dict = news_parsed.to_dict('index')
+    for key1 in news2dict.keys():
+        for key2 in news2dict[key1].keys():
+            news2dict[key1][key2] = torch.tensor(news2dict[key1][key2])
+    return news2dict
+
+
 class BaseDataset(Dataset):
     def __init__(self, behaviors_path, news_path):
         # call the constructor of the parent class and ensure proper initialization of 
@@ -29,30 +56,27 @@ class BaseDataset(Dataset):
         assert all(attribute in ['user', 'clicked_news_length']
                    for attribute in config.dataset_attributes['record'])
 
-        self.behaviors_parsed = pd.read_table(behaviors_path)
-        # NAML에서는 category, subcategory, title, abstract 총 네 가지 feature 사용.
-        self.news_parsed = pd.read_table(
-            news_path,
-            index_col='id',
-            usecols=['id'] + config.dataset_attributes['news'],
-            converters={
-                attribute: literal_eval
-                for attribute in set(config.dataset_attributes['news']) & set([
-                    'title', 'abstract', 'title_entities', 'abstract_entities'
-                ])
-            })
-        
-        # 데이터셋 크기를 줄이려면 behaviors_parsed랑 news_parsed의 양을 줄이기.
-        # 아래 코드 사용.
-        self.behaviors_parsed = self.behaviors_parsed.iloc[:100]
-        # self.news_parsed = self.news_parsed.iloc[:1000]
-
-        self.news_id2int = {x: i for i, x in enumerate(self.news_parsed.index)}
-        self.news2dict = self.news_parsed.to_dict('index')
-        for key1 in self.news2dict.keys():
-            for key2 in self.news2dict[key1].keys():
-                self.news2dict[key1][key2] = torch.tensor(
-                    self.news2dict[key1][key2])
+        # Written by `pack_behaviors`, if it exists __getitem__ only slices arrays
+        self.behaviors_packed = load_packed_behaviors(
+            behaviors_packed_directory(behaviors_path))
+        if self.behaviors_packed is None:
+            self.behaviors_parsed = pd.read_table(behaviors_path)
+
+            # 데이터셋 크기를 줄이려면 behaviors_parsed랑 news_parsed의 양을 줄이기.
+            # 아래 코드 사용.
+            self.behaviors_parsed = self.behaviors_parsed.iloc[:100]
+
+        store_directory = news_store_directory(news_path)
+        if NewsStore.exists(store_directory):
+            # Memory-mapped, so startup doesn't depend on the number of news
+            self.news_store = NewsStore(store_directory)
+            self.news2dict = None
+        else:
+            self.news_store = None
+            self.news2dict = load_news2dict(news_path)
+            # Row of each news in news_parsed.tsv, like a news store row
+            self.news2int = {x: i + 1 for i, x in enumerate(self.news2dict)}
+
         padding_all = {
             'category': 0,
             'subcategory': 0,
@@ -70,26 +94,62 @@ class BaseDataset(Dataset):
             if k in config.dataset_attributes['news']
         }
 
+    def news(self, news_ids):
+        """
+        Args:
+            news_ids: list of news id strings
+        Returns:
+            list of {attribute: tensor}
+        """
+        if self.news_store is None:
+            return [self.news2dict[x] for x in news_ids]
+        rows = {
+            attribute: torch.from_numpy(value).long()
+            for attribute, value in self.news_store.get(
+                self.news_store.rows(news_ids),
+                config.dataset_attributes['news']).items()
+        }
+        return [{attribute: value[i]
+                 for attribute, value in rows.items()}
+                for i in range(len(news_ids))]
+
+    def news_rows(self, news_ids):
+        """
+        Args:
+            news_ids: list of news id strings
+        Returns:
+            int64 tensor of news rows, to tell the same news apart in a batch
+        """
+        if self.news_store is None:
+            return torch.tensor([self.news2int[x] for x in news_ids])
+        return torch.from_numpy(self.news_store.rows(news_ids).astype(
+            np.int64))
+
     def __len__(self):
+        if self.behaviors_packed is not None:
+            return len(self.behaviors_packed['candidate_news'])
         return len(self.behaviors_parsed)
 
     # clicked_news라는 사용 기록을 가진 user가
     # candidate_news라는 후보 기사들 중 어떤 것을 봤는지 추측하는 task.
     # 정답은 clicked.
     def __getitem__(self, idx):
+        if self.behaviors_packed is not None:
+            return self.packed_item(idx)
         item = {}
         row = self.behaviors_parsed.iloc[idx]
-        if 'user' in config.dataset_attributes['record']:
+        # In-batch negatives mask positives of the same user and news
+        if 'user' in config.dataset_attributes[
+                'record'] or config.in_batch_negatives:
             item['user'] = row.user
+        if config.in_batch_negatives:
+            item['candidate_news_id'] = self.news_rows(
+                row.candidate_news.split())
         item["clicked"] = list(map(int, row.clicked.split()))
-        item["candidate_news"] = [
-            self.news2dict[x] for x in row.candidate_news.split()
-        ]
+        item["candidate_news"] = self.news(row.candidate_news.split())
         # config.num_clicked_news_a_user가 50이므로 최대 50개 기록만 사용.
-        item["clicked_news"] = [
-            self.news2dict[x]
-            for x in row.clicked_news.split()[:config.num_clicked_news_a_user]
-        ]
+        item["clicked_news"] = self.news(
+            row.clicked_news.split()[:config.num_clicked_news_a_user])
         if 'clicked_news_length' in config.dataset_attributes['record']:
             item['clicked_news_length'] = len(item["clicked_news"])
         repeated_times = config.num_clicked_news_a_user - \
@@ -101,3 +161,210 @@ class BaseDataset(Dataset):
                                 ] * repeated_times + item["clicked_news"]
 
         return item
+
+    def packed_item(self, idx):
+        """
+        Unlike the tsv path, news are not split into a list of dicts, each
+        attribute is stacked instead:
+            candidate_news: {attribute: (1 + K) * ...}
+            clicked_news: {attribute: num_clicked_news_a_user * ...}
+        `NAML.forward` accepts both.
+        With `config.news_table` set, they are only news store row indices.
+        """
+        packed = self.behaviors_packed
+        item = {}
+        if 'user' in config.dataset_attributes[
+                'record'] or config.in_batch_negatives:
+            item['user'] = int(packed['user'][idx])
+        if config.in_batch_negatives:
+            item['candidate_news_id'] = torch.from_numpy(
+                packed['candidate_news'][idx].astype(np.int64))
+        item["clicked"] = torch.from_numpy(packed['clicked'][idx].astype(
+            np.int64))
+        # History is already left-padded with row 0, the padding news
+        for key in ['candidate_news', 'clicked_news']:
+            if config.news_table is not None:
+                # Gathered by the model, see `NAML.set_news_table`
+                item[key] = torch.from_numpy(packed[key][idx].astype(np.int64))
+                continue
+            item[key] = {
+                attribute: torch.from_numpy(value).long()
+                for attribute, value in self.news_store.get(
+                    packed[key][idx], config.dataset_attributes['news']).items()
+            }
+        if 'clicked_news_length' in config.dataset_attributes['record']:
+            item['clicked_news_length'] = int(
+                packed['clicked_news_length'][idx])
+        return item
+
+
+class ResumableSampler(Sampler):
+    """
+    Shuffled sampler whose position can be saved and restored, so resumed
+    training goes on from the sample it stopped at instead of replaying the
+    epoch. Every epoch is a permutation seeded by (seed, epoch), so it is the
+    same after a restart. With `num_replicas` > 1, each rank takes every
+    `num_replicas`-th index of the permutation, like DistributedSampler: the
+    permutation is padded by wrapping around until ranks get equally many.
+    """
+    def __init__(self, dataset, seed=0, num_replicas=1, rank=0):
+        self.dataset_size = len(dataset)
+        self.num_samples = math.ceil(self.dataset_size / num_replicas)
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        # Samples of this epoch consumed by training, counted by the caller
+        # since DataLoader workers prefetch ahead of it
+        self.position = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self.position = 0
+
+    def state_dict(self):
+        return {
+            'seed': self.seed,
+            'epoch': self.epoch,
+            'position': self.position
+        }
+
+    def load_state_dict(self, state_dict):
+        self.seed = state_dict['seed']
+        self.epoch = state_dict['epoch']
+        self.position = state_dict['position']
+
+    def __len__(self):
+        return self.num_samples - self.position
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        indices = torch.randperm(self.dataset_size, generator=generator)
+        padding = self.num_samples * self.num_replicas - self.dataset_size
+        indices = torch.cat(
+            [indices, indices[torch.arange(padding) % max(1, len(indices))]])
+        # Skipped indices are never handed to the dataset
+        return iter(indices[self.rank::self.num_replicas]
+                    [self.position:].tolist())
+
+
+class ShardDataset(IterableDataset):
+    """
+    Stream pre-collated minibatches from shards written by `compile_shards`.
+    Samples were shuffled once when compiling, each epoch only shuffles the
+    order of shards, seeded by (seed, epoch), and reads every shard forward.
+    Use it with `DataLoader(batch_size=None)`, items are whole minibatches
+    as `BaseDataset.packed_item` would be collated.
+
+    Minibatches are numbered in shard order. Rank r of `num_replicas` takes
+    every `num_replicas`-th of them and its DataLoader worker w every
+    `num_workers`-th of those, which the DataLoader yields round-robin, so
+    the order doesn't depend on the number of workers. Like
+    `ResumableSampler`, it has a position (in samples) to resume from.
+    """
+    def __init__(self, directory, news_path, seed=0, num_replicas=1, rank=0):
+        super(ShardDataset, self).__init__()
+        with open(path.join(directory, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        assert self.manifest['batch_size'] == config.batch_size, \
+            'Shards were compiled with another batch size, compile them again'
+        self.directory = directory
+        self.news_store = NewsStore(news_store_directory(news_path))
+        self.batch_size = self.manifest['batch_size']
+        self.num_batches = self.manifest['num_batches'] // num_replicas
+        self.num_samples = self.num_batches * self.batch_size
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self.position = 0
+
+    @staticmethod
+    def exists(directory):
+        return directory is not None and path.exists(
+            path.join(directory, 'manifest.json'))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self.position = 0
+
+    def state_dict(self):
+        return {
+            'seed': self.seed,
+            'epoch': self.epoch,
+            'position': self.position
+        }
+
+    def load_state_dict(self, state_dict):
+        self.seed = state_dict['seed']
+        self.epoch = state_dict['epoch']
+        self.position = state_dict['position']
+
+    def __len__(self):
+        """
+        Number of minibatches left in this epoch.
+        """
+        return self.num_batches - self.position // self.batch_size
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker = 0 if worker_info is None else worker_info.id
+        num_workers = 1 if worker_info is None else worker_info.num_workers
+
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        shards = torch.randperm(self.manifest['num_shards'],
+                                generator=generator).tolist()
+        # (shard, minibatch in shard) of every minibatch, in shard order
+        sizes = np.minimum(
+            self.manifest['num_batches'] -
+            np.array(shards) * self.manifest['batches_per_shard'],
+            self.manifest['batches_per_shard'])
+        batches = np.column_stack([
+            np.repeat(shards, sizes),
+            np.concatenate([np.arange(x) for x in sizes])
+        ])
+        batches = batches[self.rank::self.num_replicas][:self.num_batches]
+        batches = batches[self.position // self.batch_size:][worker::num_workers]
+
+        packed, packed_shard = None, None
+        for shard, batch in batches.tolist():
+            # Memory-mapped, a shard is opened once and read forward
+            if shard != packed_shard:
+                packed = load_packed_behaviors(
+                    path.join(self.directory, f'shard-{shard:05d}'))
+                packed_shard = shard
+            yield self.minibatch(
+                packed, slice(batch * self.batch_size,
+                              (batch + 1) * self.batch_size))
+
+    def minibatch(self, packed, rows):
+        """
+        Same keys and layout as a collated `BaseDataset.packed_item`.
+        """
+        item = {}
+        if 'user' in config.dataset_attributes[
+                'record'] or config.in_batch_negatives:
+            item['user'] = torch.from_numpy(packed['user'][rows].astype(
+                np.int64))
+        if config.in_batch_negatives:
+            item['candidate_news_id'] = torch.from_numpy(
+                packed['candidate_news'][rows].astype(np.int64))
+        item["clicked"] = torch.from_numpy(packed['clicked'][rows].astype(
+            np.int64))
+        for key in ['candidate_news', 'clicked_news']:
+            indices = packed[key][rows].astype(np.int64)
+            if config.news_table is not None:
+                item[key] = torch.from_numpy(indices)
+                continue
+            # One gather per attribute for the whole minibatch
+            item[key] = {
+                attribute: torch.from_numpy(value).long()
+                for attribute, value in self.news_store.get(
+                    indices, config.dataset_attributes['news']).items()
+            }
+        if 'clicked_news_length' in config.dataset_attributes['record']:
+            item['clicked_news_length'] = torch.from_numpy(
+                packed['clicked_news_length'][rows].astype(np.int64))
+        return item
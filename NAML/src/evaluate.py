@@ -3,13 +3,17 @@ from sklearn.metrics import roc_auc_score
 from tqdm import tqdm
 import torch
 from config import model_name
-from torch.utils.data import Dataset, DataLoader
 from os import path
 import sys
 import pandas as pd
 from ast import literal_eval
+from news_store import NewsStore, news_store_directory
 import importlib
-from multiprocessing import Pool
+from itertools import chain
+from metrics import RunningMetrics
+import io
+import copy
+import torch.multiprocessing as mp
 
 try:
     Model = getattr(importlib.import_module(f"model.{model_name}"), model_name)
@@ -48,113 +52,248 @@ def value2rank(d):
     return {k: ranks[i] + 1 for i, k in enumerate(d.keys())}
 
 
-class NewsDataset(Dataset):
+class FileRange(io.RawIOBase):
     """
-    Load news for evaluation.
+    Bytes start to end of a file, read as a file of its own.
     """
-    def __init__(self, news_path):
-        super(NewsDataset, self).__init__()
-        self.news_parsed = pd.read_table(
-            news_path,
-            usecols=['id'] + config.dataset_attributes['news'],
-            converters={
-                attribute: literal_eval
-                for attribute in set(config.dataset_attributes['news']) & set([
-                    'title', 'abstract', 'title_entities', 'abstract_entities'
-                ])
-            })
-        self.news2dict = self.news_parsed.to_dict('index')
-        for key1 in self.news2dict.keys():
-            for key2 in self.news2dict[key1].keys():
-                if type(self.news2dict[key1][key2]) != str:
-                    self.news2dict[key1][key2] = torch.tensor(
-                        self.news2dict[key1][key2])
+    def __init__(self, file_path, start, end):
+        self.file = open(file_path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
 
-    def __len__(self):
-        return len(self.news_parsed)
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = self.file.readinto(memoryview(buffer)[:self.remaining])
+        self.remaining -= size
+        return size
 
-    def __getitem__(self, idx):
-        item = self.news2dict[idx]
-        return item
+    def close(self):
+        self.file.close()
+        super(FileRange, self).close()
 
 
-class UserDataset(Dataset):
+def shard_behaviors(behaviors_path, num_shards, max_count=sys.maxsize):
     """
-    Load users for evaluation, duplicated rows will be dropped
+    Split behaviors.tsv into byte ranges of whole lines of about equal size,
+    so processes can each read their own shard.
+    Args:
+        max_count: like `evaluate`, only the first max_count - 1 lines
+    Returns:
+        list of (start, end) byte offsets, without empty shards
     """
-    def __init__(self, behaviors_path, user2int_path):
-        super(UserDataset, self).__init__()
-        self.behaviors = pd.read_table(behaviors_path,
-                                       header=None,
-                                       usecols=[1, 3],
-                                       names=['user', 'clicked_news'])
-        self.behaviors.clicked_news.fillna(' ', inplace=True)
-        self.behaviors.drop_duplicates(inplace=True)
-        user2int = dict(pd.read_table(user2int_path).values.tolist())
-        user_total = 0
-        user_missed = 0
-        for row in self.behaviors.itertuples():
-            user_total += 1
-            if row.user in user2int:
-                self.behaviors.at[row.Index, 'user'] = user2int[row.user]
-            else:
-                user_missed += 1
-                self.behaviors.at[row.Index, 'user'] = 0
-        if model_name == 'LSTUR':
-            print(f'User miss rate: {user_missed/user_total:.4f}')
-
-    def __len__(self):
-        return len(self.behaviors)
-
-    def __getitem__(self, idx):
-        row = self.behaviors.iloc[idx]
-        item = {
-            "user":
-            row.user,
-            "clicked_news_string":
-            row.clicked_news,
-            "clicked_news":
-            row.clicked_news.split()[:config.num_clicked_news_a_user]
+    with open(behaviors_path, 'rb') as f:
+        if max_count == sys.maxsize:
+            size = path.getsize(behaviors_path)
+        else:
+            for _ in range(max_count - 1):
+                if not f.readline():
+                    break
+            size = f.tell()
+        boundaries = [0]
+        for i in range(1, num_shards):
+            # Move to the start of the next line
+            f.seek(max(size * i // num_shards, boundaries[-1] + 1) - 1)
+            f.readline()
+            boundaries.append(min(f.tell(), size))
+        boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries[:-1], boundaries[1:])
+            if start < end]
+
+
+def load_news(news_path):
+    """
+    Load parsed news for evaluation, from the news store next to
+    `news_parsed.tsv` if it exists.
+    Returns:
+        ids: news ids, row 0 is the padding news
+        {attribute: int tensor}, num_news + 1 rows, row 0 is padding
+    """
+    store_directory = news_store_directory(news_path)
+    if NewsStore.exists(store_directory):
+        news_store = NewsStore(store_directory)
+        return np.asarray(news_store.ids), {
+            attribute: torch.from_numpy(value)
+            for attribute, value in news_store.get(
+                slice(None), config.dataset_attributes['news']).items()
         }
-        item['clicked_news_length'] = len(item["clicked_news"])
-        repeated_times = config.num_clicked_news_a_user - len(
-            item["clicked_news"])
-        assert repeated_times >= 0
-        item["clicked_news"] = ['PADDED_NEWS'
-                                ] * repeated_times + item["clicked_news"]
-
-        return item
-
-
-class BehaviorsDataset(Dataset):
+    news_parsed = pd.read_table(
+        news_path,
+        usecols=['id'] + config.dataset_attributes['news'],
+        converters={
+            attribute: literal_eval
+            for attribute in set(config.dataset_attributes['news']) & set([
+                'title', 'abstract', 'title_entities', 'abstract_entities'
+            ])
+        })
+    news = {}
+    for attribute in config.dataset_attributes['news']:
+        value = torch.tensor(news_parsed[attribute].tolist())
+        news[attribute] = torch.cat(
+            [torch.zeros((1, ) + value.shape[1:], dtype=value.dtype), value])
+    return np.concatenate([[''], news_parsed.id.values.astype(str)]), news
+
+
+class EvaluationData():
     """
-    Load behaviors for evaluation, (user, time) pair as session
+    News, user histories and impressions of a split, parsed once and kept in
+    memory, so evaluating it repeatedly (e.g. validation during training)
+    only encodes and scores.
+
+    News are rows of `news`, row 0 is padding and stands for unknown news.
+    Users are told apart by their click history, as users with the same
+    history get the same vector, clicked_news holds the news rows of each
+    history as a tensor to gather news vectors with. Impressions are flattened:
+        candidate_news[offsets[i]:offsets[i + 1]] are the news rows of
+        impression i, clicked the labels (None without labels), history[i]
+        the row of its user in clicked_news
+    With chunk_size, only news are kept and histories and impressions are
+    those of the current chunk of `chunks`, so memory is set by chunk_size
+    rather than the number of impressions. With behaviors_range, a (start,
+    end) byte range of whole lines of behaviors.tsv (see `shard_behaviors`),
+    `chunks` only reads that shard.
     """
-    def __init__(self, behaviors_path):
-        super(BehaviorsDataset, self).__init__()
-        self.behaviors = pd.read_table(behaviors_path,
-                                       header=None,
-                                       usecols=range(5),
-                                       names=[
-                                           'impression_id', 'user', 'time',
-                                           'clicked_news', 'impressions'
-                                       ])
-        self.behaviors.clicked_news.fillna(' ', inplace=True)
-        self.behaviors.impressions = self.behaviors.impressions.str.split()
+    def __init__(self,
+                 directory,
+                 max_count=sys.maxsize,
+                 user2int_path='data/train/user2int.tsv',
+                 chunk_size=None,
+                 load_behaviors=True):
+        """
+        Args:
+            directory: the directory that contains two files (behaviors.tsv, news_parsed.tsv)
+            max_count: like `evaluate`, only the first max_count - 1
+                impressions are used
+            chunk_size: if set, impressions are not loaded here but chunk by
+                chunk of chunk_size impressions by `chunks`
+            load_behaviors: if False, impressions are not loaded here either,
+                e.g. when processes load shards of them
+        """
+        self.directory = directory
+        self.max_count = max_count
+        self.chunk_size = chunk_size
+        self.behaviors_range = None
+        self.news_ids, self.news = load_news(
+            path.join(directory, 'news_parsed.tsv'))
+        # The first row of duplicated ids is used
+        self.news_row = pd.Series(np.arange(len(self.news_ids)),
+                                  index=self.news_ids)
+        self.news_row = self.news_row[~self.news_row.index.duplicated()]
+        self.user2int = dict(pd.read_table(user2int_path).values.tolist())
+        if chunk_size is None and load_behaviors:
+            self.parse_behaviors(
+                self.read_behaviors(path.join(directory, 'behaviors.tsv')))
+
+    def open_behaviors(self):
+        """
+        Returns:
+            binary file of behaviors.tsv, or of its lines in behaviors_range
+        """
+        file_path = path.join(self.directory, 'behaviors.tsv')
+        if self.behaviors_range is None:
+            return open(file_path, 'rb')
+        return io.BufferedReader(FileRange(file_path, *self.behaviors_range))
+
+    def read_behaviors(self, source, chunk_size=None):
+        """
+        Args:
+            source: path or binary file of behaviors
+        Returns:
+            DataFrame of behaviors, or an iterator of DataFrames of
+            chunk_size impressions
+        """
+        return pd.read_table(source,
+                             header=None,
+                             usecols=range(5),
+                             names=[
+                                 'impression_id', 'user', 'time',
+                                 'clicked_news', 'impressions'
+                             ],
+                             # Shards already end at max_count
+                             nrows=None if self.max_count == sys.maxsize or
+                             self.behaviors_range is not None else
+                             self.max_count - 1,
+                             chunksize=chunk_size)
+
+    def parse_behaviors(self, behaviors):
+        """
+        Set the user histories and impressions of a DataFrame of behaviors.
+        """
+        behaviors['clicked_news'] = behaviors.clicked_news.fillna(' ')
+
+        self.history, clicked_news = pd.factorize(behaviors.clicked_news)
+        first = np.unique(self.history, return_index=True)[1]
+        user = behaviors.user.iloc[first].map(self.user2int)
+        if model_name == 'LSTUR':
+            print(f'User miss rate: {user.isna().mean():.4f}')
+        self.user = torch.from_numpy(user.fillna(0).values.astype(np.int64))
+        self.clicked_news, self.clicked_news_length = self.pad_histories(
+            [x.split()[:config.num_clicked_news_a_user] for x in clicked_news])
+
+        impressions = behaviors.impressions.str.split()
+        length = impressions.str.len().values
+        self.offsets = np.concatenate([[0], np.cumsum(length)])
+        impressions = np.array(list(chain.from_iterable(impressions)),
+                               dtype=str)
+        news, _, clicked = np.char.partition(impressions, '-').T
+        self.candidate_news = self.rows(news)
+        # Impressions to predict have no labels
+        self.clicked = clicked.astype(np.int8) if np.all(
+            clicked != '') else None
+
+    def chunks(self):
+        """
+        Iterate over the impressions, all at once or chunk_size at a time.
+        Each chunk replaces the histories and impressions of the previous
+        one, so only one chunk is held in memory.
+        Returns:
+            iterator of self with the impressions of each chunk
+        """
+        if self.chunk_size is None and self.behaviors_range is None:
+            yield self
+            return
+        with self.open_behaviors() as f:
+            behaviors = self.read_behaviors(f, self.chunk_size)
+            for chunk in [behaviors] if self.chunk_size is None else behaviors:
+                self.parse_behaviors(chunk)
+                yield self
+
+    def rows(self, news_ids):
+        """
+        Returns:
+            int64 array of news rows, 0 for unknown news
+        """
+        return self.news_row.reindex(news_ids).fillna(0).values.astype(
+            np.int64)
+
+    def pad_histories(self, clicked_news):
+        """
+        Args:
+            clicked_news: list of news id lists
+        Returns:
+            news rows, len(clicked_news) * num_clicked_news_a_user,
+                left-padded with 0
+            history lengths
+        """
+        length = np.fromiter(map(len, clicked_news),
+                             dtype=np.int64,
+                             count=len(clicked_news))
+        row = np.repeat(np.arange(len(clicked_news)), length)
+        # Position of each news in its history
+        rank = np.arange(len(row)) - np.repeat(np.cumsum(length) - length,
+                                               length)
+        matrix = np.zeros((len(clicked_news), config.num_clicked_news_a_user),
+                          dtype=np.int64)
+        matrix[row, config.num_clicked_news_a_user - length[row] +
+               rank] = self.rows(list(chain.from_iterable(clicked_news)))
+        return torch.from_numpy(matrix), torch.from_numpy(length)
 
     def __len__(self):
-        return len(self.behaviors)
-
-    def __getitem__(self, idx):
-        row = self.behaviors.iloc[idx]
-        item = {
-            "impression_id": row.impression_id,
-            "user": row.user,
-            "time": row.time,
-            "clicked_news_string": row.clicked_news,
-            "impressions": row.impressions
-        }
-        return item
+        """
+        Number of impressions (of the current chunk).
+        """
+        return len(self.offsets) - 1
 
 
 def calculate_single_user_metric(pair):
@@ -169,107 +308,230 @@ def calculate_single_user_metric(pair):
 
 
 @torch.no_grad()
-def evaluate(model, directory, num_workers, max_count=sys.maxsize):
+def get_news_vectors(model, news):
+    """
+    Args:
+        news: {attribute: tensor}, row 0 is padding, see `load_news`
+    Returns:
+        (shape) num_news + 1, num_filters, row 0 is zeros for padding and
+        unknown news
+    """
+    batch_size = config.batch_size * 16
+    news_vectors = [
+        model.get_news_vector(
+            {k: v[start:start + batch_size].long()
+             for k, v in news.items()})
+        for start in tqdm(range(1, len(next(iter(news.values()))),
+                                batch_size),
+                          desc="Calculating vectors for news")
+    ]
+    return torch.cat([torch.zeros_like(news_vectors[0][:1])] + news_vectors)
+
+
+@torch.no_grad()
+def get_user_vectors(model,
+                     news_vector,
+                     clicked_news,
+                     user,
+                     clicked_news_length,
+                     progress=True):
+    """
+    Args:
+        news_vector: num_news + 1, num_filters, see `get_news_vectors`
+        clicked_news: num_users, num_clicked_news_a_user (news rows)
+        user, clicked_news_length: num_users, only used by LSTUR
+        progress: show a progress bar
+    Returns:
+        (shape) num_users, num_filters
+    """
+    batch_size = config.batch_size * 16
+    user_vectors = []
+    for start in tqdm(range(0, len(clicked_news), batch_size),
+                      desc="Calculating vectors for users",
+                      disable=not progress):
+        end = start + batch_size
+        # batch_size, num_clicked_news_a_user, num_filters
+        clicked_news_vector = news_vector[clicked_news[start:end].to(
+            news_vector.device)]
+        if model_name == 'LSTUR':
+            user_vectors.append(
+                model.get_user_vector(user[start:end],
+                                      clicked_news_length[start:end],
+                                      clicked_news_vector))
+        else:
+            user_vectors.append(model.get_user_vector(clicked_news_vector))
+    return torch.cat(user_vectors)
+
+
+@torch.no_grad()
+def score_impressions(news_vector,
+                      user_vector,
+                      candidate_news,
+                      history,
+                      offsets,
+                      batch_size=8192,
+                      progress=True):
+    """
+    Score flattened impressions (see `EvaluationData`) in batches of
+    candidates: gather candidate and user vectors, then a row-wise dot
+    product, as `DotProductClickPredictor` does per impression.
+    Args:
+        news_vector: num_news + 1, num_filters, see `get_news_vectors`
+        user_vector: num_users, num_filters, see `get_user_vectors`
+        candidate_news: news rows of all impressions
+        history: user row of each impression
+        offsets: num_impressions + 1
+        batch_size: number of candidates scored at a time
+        progress: show a progress bar
+    Returns:
+        float64 array of click probabilities, aligned with candidate_news
+    """
+    # User row of each candidate
+    user = np.repeat(history, np.diff(offsets))
+    y_pred = []
+    for start in tqdm(range(0, len(candidate_news), batch_size),
+                      desc="Calculating probabilities",
+                      disable=not progress):
+        end = start + batch_size
+        candidate_news_vector = news_vector[torch.from_numpy(
+            candidate_news[start:end]).to(news_vector.device)]
+        candidate_user_vector = user_vector[torch.from_numpy(
+            user[start:end]).to(user_vector.device)]
+        y_pred.append((candidate_news_vector *
+                       candidate_user_vector).sum(dim=-1).cpu())
+    if not y_pred:
+        return np.zeros(0)
+    return torch.cat(y_pred).double().numpy()
+
+
+@torch.no_grad()
+def evaluate_chunks(model, news_vector, data, progress=True):
+    """
+    Score the impressions of data chunk by chunk (see `EvaluationData.chunks`).
+    Args:
+        news_vector: num_news + 1, num_filters, see `get_news_vectors`
+        progress: show progress bars, of chunks if there are chunks
+    Returns:
+        RunningMetrics of the impressions
+    """
+    metrics = RunningMetrics((5, 10))
+    chunks = data.chunks()
+    if progress and data.chunk_size is not None:
+        chunks = tqdm(chunks, desc="Evaluating chunks")
+        progress = False
+    for chunk in chunks:
+        user_vector = get_user_vectors(model,
+                                       news_vector,
+                                       chunk.clicked_news,
+                                       chunk.user,
+                                       chunk.clicked_news_length,
+                                       progress=progress)
+        y_pred = score_impressions(news_vector,
+                                   user_vector,
+                                   chunk.candidate_news,
+                                   chunk.history,
+                                   chunk.offsets,
+                                   progress=progress)
+        metrics.update(chunk.clicked, y_pred, chunk.offsets)
+    return metrics
+
+
+# Set in each process of sharded evaluation by `init_shard_worker`
+shard_worker = {}
+
+
+def init_shard_worker(model, news_vector, data, config_values, num_threads):
+    """
+    Args:
+        config_values: {name: value} of the caller's config, as it may have
+            been changed at runtime and workers import config afresh
+    """
+    for key, value in config_values.items():
+        setattr(config, key, value)
+    torch.set_num_threads(num_threads)
+    shard_worker.update(model=model, news_vector=news_vector, data=data)
+
+
+def evaluate_shard(behaviors_range):
+    """
+    Score the impressions of a shard of behaviors.tsv in a worker process.
+    Returns:
+        RunningMetrics of the shard
+    """
+    model, news_vector, data = (shard_worker['model'],
+                                shard_worker['news_vector'],
+                                shard_worker['data'])
+    data.behaviors_range = behaviors_range
+    return evaluate_chunks(model, news_vector, data, progress=False)
+
+
+def evaluate_sharded(model, news_vector, data, num_workers):
+    """
+    Split behaviors.tsv into shards scored by num_workers processes, which
+    share the news vectors (and model weights) instead of copying them, and
+    add up their partial metric sums.
+    """
+    shards = shard_behaviors(path.join(data.directory, 'behaviors.tsv'),
+                             num_workers * 4, data.max_count)
+    # Workers only need news rows and user ids, news are encoded already
+    data.news = None
+    news_vector.share_memory_()
+    # Shared by the workers without changing the caller's model
+    model = copy.deepcopy(model).share_memory()
+    config_values = {
+        key: getattr(config, key)
+        for key in dir(config) if not key.startswith('__')
+    }
+    metrics = RunningMetrics((5, 10))
+    with mp.get_context('spawn').Pool(
+            processes=num_workers,
+            initializer=init_shard_worker,
+            initargs=(model, news_vector, data, config_values,
+                      max(1, torch.get_num_threads() // num_workers))) as pool:
+        for shard_metrics in tqdm(pool.imap_unordered(evaluate_shard, shards),
+                                  total=len(shards),
+                                  desc="Evaluating shards"):
+            metrics.merge(shard_metrics)
+    return metrics.result()
+
+
+def evaluate(model,
+             directory,
+             num_workers,
+             max_count=sys.maxsize,
+             data=None,
+             chunk_size=None):
     """
     Evaluate model on target directory.
     Args:
         model: model to be evaluated
         directory: the directory that contains two files (behaviors.tsv, news_parsed.tsv)
-        num_workers: processes number for calculating metrics
+        num_workers: number of processes. With more than one (and data not
+            given), news are encoded once here and processes score shards
+            of behaviors.tsv, see `evaluate_sharded`
+        data: EvaluationData of directory and max_count if already built,
+            e.g. kept by training for validation
+        chunk_size: if set (and data not given), stream behaviors.tsv (or
+            each shard) in chunks of chunk_size impressions, scoring each
+            chunk and keeping only running sums of the metrics
     Returns:
         AUC
         MRR
         nDCG@5
         nDCG@10
     """
-    news_dataset = NewsDataset(path.join(directory, 'news_parsed.tsv'))
-    news_dataloader = DataLoader(news_dataset,
-                                 batch_size=config.batch_size * 16,
-                                 shuffle=False,
-                                 num_workers=config.num_workers,
-                                 drop_last=False,
-                                 pin_memory=True)
-
-    news2vector = {}
-    for minibatch in tqdm(news_dataloader,
-                          desc="Calculating vectors for news"):
-        news_ids = minibatch["id"]
-        if any(id not in news2vector for id in news_ids):
-            news_vector = model.get_news_vector(minibatch)
-            for id, vector in zip(news_ids, news_vector):
-                if id not in news2vector:
-                    news2vector[id] = vector
-
-    news2vector['PADDED_NEWS'] = torch.zeros(
-        list(news2vector.values())[0].size())
-
-    user_dataset = UserDataset(path.join(directory, 'behaviors.tsv'),
-                               'data/train/user2int.tsv')
-    user_dataloader = DataLoader(user_dataset,
-                                 batch_size=config.batch_size * 16,
-                                 shuffle=False,
-                                 num_workers=config.num_workers,
-                                 drop_last=False,
-                                 pin_memory=True)
-
-    user2vector = {}
-    for minibatch in tqdm(user_dataloader,
-                          desc="Calculating vectors for users"):
-        user_strings = minibatch["clicked_news_string"]
-        if any(user_string not in user2vector for user_string in user_strings):
-            clicked_news_vector = torch.stack([
-                torch.stack([news2vector[x].to(device) for x in news_list],
-                            dim=0) for news_list in minibatch["clicked_news"]
-            ],
-                                              dim=0).transpose(0, 1)
-            if model_name == 'LSTUR':
-                user_vector = model.get_user_vector(
-                    minibatch['user'], minibatch['clicked_news_length'],
-                    clicked_news_vector)
-            else:
-                user_vector = model.get_user_vector(clicked_news_vector)
-            for user, vector in zip(user_strings, user_vector):
-                if user not in user2vector:
-                    user2vector[user] = vector
-
-    behaviors_dataset = BehaviorsDataset(path.join(directory, 'behaviors.tsv'))
-    behaviors_dataloader = DataLoader(behaviors_dataset,
-                                      batch_size=1,
-                                      shuffle=False,
-                                      num_workers=config.num_workers)
-
-    count = 0
-
-    tasks = []
-
-    for minibatch in tqdm(behaviors_dataloader,
-                          desc="Calculating probabilities"):
-        count += 1
-        if count == max_count:
-            break
-
-        candidate_news_vector = torch.stack([
-            news2vector[news[0].split('-')[0]]
-            for news in minibatch['impressions']
-        ],
-                                            dim=0)
-        user_vector = user2vector[minibatch['clicked_news_string'][0]]
-        click_probability = model.get_prediction(candidate_news_vector,
-                                                 user_vector)
-
-        y_pred = click_probability.tolist()
-        y_true = [
-            int(news[0].split('-')[1]) for news in minibatch['impressions']
-        ]
-
-        tasks.append((y_true, y_pred))
-
-    with Pool(processes=num_workers) as pool:
-        results = pool.map(calculate_single_user_metric, tasks)
-
-    aucs, mrrs, ndcg5s, ndcg10s = np.array(results).T
-    return np.nanmean(aucs), np.nanmean(mrrs), np.nanmean(ndcg5s), np.nanmean(
-        ndcg10s)
+    sharded = data is None and num_workers > 1
+    if data is None:
+        # Shards are parsed by the workers
+        data = EvaluationData(directory,
+                              max_count,
+                              chunk_size=chunk_size,
+                              load_behaviors=not sharded)
+
+    news_vector = get_news_vectors(model, data.news)
+    if sharded:
+        return evaluate_sharded(model, news_vector, data, num_workers)
+    return evaluate_chunks(model, news_vector, data).result()
 
 
 if __name__ == '__main__':
@@ -278,17 +540,20 @@ if __name__ == '__main__':
     # Don't need to load pretrained word/entity/context embedding
     # since it will be loaded from checkpoint later
     model = Model(config).to(device)
-    from train import latest_checkpoint  # Avoid circular imports
+    from train import latest_checkpoint, load_checkpoint  # Avoid circular imports
     checkpoint_path = latest_checkpoint(path.join('./checkpoint', model_name))
     if checkpoint_path is None:
         print('No checkpoint file found!')
         exit()
     print(f"Load saved parameters in {checkpoint_path}")
-    checkpoint = torch.load(checkpoint_path)
+    checkpoint = load_checkpoint(checkpoint_path)
     model.load_state_dict(checkpoint['model_state_dict'])
     model.eval()
-    auc, mrr, ndcg5, ndcg10 = evaluate(model, './data/test',
-                                       config.num_workers)
+    auc, mrr, ndcg5, ndcg10 = evaluate(
+        model,
+        './data/test',
+        config.num_evaluate_workers,
+        chunk_size=config.num_impressions_evaluate_chunk)
     print(
         f'AUC: {auc:.4f}\nMRR: {mrr:.4f}\nnDCG@5: {ndcg5:.4f}\nnDCG@10: {ndcg10:.4f}'
     )
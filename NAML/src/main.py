@@ -1,16 +1,16 @@
 import numpy as np
 from sklearn.metrics import roc_auc_score
-from tqdm import tqdm
 import torch
 from config import model_name
 from google.cloud import storage
-from torch.utils.data import Dataset, DataLoader
-from data_preprocess import data_process
+from data_preprocess import data_process, word_embedding_rows
+from evaluate import (EvaluationData, get_news_vectors, get_user_vectors,
+                      score_impressions)
 import os
 from os import path
 import sys
 import pandas as pd
-from ast import literal_eval
+from vocab import load_vocab_manifest
 import importlib
 from multiprocessing import Pool
 import csv
@@ -36,214 +36,47 @@ except AttributeError:
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
 
-class NewsDataset(Dataset):
-    """
-    Load news for prediction.
-    """
-    def __init__(self, news_path):
-        super(NewsDataset, self).__init__()
-        self.news_predict_parsed = pd.read_table(
-            news_path,
-            usecols=['id'] + config.dataset_attributes['news'],
-            converters={
-                attribute: literal_eval
-                for attribute in set(config.dataset_attributes['news']) & set([
-                    'title', 'abstract'])
-            })
-        self.news2dict = self.news_predict_parsed.to_dict('index')
-        for key1 in self.news2dict.keys():
-            for key2 in self.news2dict[key1].keys():
-                if type(self.news2dict[key1][key2]) != str:
-                    self.news2dict[key1][key2] = torch.tensor(
-                        self.news2dict[key1][key2])
-
-    def __len__(self):
-        return len(self.news_predict_parsed)
-
-    def __getitem__(self, idx):
-        item = self.news2dict[idx]
-        return item
-
-
-class UserDataset(Dataset):
-    """
-    Load users for evaluation, duplicated rows will be dropped
-    """
-    def __init__(self, behaviors_path, user2int_path):
-        super(UserDataset, self).__init__()
-        self.behaviors = pd.read_table(behaviors_path,
-                                       header=None,
-                                       usecols=[1, 3],
-                                       names=['user', 'clicked_news'])
-        self.behaviors.clicked_news.fillna(' ', inplace=True)
-        self.behaviors.drop_duplicates(inplace=True)
-        user2int = dict(pd.read_table(user2int_path).values.tolist())
-        user_total = 0
-        user_missed = 0
-        for row in self.behaviors.itertuples():
-            user_total += 1
-            if row.user in user2int:
-                self.behaviors.at[row.Index, 'user'] = user2int[row.user]
-            else:
-                user_missed += 1
-                self.behaviors.at[row.Index, 'user'] = 0
-
-    def __len__(self):
-        return len(self.behaviors)
-
-    def __getitem__(self, idx):
-        row = self.behaviors.iloc[idx]
-        item = {
-            "user":
-            row.user,
-            "clicked_news_string":
-            row.clicked_news,
-            "clicked_news":
-            row.clicked_news.split()[:config.num_clicked_news_a_user]
-        }
-        item['clicked_news_length'] = len(item["clicked_news"])
-        repeated_times = config.num_clicked_news_a_user - len(
-            item["clicked_news"])
-        assert repeated_times >= 0
-        item["clicked_news"] = ['PADDED_NEWS'
-                                ] * repeated_times + item["clicked_news"]
-
-        return item
-
-
-class BehaviorsDataset(Dataset):
-    """
-    Load behaviors for evaluation, (user, time) pair as session
-    """
-    def __init__(self, behaviors_path):
-        super(BehaviorsDataset, self).__init__()
-        self.behaviors = pd.read_table(behaviors_path,
-                                       header=None,
-                                       usecols=range(5),
-                                       names=[
-                                           'impression_id', 'user', 'time',
-                                           'clicked_news', 'impressions'
-                                       ])
-        self.behaviors.clicked_news.fillna(' ', inplace=True)
-        self.behaviors.impressions = self.behaviors.impressions.str.split()
-
-    def __len__(self):
-        return len(self.behaviors)
-
-    def __getitem__(self, idx):
-        row = self.behaviors.iloc[idx]
-        item = {
-            "impression_id": row.impression_id,
-            "user": row.user,
-            "time": row.time,
-            "clicked_news_string": row.clicked_news,
-            "impressions": row.impressions
-        }
-        return item
-
 @torch.no_grad()
 def predict(model, directory, num_workers, max_count=sys.maxsize):
     """
     Predict model on target directory.
     Args:
         model: model to be predicted
-        directory: the directory that contains two files (behaviors.tsv, news_predict_parsed.tsv)
-        num_workers: processes number for calculating metrics
+        directory: the directory that contains four files (behaviors.tsv, news.tsv, news_parsed.tsv, user2int.tsv)
+        num_workers: not used, kept for the signature of `evaluate`
     Returns:
-        AUC
-        MRR
-        nDCG@5
-        nDCG@10
+        {category: news id} of the candidate news with the highest click
+        probability in each category, for the last impression
     """
-    news_dataset = NewsDataset(path.join(directory, 'news_parsed.tsv'))
-    news_dataloader = DataLoader(news_dataset,
-                                 batch_size=config.batch_size,
-                                 shuffle=False,
-                                 num_workers=config.num_workers,
-                                 drop_last=False,
-                                 pin_memory=True)
-
-    news2vector = {}
-    for minibatch in tqdm(news_dataloader,
-                          desc="Calculating vectors for news"):
-        news_ids = minibatch['id']
-        if any(id not in news2vector for id in news_ids):
-            news_vector = model.get_news_vector(minibatch)
-            for id, vector in zip(news_ids, news_vector):
-                if id not in news2vector:
-                    news2vector[id] = vector
-
-    news2vector['PADDED_NEWS'] = torch.zeros(
-        list(news2vector.values())[0].size())
-    
-    print('check if news2vector works properly:',news2vector.items())
-
-    user_dataset = UserDataset(path.join(directory, 'behaviors.tsv'),
-                               path.join(directory, 'user2int.tsv'))
-    user_dataloader = DataLoader(user_dataset,
-                                 batch_size=config.batch_size,
-                                 shuffle=False,
-                                 num_workers=config.num_workers,
-                                 drop_last=False,
-                                 pin_memory=True)
-    
-    user2vector = {}
-    for minibatch in tqdm(user_dataloader,
-                          desc="Calculating vectors for users"):
-        user_strings = minibatch["clicked_news_string"]
-        if any(user_string not in user2vector for user_string in user_strings):
-            clicked_news_vector = torch.stack([
-                torch.stack([news2vector[x].to(device) for x in news_list],
-                            dim=0) for news_list in minibatch["clicked_news"]
-            ],
-                                              dim=0).transpose(0, 1)
-            user_vector = model.get_user_vector(clicked_news_vector)
-            for user, vector in zip(user_strings, user_vector):
-                if user not in user2vector:
-                    user2vector[user] = vector
-
-    print('check if user2vector works properly:', user2vector.items())
-
-    behaviors_dataset = BehaviorsDataset(path.join(directory, 'behaviors.tsv'))
-    behaviors_dataloader = DataLoader(behaviors_dataset,
-                                      batch_size=1,
-                                      shuffle=False,
-                                      num_workers=config.num_workers)
-
-    count = 0
-
-    for minibatch in tqdm(behaviors_dataloader,
-                          desc="Calculating probabilities"):
-        count += 1
-        if count == max_count:
-            break
-
-        news_index = [news[0] for news in minibatch['impressions']]
-        candidate_news_vector = torch.stack([news2vector[news[0]] for news in minibatch['impressions']], dim=0)
-        user_vector = user2vector[minibatch['clicked_news_string'][0]]
-        click_probability = model.get_prediction(candidate_news_vector,
-                                                 user_vector)
-
-        y_pred = click_probability.tolist()
-
-        prediction = {news_index[i]: y_pred[i] for i in range(len(news_index))}
-
-        news = pd.read_table(path.join(directory, 'news.tsv'),
-                            header=0,
-                            usecols=[0, 2, 6, 7],
-                            quoting=csv.QUOTE_NONE,
-                            names=[
-                                'id', 'category', 'title',
-                                'abstract'
-                            ])
-        news.fillna(' ', inplace=True)             
-
-        category_to_news = {}
-
-        for news_id, prediction_value in prediction.items():
-            category = news[news['id']==news_id]['category'].iloc[0]
-            if category not in category_to_news or prediction_value > prediction[category_to_news[category]]:
-                category_to_news[category] = news_id
+    data = EvaluationData(directory, max_count,
+                          path.join(directory, 'user2int.tsv'))
+    news_vector = get_news_vectors(model, data.news)
+    user_vector = get_user_vectors(model, news_vector, data.clicked_news,
+                                   data.user, data.clicked_news_length)
+    # All impressions are scored in batches of candidates
+    y_pred = score_impressions(news_vector, user_vector, data.candidate_news,
+                               data.history, data.offsets)
+
+    news = pd.read_table(path.join(directory, 'news.tsv'),
+                         header=0,
+                         usecols=[0, 2, 6, 7],
+                         quoting=csv.QUOTE_NONE,
+                         names=[
+                             'id', 'category', 'title',
+                             'abstract'
+                         ])
+    news.fillna(' ', inplace=True)
+    news2category = news.drop_duplicates('id').set_index('id').category
+
+    start, end = data.offsets[-2:]
+    news_index = data.news_ids[data.candidate_news[start:end]].tolist()
+    prediction = dict(zip(news_index, y_pred[start:end]))
+
+    category_to_news = {}
+    for news_id, prediction_value in prediction.items():
+        category = news2category[news_id]
+        if category not in category_to_news or prediction_value > prediction[category_to_news[category]]:
+            category_to_news[category] = news_id
 
     return category_to_news
 
@@ -306,18 +139,36 @@ def make_prediction(request):
     print('Using device:', device)
     print(f'Evaluating model {model_name}')
 
-    model = Model(config).to(device)
-
-    from train import latest_checkpoint 
+    data_process()
+    file_path = 'gs://newsnudge/data/predict' 
+    # The crawled news may have added words and categories to the training
+    # vocabulary, the embeddings of the checkpoint grow to the new sizes when
+    # loaded
+    word2int_path = './data/train/word2int.tsv'
+    for key, value in load_vocab_manifest(word2int_path).items():
+        setattr(config, key, value)
+
+    from train import latest_checkpoint, load_checkpoint
     checkpoint_path = latest_checkpoint(path.join('./checkpoint', model_name))
 
     if checkpoint_path is not None:
-        checkpoint = torch.load(checkpoint_path)
+        checkpoint = load_checkpoint(checkpoint_path)
+        # Words the checkpoint has not seen get their pretrained vector (or
+        # zeros), the same rows as in training, rather than random ones
+        num_words_saved = next(
+            len(value) for key, value in checkpoint['model_state_dict'].items()
+            if key.endswith('word_embedding.weight'))
+        pretrained_word_embedding = torch.zeros(config.num_words,
+                                                config.word_embedding_dim)
+        pretrained_word_embedding[num_words_saved:] = torch.from_numpy(
+            word_embedding_rows(config.word_embedding_source,
+                                word2int_path, num_words_saved))
+        model = Model(config, pretrained_word_embedding).to(device)
         model.load_state_dict(checkpoint['model_state_dict'])
+    else:
+        model = Model(config).to(device)
 
     model.eval()
-    data_process()
-    file_path = 'gs://newsnudge/data/predict' 
     recommendations = predict(model, file_path, config.num_workers) # recommendations = predict(model, './data/predict', config.num_workers)
     print(recommendations)
     print('Recommendation process finished. Started to write an email content.')
@@ -0,0 +1,112 @@
+import numpy as np
+
+
+def impression_metrics(y_true, y_score, offsets, ks=(5, 10)):
+    """
+    AUC, MRR and nDCG@k of every impression of ragged arrays, with a single
+    lexsort by (impression, score) instead of sorting per impression.
+    Same as `roc_auc_score`, `mrr_score` and `ndcg_score` of `evaluate`,
+    including NaN for all metrics of impressions with only one class. Tied
+    scores count half for AUC, and are ranked later index first for MRR and
+    nDCG, as a stable argsort reversed would.
+    Args:
+        y_true: 0/1 labels of all candidates
+        y_score: scores of all candidates
+        offsets: num_impressions + 1, candidates of impression i are
+            offsets[i]:offsets[i + 1]
+        ks: cutoffs of nDCG
+    Returns:
+        auc: num_impressions
+        mrr: num_impressions
+        {k: nDCG@k}: num_impressions each. Without candidates, e.g. an
+        empty chunk, every impression is NaN
+    """
+    offsets = np.asarray(offsets)
+    num_impressions = max(len(offsets) - 1, 0)
+    if np.size(y_score) == 0:
+        nan = np.full(num_impressions, np.nan)
+        return nan, nan.copy(), {k: nan.copy() for k in ks}
+    length = np.diff(offsets)
+    impression = np.repeat(np.arange(num_impressions), length)
+    # Ascending by score within each impression, ties in index order.
+    # Impressions stay where they were, so offsets still apply.
+    order = np.lexsort((y_score, impression))
+    score = np.asarray(y_score)[order]
+    label = np.asarray(y_true)[order].astype(np.float64)
+    # 0-based ascending position within the impression
+    position = np.arange(len(order)) - np.repeat(offsets[:-1], length)
+
+    positives = np.bincount(impression, weights=label, minlength=num_impressions)
+    negatives = length - positives
+
+    # Mann-Whitney U with mid-ranks of tied scores
+    tie_start = np.flatnonzero(
+        np.r_[True, (score[1:] != score[:-1]) |
+              (impression[1:] != impression[:-1])])
+    tie_size = np.diff(np.r_[tie_start, len(score)])
+    mid_rank = np.repeat(position[tie_start] + (tie_size + 1) / 2, tie_size)
+    rank_sum = np.bincount(impression,
+                           weights=mid_rank * label,
+                           minlength=num_impressions)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        auc = (rank_sum - positives *
+               (positives + 1) / 2) / (positives * negatives)
+
+        # 1-based rank from the top
+        rank = length[impression] - position
+        mrr = np.bincount(impression,
+                          weights=label / rank,
+                          minlength=num_impressions) / positives
+
+        # Ideal DCG@k puts all positives on top
+        ideal = np.r_[0, np.cumsum(1 / np.log2(np.arange(max(ks)) + 2))]
+        ndcg = {}
+        for k in ks:
+            dcg = np.bincount(impression,
+                              weights=np.where(rank <= k,
+                                               (2**label - 1) / np.log2(rank + 1),
+                                               0),
+                              minlength=num_impressions)
+            ndcg[k] = dcg / ideal[np.minimum(positives, k).astype(np.int64)]
+
+    single_class = (positives == 0) | (negatives == 0)
+    for metric in [auc, mrr] + list(ndcg.values()):
+        metric[single_class] = np.nan
+    return auc, mrr, ndcg
+
+
+class RunningMetrics():
+    """
+    Mean AUC, MRR and nDCG@k over impressions added batch by batch, kept as
+    sums and a count. Impressions with only one class are left out, like
+    `np.nanmean` of the per-impression metrics. Partial results, e.g. of
+    several processes, add up with `merge`.
+    """
+    def __init__(self, ks=(5, 10)):
+        self.ks = ks
+        self.sums = np.zeros(2 + len(ks))
+        self.count = 0
+
+    def update(self, y_true, y_score, offsets):
+        """
+        Add impressions, arguments like `impression_metrics`.
+        """
+        auc, mrr, ndcg = impression_metrics(y_true, y_score, offsets, self.ks)
+        # NaN for all metrics or none
+        valid = ~np.isnan(auc)
+        self.sums += np.stack([auc, mrr] + [ndcg[k] for k in self.ks],
+                              axis=1)[valid].sum(axis=0)
+        self.count += int(valid.sum())
+
+    def merge(self, other):
+        self.sums += other.sums
+        self.count += other.count
+
+    def result(self):
+        """
+        Returns:
+            AUC, MRR, nDCG@k for each k
+        """
+        if self.count == 0:
+            return (np.nan, ) * len(self.sums)
+        return tuple(self.sums / self.count)
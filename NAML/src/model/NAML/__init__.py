@@ -4,6 +4,13 @@ from model.NAML.user_encoder import UserEncoder
 from model.general.click_predictor.dot_product import DotProductClickPredictor
 
 
+def stack_news(news):
+    """
+    [{attribute: batch_size * ...}] * num_news -> {attribute: batch_size * num_news * ...}
+    """
+    return {k: torch.stack([x[k] for x in news], dim=1) for k in news[0]}
+
+
 class NAML(torch.nn.Module):
     """
     NAML network.
@@ -15,8 +22,48 @@ class NAML(torch.nn.Module):
         self.news_encoder = NewsEncoder(config, pretrained_word_embedding)
         self.user_encoder = UserEncoder(config)
         self.click_predictor = DotProductClickPredictor()
+        # Not a buffer, so it is neither saved in checkpoints nor moved by `to`
+        self.news_table = None
+        self.num_news_encoded = None
+
+    def set_news_table(self, news_store, location='device'):
+        """
+        Hold all news so forward can take news row indices instead of news.
+        Args:
+            news_store: NewsStore
+            location: 'device' to keep it on the device of the model,
+                'pinned' to keep it in pinned CPU memory
+        """
+        device = next(self.parameters()).device
+        self.news_table = {}
+        for attribute, value in news_store.get(
+                slice(None), self.config.dataset_attributes['news']).items():
+            value = torch.from_numpy(value)
+            if location == 'device':
+                value = value.to(device)
+            elif device.type == 'cuda':
+                value = value.pin_memory()
+            self.news_table[attribute] = value
+
+    def gather_news(self, indices):
+        """
+        Args:
+            indices: news row indices, any shape
+        Returns:
+            {attribute: indices.shape * ...}, on the device of the model
+        """
+        device = next(self.parameters()).device
+        return {
+            attribute: value[indices.to(value.device)].to(
+                device, non_blocking=True).long()
+            for attribute, value in self.news_table.items()
+        }
 
-    def forward(self, candidate_news, clicked_news):
+    def forward(self,
+                candidate_news,
+                clicked_news,
+                candidate_news_id=None,
+                user=None):
         """
         Args:
             candidate_news:
@@ -37,22 +84,109 @@ class NAML(torch.nn.Module):
                         "abstract": batch_size * num_words_abstract
                     } * num_clicked_news_a_user
                 ]
+            both can also be given stacked, as yielded by `BaseDataset.packed_item`
+                {
+                    "category": batch_size * num_clicked_news_a_user,
+                    "title": batch_size * num_clicked_news_a_user * num_words_title,
+                    ...
+                }
+            or as news row indices (batch_size * num_news) if `set_news_table`
+            was called
+            candidate_news_id, user: only used with `config.in_batch_negatives`,
+                see `predict_clicks`. Not needed for news row indices
         Returns:
-            click_probability: batch_size
+            click_probability: batch_size, 1 + K (see `predict_clicks`)
         """
+        if self.config.deduplicate_news and torch.is_tensor(
+                candidate_news) and torch.is_tensor(clicked_news):
+            candidate_news_vector, clicked_news_vector = self.encode_unique(
+                candidate_news, clicked_news)
+            user_vector = self.user_encoder(clicked_news_vector)
+            return self.predict_clicks(candidate_news_vector, user_vector,
+                                       candidate_news, user)
+        # Row indices, to tell the same news in different samples apart
+        if torch.is_tensor(candidate_news):
+            candidate_news_id = candidate_news
+        if torch.is_tensor(candidate_news):
+            candidate_news = self.gather_news(candidate_news)
+        if torch.is_tensor(clicked_news):
+            clicked_news = self.gather_news(clicked_news)
+        if isinstance(candidate_news, list):
+            candidate_news = stack_news(candidate_news)
+        if isinstance(clicked_news, list):
+            clicked_news = stack_news(clicked_news)
+        num_candidate_news = next(iter(candidate_news.values())).size(1)
+        # All candidate and clicked news are encoded in one call
+        # batch_size, 1 + K + num_clicked_news_a_user, ...
+        news = {
+            k: torch.cat([v, clicked_news[k]], dim=1)
+            for k, v in candidate_news.items()
+        }
+        batch_size, num_news = next(iter(news.values())).shape[:2]
+        # batch_size * (1 + K + num_clicked_news_a_user), num_filters
+        news_vector = self.news_encoder(
+            {k: v.flatten(0, 1)
+             for k, v in news.items()})
         # batch_size, 1 + K, num_filters
-        candidate_news_vector = torch.stack(
-            [self.news_encoder(x) for x in candidate_news], dim=1)
+        candidate_news_vector = news_vector.view(batch_size, num_news,
+                                                 -1)[:, :num_candidate_news]
         # batch_size, num_clicked_news_a_user, num_filters
-        clicked_news_vector = torch.stack(
-            [self.news_encoder(x) for x in clicked_news], dim=1)
+        clicked_news_vector = news_vector.view(batch_size, num_news,
+                                               -1)[:, num_candidate_news:]
         # batch_size, num_filters
         user_vector = self.user_encoder(clicked_news_vector)
         # batch_size, 1 + K
-        click_probability = self.click_predictor(candidate_news_vector,
-                                                 user_vector)
+        click_probability = self.predict_clicks(candidate_news_vector,
+                                                user_vector, candidate_news_id,
+                                                user)
         return click_probability
 
+    def predict_clicks(self,
+                       candidate_news_vector,
+                       user_vector,
+                       candidate_news_id=None,
+                       user=None):
+        """
+        With `config.in_batch_negatives` in training, candidates of the other
+        samples in the minibatch are scored as extra negatives, see
+        `DotProductClickPredictor.in_batch`. The positive stays at 0.
+        Args:
+            candidate_news_vector: batch_size, 1 + K, num_filters
+            user_vector: batch_size, num_filters
+            candidate_news_id: batch_size, 1 + K (news row indices) or None
+            user: batch_size, user ids or None. Positives of samples of the
+                same user (and candidates of the same news) are masked out of
+                the in-batch negatives
+        Returns:
+            click_probability: batch_size, 1 + K, or in training with
+                `config.in_batch_negatives` batch_size, batch_size * (1 + K)
+        """
+        if self.training and self.config.in_batch_negatives:
+            return self.click_predictor.in_batch(candidate_news_vector,
+                                                 user_vector,
+                                                 candidate_news_id, user)
+        return self.click_predictor(candidate_news_vector, user_vector)
+
+    def encode_unique(self, candidate_news, clicked_news):
+        """
+        Encode each distinct news of the minibatch once and scatter the vectors
+        back. Repeated news (popular articles, the padding news) share one
+        dropout mask in training, unlike encoding each slot separately.
+        Args:
+            candidate_news: batch_size, 1 + K (news row indices)
+            clicked_news: batch_size, num_clicked_news_a_user (news row indices)
+        Returns:
+            (shape) batch_size, 1 + K, num_filters
+            (shape) batch_size, num_clicked_news_a_user, num_filters
+        """
+        indices = torch.cat([candidate_news, clicked_news], dim=1)
+        unique, inverse = torch.unique(indices, return_inverse=True)
+        # Number of news slots and distinct news, for measuring saved work
+        self.num_news_encoded = (indices.numel(), unique.numel())
+        news_vector = self.news_encoder(self.gather_news(unique))
+        return news_vector[inverse.to(news_vector.device)].split(
+            [candidate_news.size(1), clicked_news.size(1)], dim=1)
+
     def get_news_vector(self, news):
         """
         Args:
@@ -23,10 +23,26 @@ class TextEncoder(torch.nn.Module):
         text_vector = F.dropout(self.word_embedding(text),
                                 p=self.dropout_probability,
                                 training=self.training)
-        # batch_size, num_filters, num_words_title
-        convoluted_text_vector = self.CNN(
-            text_vector.unsqueeze(dim=1)).squeeze(dim=3)
-        # batch_size, num_filters, num_words_title
+        return self.encode(text_vector)
+
+    def encode(self, text_vector):
+        """
+        Args:
+            text_vector: batch_size, num_words_text, word_embedding_dim
+                (already looked up and dropped out)
+        Returns:
+            (shape) batch_size, num_filters
+        """
+        # The Conv2d kernel spans the whole embedding, so it is a Conv1d over
+        # words with embedding dims as channels. Its weights are used as is,
+        # so checkpoints are unchanged.
+        # batch_size, num_filters, num_words_text
+        convoluted_text_vector = F.conv1d(
+            text_vector.transpose(1, 2),
+            self.CNN.weight.squeeze(dim=1).transpose(1, 2),
+            self.CNN.bias,
+            padding=self.CNN.padding[0])
+        # batch_size, num_filters, num_words_text
         activated_text_vector = F.dropout(F.relu(convoluted_text_vector),
                                           p=self.dropout_probability,
                                           training=self.training)
@@ -54,10 +70,23 @@ class NewsEncoder(torch.nn.Module):
         if pretrained_word_embedding is None:
             word_embedding = nn.Embedding(config.num_words,
                                           config.word_embedding_dim,
-                                          padding_idx=0)
+                                          padding_idx=0,
+                                          sparse=config.sparse_embedding)
         else:
+            # Words appended to the vocabulary after the pretrained embedding
+            # was generated get zeros, unless the caller already added their
+            # rows (see `data_preprocess.word_embedding_rows`)
+            pretrained_word_embedding = torch.cat([
+                pretrained_word_embedding,
+                torch.zeros(
+                    max(0, config.num_words - len(pretrained_word_embedding)),
+                    config.word_embedding_dim)
+            ])
             word_embedding = nn.Embedding.from_pretrained(
-                pretrained_word_embedding, freeze=False, padding_idx=0)
+                pretrained_word_embedding,
+                freeze=False,
+                padding_idx=0,
+                sparse=config.sparse_embedding)
         assert len(config.dataset_attributes['news']) > 0
         text_encoders_candidates = ['title', 'abstract']
         self.text_encoders = nn.ModuleDict({
@@ -70,7 +99,8 @@ class NewsEncoder(torch.nn.Module):
         })
         category_embedding = nn.Embedding(config.num_categories,
                                           config.category_embedding_dim,
-                                          padding_idx=0)
+                                          padding_idx=0,
+                                          sparse=config.sparse_embedding)
         element_encoders_candidates = ['category']
         self.element_encoders = nn.ModuleDict({
             name:
@@ -82,6 +112,50 @@ class NewsEncoder(torch.nn.Module):
         if len(config.dataset_attributes['news']) > 1:
             self.final_attention = AdditiveAttention(config.query_vector_dim,
                                                      config.num_filters)
+        self.pretrained_word_embedding = pretrained_word_embedding is not None
+        self._register_load_state_dict_pre_hook(self.grow_embeddings)
+
+    def grow_embeddings(self, state_dict, prefix, *args):
+        """
+        Load checkpoints saved before the vocabulary grew: saved rows are
+        loaded as usual. Appended rows of the word embedding keep their
+        pretrained rows if it was built from one, all other appended rows are
+        zeros, never their random initialization.
+        """
+        for name, module in self.named_modules(remove_duplicate=False):
+            key = f'{prefix}{name}.weight'
+            if isinstance(module, nn.Embedding) and key in state_dict:
+                saved = state_dict[key]
+                if len(saved) < module.num_embeddings:
+                    if self.pretrained_word_embedding and name.endswith(
+                            'word_embedding'):
+                        grown = module.weight.detach().clone()
+                    else:
+                        grown = torch.zeros_like(module.weight)
+                    grown[:len(saved)] = saved
+                    state_dict[key] = grown
+
+    def encode_texts(self, texts):
+        """
+        All text encoders share one word embedding, so title and abstract
+        words are looked up (and dropped out) together, then split up again.
+        Args:
+            texts: [batch_size * num_words_text] in the order of text_encoders
+        Returns:
+            [batch_size * num_filters]
+        """
+        if not texts:
+            return []
+        encoders = list(self.text_encoders.values())
+        # batch_size, sum of num_words_text, word_embedding_dim
+        text_vector = F.dropout(encoders[0].word_embedding(
+            torch.cat(texts, dim=1)),
+                                p=self.config.dropout_probability,
+                                training=self.training)
+        return [
+            encoder.encode(x) for encoder, x in zip(
+                encoders, text_vector.split([x.size(1) for x in texts], dim=1))
+        ]
 
     def forward(self, news):
         """
@@ -95,12 +169,10 @@ class NewsEncoder(torch.nn.Module):
         Returns:
             (shape) batch_size, num_filters
         """
-        text_vectors = [
-            encoder(news[name].to(device))
-            for name, encoder in self.text_encoders.items()
-        ]
+        text_vectors = self.encode_texts(
+            [news[name].to(device, non_blocking=True) for name in self.text_encoders])
         element_vectors = [
-            encoder(news[name].to(device))
+            encoder(news[name].to(device, non_blocking=True))
             for name, encoder in self.element_encoders.items()
         ]
 
@@ -17,3 +17,64 @@ class DotProductClickPredictor(torch.nn.Module):
         probability = torch.bmm(candidate_news_vector,
                                 user_vector.unsqueeze(dim=-1)).squeeze(dim=-1)
         return probability
+
+    def in_batch(self,
+                 candidate_news_vector,
+                 user_vector,
+                 candidate_news=None,
+                 user=None):
+        """
+        Score every user against the candidates of every sample in the batch,
+        so the candidates of other samples are extra negatives. Candidates of
+        other samples which are the positive (first candidate) of a sample of
+        the same user, e.g. of the same impression, or the same news as one,
+        are masked out, as they are not negatives.
+        Args:
+            candidate_news_vector: batch_size, candidate_size, X
+            user_vector: batch_size, X
+            candidate_news: batch_size, candidate_size, news ids (e.g. row
+                indices). Without them, only the positives themselves are
+                masked, not other candidates of the same news
+            user: batch_size, user ids. Without them, only the sample's own
+                positive is masked
+        Returns:
+            (shape): batch_size, batch_size * candidate_size. The sample's own
+            candidates come first, then those of the samples after it (wrapping
+            around), so the first candidate stays at 0
+        """
+        batch_size, candidate_size = candidate_news_vector.shape[:2]
+        device = candidate_news_vector.device
+        # batch_size, batch_size * candidate_size
+        probability = torch.matmul(
+            user_vector,
+            candidate_news_vector.flatten(0, 1).transpose(0, 1))
+
+        if candidate_news is None:
+            # Every candidate only equals itself
+            candidate_news = torch.arange(batch_size * candidate_size,
+                                          device=device)
+        candidate_news = candidate_news.to(device).flatten()
+        if user is None:
+            same_user = torch.eye(batch_size, dtype=torch.bool, device=device)
+        else:
+            user = user.to(device)
+            same_user = user.unsqueeze(dim=0) == user.unsqueeze(dim=1)
+        # batch_size, batch_size * candidate_size, whether a candidate is the
+        # positive of each sample
+        positive = candidate_news.view(
+            batch_size, candidate_size)[:, :1] == candidate_news.unsqueeze(
+                dim=0)
+        # Positives of any sample of the same user
+        false_negative = torch.matmul(same_user.float(), positive.float()) > 0
+
+        # Sample b sees samples b, b + 1, ..., b - 1
+        order = (torch.arange(batch_size, device=device).unsqueeze(dim=0) +
+                 torch.arange(batch_size, device=device).unsqueeze(dim=1)
+                 ) % batch_size
+        index = (order.unsqueeze(dim=-1) * candidate_size +
+                 torch.arange(candidate_size, device=device)).flatten(1)
+        probability = probability.gather(1, index)
+        false_negative = false_negative.gather(1, index)
+        # The sample's own candidates are labelled by its impression
+        false_negative[:, :candidate_size] = False
+        return probability.masked_fill(false_negative, float('-inf'))
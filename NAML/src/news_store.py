@@ -0,0 +1,131 @@
+import numpy as np
+import json
+from os import path
+from pathlib import Path
+
+
+class NewsStore():
+    """
+    Memory-mapped columnar store of parsed news, written by `parse_news`.
+    Row 0 is the padding news, so a row index of 0 can be used for padding
+    and for news missing from the store.
+    """
+    columns = ['category', 'title', 'abstract']
+
+    def __init__(self, directory):
+        with open(path.join(directory, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        # Opened with mmap_mode so nothing is read until it is sliced
+        for column in self.columns:
+            setattr(self, column,
+                    np.load(path.join(directory, f'{column}.npy'),
+                            mmap_mode='r'))
+        self.ids = np.load(path.join(directory, 'id.npy'), mmap_mode='r')
+        # Sorted ids and their rows, for id -> row lookup by binary search
+        self.sorted_ids = np.load(path.join(directory, 'sorted_id.npy'),
+                                  mmap_mode='r')
+        self.sorted_rows = np.load(path.join(directory, 'sorted_row.npy'),
+                                   mmap_mode='r')
+
+    def __len__(self):
+        """
+        Number of rows, including the padding row.
+        """
+        return len(self.ids)
+
+    @staticmethod
+    def exists(directory):
+        return path.exists(path.join(directory, 'manifest.json'))
+
+    def rows(self, news_ids):
+        """
+        Args:
+            news_ids: iterable of news id strings
+        Returns:
+            int64 array of row indices, 0 for unknown ids
+        """
+        news_ids = np.asarray(news_ids, dtype=str)
+        if len(self.sorted_ids) == 0:
+            return np.zeros(len(news_ids), dtype=np.int64)
+        position = np.searchsorted(self.sorted_ids, news_ids)
+        position[position == len(self.sorted_ids)] = 0
+        found = self.sorted_ids[position] == news_ids
+        return np.where(found, self.sorted_rows[position], 0).astype(np.int64)
+
+    def get(self, rows, attributes):
+        """
+        Args:
+            rows: int or array of row indices
+            attributes: e.g. config.dataset_attributes['news']
+        Returns:
+            {attribute: numpy array} copied out of the memory map
+        """
+        return {
+            attribute: np.array(getattr(self, attribute)[rows])
+            for attribute in attributes if attribute in self.columns
+        }
+
+
+def news_store_directory(news_path):
+    """
+    The store lives next to the `news_parsed.tsv` it mirrors.
+    """
+    return path.join(path.dirname(news_path), 'news_store')
+
+
+def write_news_store(directory, ids, category, title, abstract):
+    """
+    Write parsed news as a columnar store readable by `NewsStore`.
+    Args:
+        directory: target directory, created if missing
+        ids: news ids, num_news
+        category: num_news
+        title: num_news * num_words_title
+        abstract: num_news * num_words_abstract
+    """
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    ids = np.concatenate([[''], np.asarray(ids, dtype=str)])
+    columns = {
+        'category': np.asarray(category, dtype=np.int32),
+        'title': np.asarray(title, dtype=np.int32),
+        'abstract': np.asarray(abstract, dtype=np.int32)
+    }
+    for name, values in columns.items():
+        padding = np.zeros((1, ) + values.shape[1:], dtype=np.int32)
+        np.save(path.join(directory, f'{name}.npy'),
+                np.concatenate([padding, values]))
+    np.save(path.join(directory, 'id.npy'), ids)
+    # Skip the padding row, it is never looked up by id
+    order = np.argsort(ids[1:], kind='stable') + 1
+    np.save(path.join(directory, 'sorted_id.npy'), ids[order])
+    np.save(path.join(directory, 'sorted_row.npy'), order.astype(np.int64))
+    with open(path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(
+            {
+                'num_news': len(ids) - 1,
+                'num_words_title': columns['title'].shape[1],
+                'num_words_abstract': columns['abstract'].shape[1]
+            }, f)
+
+
+def behaviors_packed_directory(behaviors_path):
+    """
+    Packed behaviors live next to the `behaviors_parsed.tsv` they mirror.
+    """
+    return path.join(path.dirname(behaviors_path), 'behaviors_packed')
+
+
+def load_packed_behaviors(directory):
+    """
+    Returns:
+        {name: memory-mapped array} written by `pack_behaviors`, or None
+    """
+    if not path.exists(path.join(directory, 'candidate_news.npy')):
+        return None
+    return {
+        name: np.load(path.join(directory, f'{name}.npy'), mmap_mode='r')
+        for name in [
+            'user', 'clicked_news', 'clicked_news_length', 'candidate_news',
+            'clicked'
+        ]
+    }
@@ -0,0 +1,160 @@
+import os
+import resource
+import time
+from contextlib import contextmanager
+from os import path
+
+import torch
+
+
+def to_device(minibatch, device):
+    """
+    Move tensors in a (nested) minibatch to device.
+    """
+    if torch.is_tensor(minibatch):
+        return minibatch.to(device, non_blocking=True)
+    if isinstance(minibatch, dict):
+        return {key: to_device(value, device) for key, value in minibatch.items()}
+    if isinstance(minibatch, list):
+        return [to_device(value, device) for value in minibatch]
+    return minibatch
+
+
+def peak_memory(device):
+    """
+    Returns:
+        peak bytes allocated on a CUDA device since the last reset, or peak
+        resident memory of the process on CPU
+    """
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device)
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class TrainingProfiler():
+    """
+    Break training steps into phases and write their mean time, samples/sec
+    (of all ranks) and peak memory to TensorBoard. CUDA kernels run asynchronously, so on
+    CUDA the phases are only timed exactly with `synchronize`, which waits
+    for the device at every phase boundary.
+
+    Also captures torch.profiler traces of a window of steps into the log
+    directory, for `profile_batches` = (first, last) or on demand, by
+    touching `profile` in the log directory while training runs.
+    """
+    phases = ['data_wait', 'host_to_device', 'forward', 'backward', 'optimizer']
+
+    def __init__(self,
+                 writer,
+                 device,
+                 synchronize=False,
+                 profile_batches=None,
+                 num_batches_profile=10,
+                 num_replicas=1):
+        """
+        Args:
+            writer: SummaryWriter, or None to only time the phases
+            device: device of the model
+            num_replicas: number of DDP ranks. They step in lockstep, so
+                samples/sec of all ranks is that of this rank times it
+        """
+        self.writer = writer
+        self.num_replicas = num_replicas
+        self.device = device
+        self.synchronize = synchronize and device.type == 'cuda'
+        self.profile_batches = profile_batches
+        self.num_batches_profile = num_batches_profile
+        self.trace = None
+        self.trace_last = None
+        self.reset()
+
+    def reset(self):
+        self.totals = dict.fromkeys(self.phases, 0.0)
+        self.num_steps = 0
+        self.num_samples = 0
+        self.start = time.perf_counter()
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+
+    @contextmanager
+    def phase(self, name):
+        if self.synchronize:
+            torch.cuda.synchronize(self.device)
+        start = time.perf_counter()
+        try:
+            if self.trace is None:
+                yield
+            else:
+                # Named ranges in the trace
+                with torch.profiler.record_function(name):
+                    yield
+        finally:
+            if self.synchronize:
+                torch.cuda.synchronize(self.device)
+            self.totals[name] += time.perf_counter() - start
+
+    def start_step(self, i):
+        """
+        Start capturing a trace if batch i starts a window.
+        """
+        if self.writer is None or self.trace is not None:
+            return
+        if self.profile_batches is not None and i == self.profile_batches[0]:
+            last = self.profile_batches[1]
+        elif path.exists(self.trigger_path()):
+            os.remove(self.trigger_path())
+            last = i + self.num_batches_profile - 1
+        else:
+            return
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.device.type == 'cuda':
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.trace = torch.profiler.profile(
+            activities=activities,
+            record_shapes=True,
+            profile_memory=True,
+            on_trace_ready=torch.profiler.tensorboard_trace_handler(
+                self.writer.log_dir))
+        self.trace.start()
+        self.trace_last = last
+        print(f'Profile batches {i} to {last}')
+
+    def end_step(self, i, batch_size):
+        self.num_steps += 1
+        self.num_samples += batch_size
+        if self.trace is not None:
+            self.trace.step()
+            if i >= self.trace_last:
+                # Written by the trace handler
+                self.trace.stop()
+                self.trace = None
+
+    def trigger_path(self):
+        return path.join(self.writer.log_dir, 'profile')
+
+    def log(self, step):
+        """
+        Write means since the last call and reset them.
+        Returns:
+            samples/sec of all ranks since the last call
+        """
+        elapsed = time.perf_counter() - self.start
+        samples_per_second = self.num_samples * self.num_replicas / elapsed
+        if self.writer is not None and self.num_steps > 0:
+            for name, total in self.totals.items():
+                self.writer.add_scalar(f'Time/{name}',
+                                       total / self.num_steps * 1000, step)
+            self.writer.add_scalar('Time/step', elapsed / self.num_steps * 1000,
+                                   step)
+            self.writer.add_scalar('Throughput/samples_per_second',
+                                   samples_per_second, step)
+            self.writer.add_scalar('Memory/peak_mb',
+                                   peak_memory(self.device) / 2**20, step)
+        self.reset()
+        return samples_per_second
+
+    def close(self):
+        if self.trace is not None:
+            self.trace.stop()
+            self.trace = None
@@ -1,15 +1,20 @@
 from torch.utils.data import DataLoader
-from dataset import BaseDataset
+from dataset import BaseDataset, ResumableSampler, ShardDataset
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
 import time
 import numpy as np
 from config import model_name
 from tqdm import tqdm
 import os
 from pathlib import Path
-from evaluate import evaluate
+from evaluate import evaluate, EvaluationData
+from checkpoint import CheckpointWriter, latest_checkpoint, load_checkpoint
+from profiler import TrainingProfiler, to_device
+from torch.utils.tensorboard import SummaryWriter
 import importlib
 import datetime
 
@@ -28,7 +33,7 @@ class EarlyStopping:
     def __init__(self, patience=5):
         self.patience = patience
         self.counter = 0
-        self.best_loss = np.Inf
+        self.best_loss = np.inf
 
     def __call__(self, val_loss):
         """
@@ -51,26 +56,203 @@ class EarlyStopping:
         return early_stop, get_better
 
 
-def latest_checkpoint(directory):
-    if not os.path.exists(directory):
-        return None
-    all_checkpoints = {
-        int(x.split('.')[-2].split('-')[-1]): x
-        for x in os.listdir(directory)
-    }
-    if not all_checkpoints:
+def grow_optimizer_state(optimizer):
+    """
+    Zero-pad optimizer state (e.g. Adam moments) of embeddings that grew since
+    the checkpoint was saved, see `NewsEncoder.grow_embeddings`.
+    """
+    for group in optimizer.param_groups:
+        for parameter in group['params']:
+            state = optimizer.state.get(parameter, {})
+            for key, value in state.items():
+                if torch.is_tensor(value) and value.dim() > 0 and len(
+                        value) < len(parameter):
+                    grown = torch.zeros_like(parameter)
+                    grown[:len(value)] = value
+                    state[key] = grown
+
+
+def make_optimizers(model):
+    """
+    Returns:
+        Adam over dense parameters, and with `config.sparse_embedding`
+        SparseAdam over the embeddings (None otherwise). SparseAdam only reads
+        and writes the rows (and their moments) a minibatch looked up.
+    """
+    if not config.sparse_embedding:
+        return torch.optim.Adam(model.parameters(),
+                                lr=config.learning_rate), None
+    # modules() skips duplicates, the word embedding is shared by text encoders
+    sparse_parameters = [
+        module.weight for module in model.modules()
+        if isinstance(module, nn.Embedding) and module.sparse
+    ]
+    dense_parameters = [
+        parameter for parameter in model.parameters()
+        if all(parameter is not x for x in sparse_parameters)
+    ]
+    return (torch.optim.Adam(dense_parameters, lr=config.learning_rate),
+            torch.optim.SparseAdam(sparse_parameters, lr=config.learning_rate))
+
+
+def load_optimizer_state(optimizer, state_dict):
+    """
+    Load optimizer state saved in a checkpoint. A checkpoint saved with a
+    different `config.sparse_embedding` has state for other parameters, then
+    the optimizer starts with fresh state while the model is still resumed.
+    """
+    if state_dict is None:
+        print('No saved optimizer state, start with fresh state')
+        return
+    try:
+        optimizer.load_state_dict(state_dict)
+    except ValueError as error:
+        print(f"Saved optimizer state doesn't match, start with fresh state: {error}")
+        return
+    grow_optimizer_state(optimizer)
+
+
+def get_autocast_dtype():
+    """
+    Returns:
+        torch dtype for autocast from `config.autocast_dtype`, or None for fp32.
+        float16 needs loss scaling, which is CUDA only, so CPU uses bfloat16.
+    """
+    if config.autocast_dtype is None:
         return None
-    return os.path.join(directory,
-                        all_checkpoints[max(all_checkpoints.keys())])
+    dtype = getattr(torch, config.autocast_dtype)
+    if device.type == 'cpu' and dtype == torch.float16:
+        print('float16 autocast needs CUDA, use bfloat16 instead')
+        return torch.bfloat16
+    if device.type == 'cuda' and dtype == torch.bfloat16 and not torch.cuda.is_bf16_supported():
+        print('bfloat16 is not supported by the GPU, use float16 instead')
+        return torch.float16
+    return dtype
+
+
+def make_grad_scaler(autocast_dtype):
+    """
+    Loss scaling is only enabled for float16, otherwise the scaler passes
+    losses and optimizer steps through.
+    """
+    return torch.amp.GradScaler('cuda',
+                                enabled=autocast_dtype == torch.float16)
+
+
+def train_step(forward_model, minibatch, criterion, optimizers, scaler,
+               autocast_dtype, profiler):
+    """
+    Forward, backward and optimizer step of a minibatch, each timed as a
+    phase of `profiler`. Benchmarks take their steps with this as well.
+    Args:
+        forward_model: model (or its DistributedDataParallel), for Exp1 the
+            list of models
+        optimizers: list of optimizers to step, e.g. Adam and SparseAdam
+        scaler: see `make_grad_scaler`
+        autocast_dtype: see `get_autocast_dtype`
+        profiler: TrainingProfiler
+    Returns:
+        loss
+    """
+    # Row indices stay on CPU with a pinned news table, which is gathered
+    # there and copied in forward
+    if config.news_table != 'pinned':
+        with profiler.phase('host_to_device'):
+            minibatch = to_device(minibatch, device)
+
+    with profiler.phase('forward'), torch.autocast(
+            device.type,
+            dtype=autocast_dtype,
+            enabled=autocast_dtype is not None):
+        if model_name == 'LSTUR':
+            y_pred = forward_model(minibatch["user"], minibatch["clicked_news_length"],
+                           minibatch["candidate_news"],
+                           minibatch["clicked_news"])
+        elif model_name == 'HiFiArk':
+            y_pred, regularizer_loss = forward_model(minibatch["candidate_news"],
+                                             minibatch["clicked_news"])
+        elif model_name == 'TANR':
+            y_pred, topic_classification_loss = forward_model(
+                minibatch["candidate_news"], minibatch["clicked_news"])
+        elif model_name == 'Exp1':
+            y_preds = [
+                model(minibatch["candidate_news"], minibatch["clicked_news"])
+                for model in forward_model
+            ]
+            y_pred_averaged = torch.stack(
+                [F.softmax(y_pred, dim=1) for y_pred in y_preds],
+                dim=-1).mean(dim=-1)
+            y_pred = torch.log(y_pred_averaged)
+        else:
+            y_pred = forward_model(minibatch["candidate_news"],
+                           minibatch["clicked_news"],
+                           minibatch.get("candidate_news_id"),
+                           minibatch.get("user"))
+
+        y = torch.zeros(len(y_pred)).long().to(device)
+        loss = criterion(y_pred, y)
+
+    with profiler.phase('backward'):
+        for optimizer in optimizers:
+            optimizer.zero_grad()
+        scaler.scale(loss).backward()
+    with profiler.phase('optimizer'):
+        for optimizer in optimizers:
+            scaler.step(optimizer)
+        scaler.update()
+    return loss
+
+
+def compile_module(module):
+    """
+    torch.compile module in place, so state dict keys don't change.
+    Parts dynamo can't compile run eagerly instead of failing.
+    """
+    try:
+        import torch._dynamo
+        torch._dynamo.config.suppress_errors = True
+        module.compile()
+    except Exception as error:
+        print(f"Compile failed, run eagerly: {error}")
+
+
+def broadcast_flag(flag):
+    """
+    Rank 0 decides, e.g. on early stopping, every rank follows.
+    """
+    flag = torch.tensor([int(flag)])
+    dist.broadcast(flag, src=0)
+    return bool(flag.item())
 
 
 def train():
+    # Data parallel when launched by torchrun with more than one process,
+    # only rank 0 validates, checkpoints and decides on early stopping
+    distributed = int(os.environ.get('WORLD_SIZE', 1)) > 1
+    if distributed:
+        # Other ranks wait for rank 0 while it validates
+        dist.init_process_group(config.distributed_backend,
+                                timeout=datetime.timedelta(hours=2))
+    rank = dist.get_rank() if distributed else 0
+    world_size = dist.get_world_size() if distributed else 1
+
     if not os.path.exists('checkpoint'):
         os.makedirs('checkpoint')   
 
     try:
+        pretrained_word_embedding = np.load(
+            './data/train/pretrained_word_embedding.npy')
+        if len(pretrained_word_embedding) < config.num_words:
+            # Words appended to the vocabulary since, same rows as prediction
+            from data_preprocess import word_embedding_rows
+            pretrained_word_embedding = np.concatenate([
+                pretrained_word_embedding,
+                word_embedding_rows(config.word_embedding_source,
+                                    './data/train/word2int.tsv',
+                                    len(pretrained_word_embedding))
+            ])
         pretrained_word_embedding = torch.from_numpy(
-            np.load('./data/train/pretrained_word_embedding.npy')).float()
+            pretrained_word_embedding).float()
     except FileNotFoundError:
         pretrained_word_embedding = None
 
@@ -100,27 +282,55 @@ def train():
     else:
         model = Model(config, pretrained_word_embedding).to(device)
 
-    if model_name != 'Exp1':
-        print(model)
+    if rank == 0:
+        print(model if model_name != 'Exp1' else models[0])
+
+    # Pre-collated minibatches if compiled, streamed with their own shuffle,
+    # otherwise each rank samples its shard of BaseDataset
+    if ShardDataset.exists(config.training_shards):
+        dataset = ShardDataset(config.training_shards,
+                               'data/train/news_parsed.tsv',
+                               config.shuffle_seed, world_size, rank)
+        sampler = dataset
+        if rank == 0:
+            print(f"Load training shards with {dataset.num_batches} batches.")
     else:
-        print(models[0])
+        dataset = BaseDataset('data/train/behaviors_parsed.tsv',
+                              'data/train/news_parsed.tsv')
+        sampler = ResumableSampler(dataset, config.shuffle_seed, world_size,
+                                   rank)
+        if rank == 0:
+            print(f"Load training dataset with size {len(dataset)}.")
+
+    if config.news_table is not None and (
+            sampler is dataset or dataset.behaviors_packed is not None):
+        model.set_news_table(dataset.news_store, config.news_table)
 
-    dataset = BaseDataset('data/train/behaviors_parsed.tsv',
-                          'data/train/news_parsed.tsv')
+    if config.compile_model is not None and model_name != 'Exp1':
+        compile_module(model if config.compile_model ==
+                       'model' else model.news_encoder)
+    autocast_dtype = get_autocast_dtype()
+    scaler = make_grad_scaler(autocast_dtype)
 
-    print(f"Load training dataset with size {len(dataset)}.")
+    # Each rank gets its own shard and its own workers
+    def make_dataloader():
+        if sampler is dataset:
+            return iter(
+                DataLoader(dataset,
+                           batch_size=None,
+                           num_workers=config.num_workers,
+                           pin_memory=True))
+        return iter(
+            DataLoader(dataset,
+                       batch_size=config.batch_size, # 128
+                       sampler=sampler,
+                       num_workers=config.num_workers,
+                       drop_last=True,
+                       pin_memory=True))
 
-    dataloader = iter(
-        DataLoader(dataset,
-                   batch_size=config.batch_size, # 128
-                   shuffle=True,
-                   num_workers=config.num_workers,
-                   drop_last=True,
-                   pin_memory=True))
     if model_name != 'Exp1':
         criterion = nn.CrossEntropyLoss()
-        optimizer = torch.optim.Adam(model.parameters(),
-                                     lr=config.learning_rate)
+        optimizer, sparse_optimizer = make_optimizers(model)
     else:
         criterion = nn.NLLLoss()
         optimizers = [
@@ -137,14 +347,27 @@ def train():
     Path(checkpoint_dir).mkdir(parents=True, exist_ok=True)
 
     checkpoint_path = latest_checkpoint(checkpoint_dir)
+    # Only rank 0 saves
+    checkpoint_writer = CheckpointWriter(
+        checkpoint_dir, config.checkpoint_keep_last,
+        config.checkpoint_keep_best) if rank == 0 else None
     if checkpoint_path is not None:
-        print(f"Load saved parameters in {checkpoint_path}")
-        checkpoint = torch.load(checkpoint_path)
+        if rank == 0:
+            print(f"Load saved parameters in {checkpoint_path}")
+        checkpoint = load_checkpoint(checkpoint_path)
         early_stopping(checkpoint['early_stop_value'])
         step = checkpoint['step']
+        if 'sampler_state_dict' in checkpoint:
+            sampler.load_state_dict(checkpoint['sampler_state_dict'])
+            exhaustion_count = sampler.epoch
         if model_name != 'Exp1':
             model.load_state_dict(checkpoint['model_state_dict'])
-            optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+            load_optimizer_state(optimizer,
+                                 checkpoint['optimizer_state_dict'])
+            if sparse_optimizer is not None:
+                load_optimizer_state(
+                    sparse_optimizer,
+                    checkpoint.get('sparse_optimizer_state_dict'))
             model.train()
         else:
             for model in models:
@@ -153,87 +376,88 @@ def train():
             for optimizer in optimizers:
                 optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
 
-    for i in tqdm(range(
-            1,
-            config.num_epochs * len(dataset) // config.batch_size + 1),
-                  desc="Training"):
-        
-        print('batch', i)
-        try:
-            minibatch = next(dataloader)
-        except StopIteration:
-            exhaustion_count += 1
-            tqdm.write(
-                f"Training data exhausted for {exhaustion_count} times after {i} batches, reuse the dataset."
-            )
-            dataloader = iter(
-                DataLoader(dataset,
-                           batch_size=config.batch_size,
-                           shuffle=True,
-                           num_workers=config.num_workers,
-                           drop_last=True,
-                           pin_memory=True))
-            minibatch = next(dataloader)
+    # Called for forward, the rest (evaluation, checkpoints) use model itself
+    if model_name != 'Exp1':
+        forward_model = DistributedDataParallel(
+            model) if distributed else model
+        optimizers = [
+            x for x in [optimizer, sparse_optimizer] if x is not None
+        ]
+    else:
+        forward_model = models
 
-        step += 1
-        if model_name == 'LSTUR':
-            y_pred = model(minibatch["user"], minibatch["clicked_news_length"],
-                           minibatch["candidate_news"],
-                           minibatch["clicked_news"])
-        elif model_name == 'HiFiArk':
-            y_pred, regularizer_loss = model(minibatch["candidate_news"],
-                                             minibatch["clicked_news"])
-        elif model_name == 'TANR':
-            y_pred, topic_classification_loss = model(
-                minibatch["candidate_news"], minibatch["clicked_news"])
-        elif model_name == 'Exp1':
-            y_preds = [
-                model(minibatch["candidate_news"], minibatch["clicked_news"])
-                for model in models
-            ]
-            y_pred_averaged = torch.stack(
-                [F.softmax(y_pred, dim=1) for y_pred in y_preds],
-                dim=-1).mean(dim=-1)
-            y_pred = torch.log(y_pred_averaged)
-        else:
-            y_pred = model(minibatch["candidate_news"],
-                           minibatch["clicked_news"])
+    # Only rank 0 writes to TensorBoard
+    writer = SummaryWriter(log_dir=f"./runs/{model_name}/{datetime.datetime.now().replace(microsecond=0).isoformat()}{'-' + os.environ['REMARK'] if 'REMARK' in os.environ else ''}") if rank == 0 else None
+    profiler = TrainingProfiler(writer, device,
+                                config.synchronize_step_timing,
+                                config.profile_batches,
+                                config.num_batches_profile,
+                                num_replicas=world_size)
 
-        y = torch.zeros(len(y_pred)).long().to(device)
-        loss = criterion(y_pred, y)
+    # Parsed once, validation passes only encode and score
+    validation_data = EvaluationData(
+        './data/val', config.num_impressions_validate) if rank == 0 else None
 
-        for optimizer in optimizers:
-            optimizer.zero_grad()
-        loss.backward()
-        if model_name != 'Exp1':
-            optimizer.step()
-        else:
-            for optimizer in optimizers:
-                optimizer.step()
-
-        if i % config.num_batches_show_loss == 0:
-            tqdm.write(
-                f"Time {time_since(start_time)}, batches {i}, current loss {loss.item():.4f}, average loss: {np.mean(loss_full):.4f}, latest average loss: {np.mean(loss_full[-256:]):.4f}"
-            )
-
-        if i % config.num_batches_validate == 0:
-            (model if model_name != 'Exp1' else models[0]).eval()
-            val_auc, val_mrr, val_ndcg5, val_ndcg10 = evaluate(
-                model if model_name != 'Exp1' else models[0], './data/val',
-                config.num_workers, 200000)
-            (model if model_name != 'Exp1' else models[0]).train()
-            tqdm.write(
-                f"Time {time_since(start_time)}, batches {i}, validation AUC: {val_auc:.4f}, validation MRR: {val_mrr:.4f}, validation nDCG@5: {val_ndcg5:.4f}, validation nDCG@10: {val_ndcg10:.4f}, "
-            )
-
-            early_stop, get_better = early_stopping(-val_auc)
-            if early_stop:
-                tqdm.write('Early stop.')
-                break
-            elif get_better:
+    # Closed on errors too, so a checkpoint being written still completes
+    try:
+        # Resumed training starts where the checkpoint was saved
+        dataloader = make_dataloader()
+        num_batches = config.num_epochs * sampler.num_samples // config.batch_size
+        for i in tqdm(range(step + 1, num_batches + 1),
+                      desc="Training",
+                      initial=step,
+                      total=num_batches,
+                      disable=rank != 0):
+            profiler.start_step(i)
+            with profiler.phase('data_wait'):
                 try:
-                    torch.save(
-                        {
+                    minibatch = next(dataloader)
+                except StopIteration:
+                    exhaustion_count += 1
+                    tqdm.write(
+                        f"Training data exhausted for {exhaustion_count} times after {i} batches, reuse the dataset."
+                    )
+                    sampler.set_epoch(exhaustion_count)
+                    dataloader = make_dataloader()
+                    minibatch = next(dataloader)
+            sampler.position += config.batch_size
+
+            step += 1
+            loss = train_step(forward_model, minibatch, criterion, optimizers,
+                              scaler, autocast_dtype, profiler)
+            profiler.end_step(i, config.batch_size)
+
+            if i % config.num_batches_show_loss == 0 and rank == 0:
+                samples_per_second = profiler.log(step)
+                writer.add_scalar('Train/Loss', loss.item(), step)
+                tqdm.write(
+                    f"Time {time_since(start_time)}, batches {i}, current loss {loss.item():.4f}, average loss: {np.mean(loss_full):.4f}, latest average loss: {np.mean(loss_full[-256:]):.4f}, {samples_per_second:.1f} samples/sec"
+                )
+
+            if i % config.num_batches_validate == 0:
+                early_stop = False
+                if rank == 0:
+                    (model if model_name != 'Exp1' else models[0]).eval()
+                    val_auc, val_mrr, val_ndcg5, val_ndcg10 = evaluate(
+                        model if model_name != 'Exp1' else models[0], './data/val',
+                        config.num_workers, config.num_impressions_validate,
+                        validation_data)
+                    (model if model_name != 'Exp1' else models[0]).train()
+                    writer.add_scalar('Validation/AUC', val_auc, step)
+                    writer.add_scalar('Validation/MRR', val_mrr, step)
+                    writer.add_scalar('Validation/nDCG@5', val_ndcg5, step)
+                    writer.add_scalar('Validation/nDCG@10', val_ndcg10, step)
+                    tqdm.write(
+                        f"Time {time_since(start_time)}, batches {i}, validation AUC: {val_auc:.4f}, validation MRR: {val_mrr:.4f}, validation nDCG@5: {val_ndcg5:.4f}, validation nDCG@10: {val_ndcg10:.4f}, "
+                    )
+                    # Validation time doesn't count towards training throughput
+                    profiler.reset()
+
+                    early_stop, get_better = early_stopping(-val_auc)
+                    if get_better:
+                        # Only plain Python types and tensors, numpy scalars
+                        # can't be loaded by `torch.load` with weights_only
+                        checkpoint = {
                             'model_state_dict': (model if model_name != 'Exp1'
                                                  else models[0]).state_dict(),
                             'optimizer_state_dict':
@@ -242,10 +466,35 @@ def train():
                             'step':
                             step,
                             'early_stop_value':
-                            -val_auc
-                        }, f"./checkpoint/{model_name}/ckpt-{step}.pth")
-                except OSError as error:
-                    print(f"OS error: {error}")
+                            float(-val_auc),
+                            'sampler_state_dict':
+                            sampler.state_dict()
+                        }
+                        if model_name != 'Exp1' and sparse_optimizer is not None:
+                            checkpoint['sparse_optimizer_state_dict'] = (
+                                sparse_optimizer.state_dict())
+                        # Written in the background, training goes on meanwhile
+                        checkpoint_writer.save(
+                            checkpoint, step, {
+                                'auc': float(val_auc),
+                                'mrr': float(val_mrr),
+                                'ndcg5': float(val_ndcg5),
+                                'ndcg10': float(val_ndcg10)
+                            })
+                if distributed:
+                    early_stop = broadcast_flag(early_stop)
+                if early_stop:
+                    if rank == 0:
+                        tqdm.write('Early stop.')
+                    break
+    finally:
+        profiler.close()
+        if writer is not None:
+            writer.close()
+        if checkpoint_writer is not None:
+            checkpoint_writer.close()
+    if distributed:
+        dist.destroy_process_group()
 
 
 def time_since(since):
@@ -0,0 +1,76 @@
+import pandas as pd
+from os import path
+
+
+class Vocabulary():
+    """
+    Persistent str -> int mapping saved as a two-column tsv, e.g. word2int.tsv.
+    Ids are stable: new keys are only ever appended after the existing ones.
+    0 is reserved for padding and unknown keys.
+    """
+    def __init__(self, file_path, column):
+        self.file_path = file_path
+        self.column = column
+        try:
+            # na_filter=False is needed since nan is also a valid word, and
+            # keys like "2020" must stay str rather than become int
+            vocabulary = pd.read_table(file_path,
+                                       na_filter=False,
+                                       dtype={column: str})
+            self.key2int = dict(
+                zip(vocabulary[column].tolist(),
+                    vocabulary['int'].astype(int).tolist()))
+        except FileNotFoundError:
+            self.key2int = {}
+
+    def __len__(self):
+        """
+        Number of ids, including 0 for padding.
+        """
+        return len(self.key2int) + 1
+
+    def add(self, keys):
+        """
+        Append keys not in the vocabulary yet, in the given order.
+        Returns:
+            number of keys added
+        """
+        size = len(self.key2int)
+        for key in keys:
+            if key not in self.key2int:
+                self.key2int[key] = len(self.key2int) + 1
+        return len(self.key2int) - size
+
+    def save(self):
+        pd.DataFrame(self.key2int.items(),
+                     columns=[self.column, 'int']).to_csv(self.file_path,
+                                                          sep='\t',
+                                                          index=False)
+
+
+def vocab_manifest_path(word2int_path):
+    """
+    The manifest lives next to word2int.tsv.
+    """
+    return path.join(path.dirname(word2int_path), 'vocab.json')
+
+
+def save_vocab_manifest(word2int, category2int):
+    """
+    Record vocabulary sizes (including padding) for `config` and the model.
+    Args:
+        word2int, category2int: Vocabulary
+    """
+    pd.Series({
+        'num_words': len(word2int),
+        'num_categories': len(category2int)
+    }).to_json(vocab_manifest_path(word2int.file_path))
+
+
+def load_vocab_manifest(word2int_path):
+    """
+    Returns:
+        {'num_words': int, 'num_categories': int}
+    """
+    return pd.read_json(vocab_manifest_path(word2int_path),
+                        typ='series').to_dict()
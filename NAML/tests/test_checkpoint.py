@@ -0,0 +1,35 @@
+import pickle
+
+import pytest
+import torch
+
+from checkpoint import CheckpointWriter, latest_checkpoint
+
+
+def test_write_error_is_raised_by_the_next_save(tmp_path):
+    writer = CheckpointWriter(str(tmp_path))
+    # torch.save can't pickle a lambda
+    writer.save({'step': lambda: 1}, 1, {'auc': 0.5})
+    with pytest.raises((AttributeError, pickle.PicklingError)):
+        writer.wait()
+    writer.save({'step': 2}, 2, {'auc': 0.6})
+    writer.close()
+    assert latest_checkpoint(str(tmp_path)) == str(tmp_path / 'ckpt-2.pth')
+
+
+def test_write_error_is_raised_by_close(tmp_path):
+    writer = CheckpointWriter(str(tmp_path))
+    writer.save({'step': lambda: 1}, 1, {'auc': 0.5})
+    with pytest.raises((AttributeError, pickle.PicklingError)):
+        writer.close()
+    assert latest_checkpoint(str(tmp_path)) is None
+
+
+def test_keep_last_and_best(tmp_path):
+    writer = CheckpointWriter(str(tmp_path), keep_last=1, keep_best=1)
+    for step, auc in [(1, 0.7), (2, 0.5), (3, 0.6)]:
+        writer.save({'weight': torch.full((2, ), step)}, step, {'auc': auc})
+    writer.close()
+    assert sorted(x.name for x in tmp_path.glob('ckpt-*')) == [
+        'ckpt-1.pth', 'ckpt-3.pth'
+    ]
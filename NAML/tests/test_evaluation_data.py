@@ -0,0 +1,72 @@
+import shutil
+
+import numpy as np
+import pytest
+
+import evaluate
+from data_preprocess import save_parsed_news
+from evaluate import EvaluationData
+from news_store import news_store_directory
+
+# News rows: N3 1, N1 2, N2 3, N5 4, N4 5
+news_ids = ['N3', 'N1', 'N2', 'N5', 'N4']
+behaviors = [
+    '1\tU1\t11/15/2019 8:55:22 AM\tN1 N2\tN3-1 N4-0',
+    # No history, unknown candidate N9
+    '2\tU2\t11/15/2019 8:55:22 AM\t\tN2-0 N9-1 N1-0',
+    '3\tU1\t11/15/2019 8:55:22 AM\tN1 N2\tN4-1',
+    # Unknown user, history longer than num_clicked_news_a_user
+    '4\tU3\t11/15/2019 8:55:22 AM\tN5 N1 N2 N3 N4\tN1-0 N2-1',
+]
+
+
+@pytest.fixture(params=['store', 'tsv'])
+def directory(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(evaluate.config, 'num_clicked_news_a_user', 3)
+    save_parsed_news(str(tmp_path / 'news_parsed.tsv'), np.array(news_ids),
+                     np.arange(1, 6), np.ones((5, 2), dtype=np.int32),
+                     np.ones((5, 3), dtype=np.int32))
+    if request.param == 'tsv':
+        shutil.rmtree(news_store_directory(str(tmp_path / 'news_parsed.tsv')))
+    (tmp_path / 'behaviors.tsv').write_text('\n'.join(behaviors) + '\n')
+    (tmp_path / 'user2int.tsv').write_text('user\tint\nU1\t1\nU2\t2\n')
+    return str(tmp_path)
+
+
+def load(directory, **kwargs):
+    return EvaluationData(directory,
+                          user2int_path=f'{directory}/user2int.tsv',
+                          **kwargs)
+
+
+def test_offsets_rows_and_histories(directory):
+    data = load(directory)
+    assert len(data) == 4
+    assert data.offsets.tolist() == [0, 2, 5, 6, 8]
+    assert data.candidate_news.tolist() == [1, 5, 3, 0, 2, 5, 2, 3]
+    assert data.clicked.tolist() == [1, 0, 0, 1, 0, 1, 0, 1]
+    # Impressions with the same history share its row
+    assert data.history.tolist() == [0, 1, 0, 2]
+    assert data.user.tolist() == [1, 2, 0]
+    assert data.clicked_news.tolist() == [[0, 2, 3], [0, 0, 0], [4, 2, 3]]
+    assert data.clicked_news_length.tolist() == [2, 0, 3]
+
+
+def test_max_count(directory):
+    data = load(directory, max_count=3)
+    assert data.offsets.tolist() == [0, 2, 5]
+    assert data.candidate_news.tolist() == [1, 5, 3, 0, 2]
+
+
+def test_chunks_cover_the_same_impressions(directory):
+    chunks = [(chunk.offsets.copy(), chunk.candidate_news.copy(),
+               chunk.clicked.copy())
+              for chunk in load(directory, chunk_size=3).chunks()]
+    assert [len(offsets) - 1 for offsets, _, _ in chunks] == [3, 1]
+    assert chunks[1][0].tolist() == [0, 2]
+    assert np.concatenate([x for _, x, _ in chunks]).tolist() == [
+        1, 5, 3, 0, 2, 5, 2, 3
+    ]
+    assert np.concatenate([x for _, _, x in chunks]).tolist() == [
+        1, 0, 0, 1, 0, 1, 0, 1
+    ]
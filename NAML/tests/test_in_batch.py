@@ -0,0 +1,47 @@
+import torch
+
+from model.general.click_predictor.dot_product import DotProductClickPredictor
+
+# Positive first, samples 0 and 1 are of the same user
+candidate_news = torch.tensor([[10, 11], [12, 10], [11, 13]])
+user = torch.tensor([7, 7, 8])
+
+
+def scores(*args):
+    torch.manual_seed(0)
+    candidate_news_vector = torch.randn(3, 2, 4)
+    user_vector = torch.randn(3, 4)
+    predictor = DotProductClickPredictor()
+    return (predictor.in_batch(candidate_news_vector, user_vector, *args),
+            predictor(candidate_news_vector, user_vector))
+
+
+def test_own_candidates_come_first():
+    probability, expected = scores(candidate_news, user)
+    assert probability.shape == (3, 6)
+    assert torch.allclose(probability[:, :2], expected)
+
+
+def test_positives_of_the_same_user_are_masked():
+    probability, _ = scores(candidate_news, user)
+    # Sample 0 sees [10, 11], then [12, 10] of sample 1, then [11, 13].
+    # 12 and 10 are positives of user 7, 11 is only the positive of user 8
+    assert torch.isinf(probability).tolist() == [
+        [False, False, True, True, False, False],
+        [False, False, False, False, True, False],
+        [False, False, False, True, False, False],
+    ]
+
+
+def test_without_users_only_own_positive_is_masked():
+    probability, _ = scores(candidate_news)
+    assert torch.isinf(probability).tolist() == [
+        [False, False, False, True, False, False],
+        [False, False, False, False, False, False],
+        [False, False, False, True, False, False],
+    ]
+
+
+def test_without_ids_nothing_is_masked():
+    probability, _ = scores()
+    assert not torch.isinf(probability).any()
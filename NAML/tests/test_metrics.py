@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from evaluate import calculate_single_user_metric
+from metrics import RunningMetrics, impression_metrics
+
+
+def stack(auc, mrr, ndcg):
+    return np.stack([auc, mrr, ndcg[5], ndcg[10]], axis=1)
+
+
+def test_same_as_per_impression_metrics():
+    rng = np.random.default_rng(0)
+    offsets = np.r_[0, np.cumsum(rng.integers(2, 30, size=200))]
+    y_true = (rng.random(offsets[-1]) < 0.2).astype(np.int8)
+    # Distinct scores, the per-impression argsort breaks ties arbitrarily
+    y_score = rng.permutation(offsets[-1]) / offsets[-1]
+    result = stack(*impression_metrics(y_true, y_score, offsets))
+
+    for i in range(len(offsets) - 1):
+        labels = y_true[offsets[i]:offsets[i + 1]]
+        if labels.min() == labels.max():
+            assert np.isnan(result[i]).all()
+        else:
+            assert result[i] == pytest.approx(
+                calculate_single_user_metric(
+                    (labels.astype(np.int64),
+                     y_score[offsets[i]:offsets[i + 1]])))
+
+
+def test_ties():
+    auc, mrr, ndcg = impression_metrics([1, 0, 0, 0], [0.5, 0.5, 0.5, 0.1],
+                                        [0, 4])
+    # Half of the tied negatives rank above the positive
+    assert auc[0] == pytest.approx(2 / 3)
+    # The later of tied candidates ranks first
+    assert mrr[0] == pytest.approx(1 / 3)
+    assert ndcg[5][0] == pytest.approx(1 / np.log2(4))
+
+
+@pytest.mark.parametrize('y_true', [[1, 1, 1], [0, 0, 0]])
+def test_single_class_impressions_are_nan(y_true):
+    auc, mrr, ndcg = impression_metrics(y_true + [1, 0], [0.3, 0.2, 0.1, 1, 0],
+                                        [0, 3, 5])
+    assert np.isnan(stack(auc, mrr, ndcg)[0]).all()
+    assert stack(auc, mrr, ndcg)[1] == pytest.approx([1, 1, 1, 1])
+
+    metrics = RunningMetrics()
+    metrics.update(np.array(y_true + [1, 0]), np.array([0.3, 0.2, 0.1, 1, 0]),
+                   np.array([0, 3, 5]))
+    assert metrics.count == 1
+    assert metrics.result() == pytest.approx((1, 1, 1, 1))
+
+
+@pytest.mark.parametrize('offsets', [[], [0], [0, 0, 0]])
+def test_no_candidates(offsets):
+    auc, mrr, ndcg = impression_metrics(np.zeros(0), np.zeros(0), offsets)
+    num_impressions = max(len(offsets) - 1, 0)
+    assert stack(auc, mrr, ndcg).shape == (num_impressions, 4)
+    assert np.isnan(stack(auc, mrr, ndcg)).all()
+
+    metrics = RunningMetrics()
+    metrics.update(np.zeros(0), np.zeros(0), np.array(offsets))
+    assert metrics.count == 0
+    assert np.isnan(metrics.result()).all()
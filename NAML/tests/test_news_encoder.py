@@ -0,0 +1,93 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from config import NAMLConfig
+from model.NAML import NAML
+
+
+class SmallConfig(NAMLConfig):
+    num_words = 30
+    num_categories = 5
+    word_embedding_dim = 8
+    category_embedding_dim = 6
+    num_filters = 12
+    query_vector_dim = 7
+    num_words_title = 5
+    num_words_abstract = 9
+    sparse_embedding = False
+
+
+def news(batch_size=4):
+    generator = torch.Generator().manual_seed(0)
+    return {
+        'category':
+        torch.randint(SmallConfig.num_categories, (batch_size, ),
+                      generator=generator),
+        'title':
+        torch.randint(SmallConfig.num_words,
+                      (batch_size, SmallConfig.num_words_title),
+                      generator=generator),
+        'abstract':
+        torch.randint(SmallConfig.num_words,
+                      (batch_size, SmallConfig.num_words_abstract),
+                      generator=generator)
+    }
+
+
+def test_conv1d_is_the_same_as_the_conv2d_module():
+    torch.manual_seed(0)
+    encoder = NAML(SmallConfig).news_encoder.text_encoders['title'].eval()
+    text = news()['title']
+    # batch_size, num_filters, num_words_title
+    convoluted = encoder.CNN(encoder.word_embedding(text).unsqueeze(
+        dim=1)).squeeze(dim=3)
+    expected = encoder.additive_attention(F.relu(convoluted).transpose(1, 2))
+    assert torch.allclose(encoder(text), expected, atol=1e-6)
+
+
+def test_encode_texts_is_the_same_as_each_text_encoder():
+    torch.manual_seed(0)
+    news_encoder = NAML(SmallConfig).news_encoder.eval()
+    texts = [news()[name] for name in news_encoder.text_encoders]
+    for vector, encoder, text in zip(news_encoder.encode_texts(texts),
+                                     news_encoder.text_encoders.values(),
+                                     texts):
+        assert torch.allclose(vector, encoder(text), atol=1e-6)
+
+
+class GrownConfig(SmallConfig):
+    num_words = SmallConfig.num_words + 3
+    num_categories = SmallConfig.num_categories + 2
+
+
+@pytest.mark.parametrize('pretrained', [False, True])
+def test_grow_embeddings_of_an_older_checkpoint(pretrained):
+    torch.manual_seed(0)
+    saved = NAML(SmallConfig).state_dict()
+    pretrained_word_embedding = torch.randn(GrownConfig.num_words,
+                                            GrownConfig.word_embedding_dim)
+    model = NAML(GrownConfig,
+                 pretrained_word_embedding if pretrained else None)
+    model.load_state_dict(saved)
+
+    word_embedding = model.news_encoder.text_encoders['title'].word_embedding
+    assert word_embedding is model.news_encoder.text_encoders[
+        'abstract'].word_embedding
+    saved_word_embedding = next(value for key, value in saved.items()
+                                if key.endswith('word_embedding.weight'))
+    num_saved = SmallConfig.num_words
+    assert torch.equal(word_embedding.weight[:num_saved],
+                       saved_word_embedding)
+    # Appended words keep their pretrained rows, otherwise zeros
+    assert torch.equal(
+        word_embedding.weight[num_saved:],
+        pretrained_word_embedding[num_saved:]
+        if pretrained else torch.zeros(3, GrownConfig.word_embedding_dim))
+
+    category_embedding = model.news_encoder.element_encoders[
+        'category'].embedding.weight
+    assert torch.equal(category_embedding[SmallConfig.num_categories:],
+                       torch.zeros(2, GrownConfig.category_embedding_dim))
+    model.eval()
+    assert model.news_encoder(news()).shape == (4, GrownConfig.num_filters)
@@ -0,0 +1,30 @@
+import numpy as np
+
+from news_store import NewsStore, write_news_store
+
+
+def test_rows_by_id_and_padding_row(tmp_path):
+    ids = ['N3', 'N1', 'N2', 'N1', 'N4']
+    category = np.arange(1, 6)
+    title = np.arange(1, 11).reshape(5, 2)
+    abstract = np.arange(1, 16).reshape(5, 3)
+    write_news_store(str(tmp_path), ids, category, title, abstract)
+
+    store = NewsStore(str(tmp_path))
+    assert len(store) == 6
+    # Duplicated ids get their first row, unknown ids and '' the padding row
+    assert store.rows(['N4', 'N1', 'N3', 'N9', '']).tolist() == [5, 2, 1, 0, 0]
+    assert store.rows([]).tolist() == []
+
+    news = store.get(store.rows(['N2', 'N9']), ['category', 'title', 'abstract'])
+    assert news['category'].tolist() == [3, 0]
+    assert news['title'].tolist() == [[5, 6], [0, 0]]
+    assert news['abstract'].tolist() == [[7, 8, 9], [0, 0, 0]]
+
+
+def test_empty_store(tmp_path):
+    write_news_store(str(tmp_path), [], np.zeros(0), np.zeros((0, 2)),
+                     np.zeros((0, 3)))
+    store = NewsStore(str(tmp_path))
+    assert len(store) == 1
+    assert store.rows(['N1']).tolist() == [0]
@@ -0,0 +1,66 @@
+import filecmp
+
+import pandas as pd
+import pytest
+
+from benchmark.synthetic import write_behaviors
+from data_preprocess import config, parse_behaviors
+
+
+@pytest.fixture
+def source(tmp_path):
+    file_path = str(tmp_path / 'behaviors.tsv')
+    write_behaviors(file_path, 300, 50, 200, max_impressions=30,
+                    click_rate=0.3)
+    return file_path
+
+
+def parse(source, name, **kwargs):
+    directory = source.rsplit('/', 1)[0]
+    target = f'{directory}/{name}_parsed.tsv'
+    user2int_path = f'{directory}/{name}_user2int.tsv'
+    parse_behaviors(source, target, user2int_path, **kwargs)
+    return target, user2int_path
+
+
+@pytest.mark.parametrize('chunksize', [2, 7, 1000])
+def test_chunked_is_the_same_as_in_memory(source, chunksize):
+    in_memory = parse(source, 'in_memory', seed=0)
+    chunked = parse(source, 'chunked', chunksize=chunksize, seed=0)
+    for x, y in zip(in_memory, chunked):
+        assert filecmp.cmp(x, y, shallow=False)
+
+
+def test_same_seed_gives_the_same_output(source):
+    first = parse(source, 'first', seed=1)
+    second = parse(source, 'second', seed=1)
+    other = parse(source, 'other', seed=2)
+    assert filecmp.cmp(first[0], second[0], shallow=False)
+    assert not filecmp.cmp(first[0], other[0], shallow=False)
+    assert filecmp.cmp(first[1], other[1], shallow=False)
+
+
+def test_pairs_are_a_positive_and_negatives_of_the_impression(source):
+    parsed = pd.read_table(parse(source, 'parsed', seed=0)[0])
+    behaviors = pd.read_table(source, header=None)
+    user2int = {
+        user: i + 1
+        for i, user in enumerate(behaviors[1].drop_duplicates())
+    }
+    K = config.negative_sampling_ratio
+    assert (parsed.clicked == ' '.join(['1'] + ['0'] * K)).all()
+
+    rows = iter(parsed.itertuples())
+    for user, impressions in zip(behaviors[1], behaviors[4].str.split()):
+        positive = [x[:-2] for x in impressions if x.endswith('1')]
+        negative = [x[:-2] for x in impressions if x.endswith('0')]
+        sampled = []
+        for j in range(min(len(positive), len(negative) // K)):
+            row = next(rows)
+            assert row.user == user2int[user]
+            candidates = row.candidate_news.split()
+            assert candidates[0] == positive[j]
+            sampled += candidates[1:]
+        for news in set(sampled):
+            assert sampled.count(news) <= negative.count(news)
+    assert next(rows, None) is None
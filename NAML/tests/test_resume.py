@@ -0,0 +1,61 @@
+from os import path
+
+import numpy as np
+import torch
+
+from benchmark.synthetic import generate
+from checkpoint import latest_checkpoint, load_checkpoint
+
+
+def test_training_resumes_from_its_checkpoint(tmp_path, monkeypatch, capsys):
+    import train
+    from dataset import ResumableSampler
+    monkeypatch.chdir(tmp_path)
+    manifest = generate(str(tmp_path),
+                        num_news=200,
+                        num_users=20,
+                        num_impressions=(40, 10))
+    for key, value in dict(manifest,
+                           num_workers=0,
+                           num_epochs=1,
+                           batch_size=8,
+                           num_batches_show_loss=1000,
+                           num_batches_validate=2,
+                           word_embedding_dim=16,
+                           category_embedding_dim=16,
+                           num_filters=16,
+                           query_vector_dim=16,
+                           training_shards=None,
+                           news_table=None).items():
+        monkeypatch.setattr(train.config, key, value)
+
+    train.train()
+    checkpoint_path = latest_checkpoint(path.join('checkpoint',
+                                                  train.model_name))
+    # weights_only, the default of torch.load since 2.6
+    checkpoint = torch.load(checkpoint_path, weights_only=True)
+    assert type(checkpoint['early_stop_value']) is float
+    assert checkpoint['sampler_state_dict']['position'] > 0
+
+    loaded = []
+    load_state_dict = ResumableSampler.load_state_dict
+    monkeypatch.setattr(
+        ResumableSampler, 'load_state_dict',
+        lambda self, state_dict:
+        (loaded.append(state_dict), load_state_dict(self, state_dict)))
+    monkeypatch.setattr(train.config, 'num_epochs', 2)
+    capsys.readouterr()
+    train.train()
+    assert f'Load saved parameters in {checkpoint_path}' in capsys.readouterr(
+    ).out.replace('./', '')
+    assert loaded == [checkpoint['sampler_state_dict']]
+
+
+def test_load_checkpoint_with_numpy_scalars(tmp_path):
+    # As saved before the metrics in checkpoints were converted to float
+    file_path = str(tmp_path / 'ckpt-1.pth')
+    torch.save({'step': 1, 'early_stop_value': -np.float64(0.5)}, file_path)
+    assert load_checkpoint(file_path) == {
+        'step': 1,
+        'early_stop_value': -0.5
+    }
@@ -0,0 +1,33 @@
+import pytest
+
+from dataset import ResumableSampler
+
+
+@pytest.mark.parametrize('dataset_size, num_replicas', [(10, 3), (7, 4),
+                                                        (2, 3), (12, 4)])
+def test_ranks_cover_dataset_when_size_does_not_divide(dataset_size,
+                                                       num_replicas):
+    dataset = range(dataset_size)
+    samplers = [
+        ResumableSampler(dataset, seed=1, num_replicas=num_replicas, rank=rank)
+        for rank in range(num_replicas)
+    ]
+    shards = [list(sampler) for sampler in samplers]
+
+    num_samples = -(-dataset_size // num_replicas)
+    assert all(len(shard) == num_samples for shard in shards)
+    indices = sum(shards, [])
+    assert set(indices) == set(range(dataset_size))
+    # Only the padding repeats indices
+    assert len(indices) - len(set(indices)) == (num_samples * num_replicas -
+                                                dataset_size)
+
+
+def test_resume_continues_where_it_stopped():
+    sampler = ResumableSampler(range(10), seed=1, num_replicas=3, rank=2)
+    indices = list(sampler)
+    sampler.position = 2
+    resumed = ResumableSampler(range(10), seed=1, num_replicas=3, rank=2)
+    resumed.load_state_dict(sampler.state_dict())
+    assert list(resumed) == indices[2:]
+    assert len(resumed) == len(indices) - 2
@@ -0,0 +1,49 @@
+from os import path
+
+from data_preprocess import parse_news
+from vocab import Vocabulary, load_vocab_manifest
+
+
+def test_numeric_keys_keep_their_ids_after_reload(tmp_path):
+    file_path = str(tmp_path / 'word2int.tsv')
+    vocabulary = Vocabulary(file_path, 'word')
+    # Only numeric-looking keys, a column pandas would read as int
+    vocabulary.add(['1', '2020', '007', '1.5'])
+    vocabulary.save()
+
+    reloaded = Vocabulary(file_path, 'word')
+    assert reloaded.key2int == vocabulary.key2int
+    assert reloaded.add(['2020', '1', '007', '1.5']) == 0
+    assert reloaded.add(['2021']) == 1
+    assert reloaded.key2int['2021'] == 5
+
+
+def test_predict_appends_to_the_training_vocabulary(tmp_path):
+    header = 'id\tsource\tcategory\tsubcategory\turl\tdate\ttitle\tabstract\n'
+    train_dir = tmp_path / 'train'
+    train_dir.mkdir()
+    (tmp_path / 'news.tsv').write_text(header +
+                                       'N1\ts\tsports\ts\tu\td\tgoal 2020\t\n')
+    (tmp_path / 'predict.tsv').write_text(header +
+                                          'N2\ts\tweather\ts\tu\td\train 2020\t\n')
+    word2int_path = str(train_dir / 'word2int.tsv')
+    category2int_path = str(train_dir / 'category2int.tsv')
+    for source, mode in [('news.tsv', 'train'), ('predict.tsv', 'predict')]:
+        parse_news(str(tmp_path / source),
+                   str(tmp_path / f'{source}.parsed'), category2int_path,
+                   word2int_path, mode)
+
+    assert Vocabulary(word2int_path, 'word').key2int == {
+        'goal': 1,
+        '2020': 2,
+        'rain': 3
+    }
+    assert Vocabulary(category2int_path, 'category').key2int == {
+        'sports': 1,
+        'weather': 2
+    }
+    assert load_vocab_manifest(word2int_path) == {
+        'num_words': 4,
+        'num_categories': 3
+    }
+    assert path.exists(tmp_path / 'predict.tsv.parsed')